@@ -13,13 +13,16 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from config.manager import load_config, save_config, list_jobs, delete_job
-from config.constants import CONFIG_FILE, SCRIPT_DIR, TEMP_DIR
+from config.constants import CONFIG_FILE, SCRIPT_DIR, STATE_DIR, TEMP_DIR
 from core.dependencies import check_and_install_dependencies, remove_dependencies
 from core.remotes import manage_remotes
 from cron.scheduler import edit_cron_jobs, remove_cron_jobs
 from jobs.backup import create_backup_job
 from jobs.transfer import create_transfer
 from jobs.restore import restore_backup_job
+from jobs.runner import run_multiple_jobs
+from pipeline import watch
+from pipeline.workdir import sweep
 from utils.display import show_help, Colors
 from utils.matrix_ui import MatrixUI, MatrixColors
 from utils.commands import run_script, run_command
@@ -147,13 +150,24 @@ def rerun_job(config: dict) -> None:
         print(f"   {MatrixColors.DIM}Destination: {job['destination']}{MatrixColors.RESET}\n")
 
     try:
-        choice = int(input(f"{MatrixColors.CYBER_BLUE}Enter job number to rerun: {MatrixColors.RESET}").strip()) - 1
-        if choice < 0 or choice >= len(job_list):
+        answer = input(
+            f"{MatrixColors.CYBER_BLUE}Enter job number to rerun (several as 1,3,4 or 'all' to run concurrently): {MatrixColors.RESET}"
+        ).strip()
+        if answer.lower() == "all":
+            choices = list(range(len(job_list)))
+        else:
+            choices = [int(part) - 1 for part in answer.split(",")]
+        if any(choice < 0 or choice >= len(job_list) for choice in choices):
             MatrixUI.print_error("INVALID CHOICE", "Job number out of range")
             input("\nPress Enter to continue...")
             return
 
-        job_id = job_list[choice]
+        if len(choices) > 1:
+            run_multiple_jobs(config, [job_list[choice] for choice in choices])
+            input("\nPress Enter to continue...")
+            return
+
+        job_id = job_list[choices[0]]
         job_type = "transfer" if config[job_id].get("type") == "transfer" else "backup"
         script_path = SCRIPT_DIR / f"{job_type}_{job_id}.sh"
         
@@ -231,15 +245,18 @@ def clear_configurations() -> None:
     
     elif choice == "3":
         if confirm_action("Are you sure you want to clear ALL jobs?"):
+            for job_id in load_config():
+                watch.stop(STATE_DIR / job_id)
             if CONFIG_FILE.exists():
                 CONFIG_FILE.unlink()
                 MatrixUI.print_success("ALL JOBS CLEARED", "All job configurations removed")
             input("\nPress Enter to continue...")
     
     elif choice == "4":
-        if confirm_action("Clear all temporary files?"):
-            run_command(f"rm -rf {TEMP_DIR}/*", check=False)
-            MatrixUI.print_success("TEMP CLEARED", "Temporary files removed")
+        if confirm_action("Clear temporary files left by finished or crashed runs?"):
+            # Working directories of runs still in progress are kept
+            removed = sweep(TEMP_DIR)
+            MatrixUI.print_success("TEMP CLEARED", f"Removed {len(removed)} stale working directories")
         input("\nPress Enter to continue...")
 
 
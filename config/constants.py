@@ -6,14 +6,17 @@ Constants and global configurations for BackupBuddy.
 from pathlib import Path
 
 # Paths
+APP_DIR = Path(__file__).resolve().parent.parent
 CONFIG_FILE = Path.home() / ".backup_tool_jobs.json"
 SCRIPT_DIR = Path.home() / "backup_scripts"
 TEMP_DIR = Path("/var/tmp/backupbuddy_temp")
+STATE_DIR = Path.home() / ".backupbuddy_state"
+DIR_SIZE_CACHE = STATE_DIR / "dir_sizes.json.gz"
 DEPENDENCY_FLAG_FILE = Path.home() / ".backupbuddy_dependencies_checked"
 INSTALLED_PACKAGES_LOG = Path.home() / ".backupbuddy_installed_packages.log"
 
 # Dependencies
-DEPENDENCIES = ["curl", "pigz", "tar", "pv", "cron"]
+DEPENDENCIES = ["curl", "pigz", "zstd", "tar", "pv", "cron"]
 
 # Default rclone flags for backup
 DEFAULT_BACKUP_FLAGS = {
@@ -38,13 +41,66 @@ DEFAULT_TRANSFER_FLAGS = {
 JOB_DEFAULTS = {
     "encrypt": False,
     "compress": False,
+    "codec": "gzip",
     "compression_level": None,
     "split_files": False,
     "split_size": None,
-    "cores": 4
+    "cores": 4,
+    "stream_upload": False,
+    "upload_queue": 4,
+    "incremental": False,
+    "full_every": 7,
+    "dedup": False,
+    "skip_incompressible": False,
+    "zstd_long": False,
+    "shards": 0,
+    "content_index": False,
+    "restore_workers": 4,
+    "snapshots": False,
+    "keep_daily": 7,
+    "keep_weekly": 4,
+    "keep_monthly": 6,
+    "filters": {},
+    "watch": False,
+    "bundle": False,
+    "bundle_threshold": "1M",
+    "bundle_size": "64M",
+    "topup": False
 }
 
 # Compression defaults
 DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_ZSTD_LEVEL = 3
+# "auto" sizes compression threads at run time (affinity, cgroup quota, load)
+CORES_AUTO = "auto"
 DEFAULT_CORES = 4
 DEFAULT_SPLIT_SIZE = "100M"
+
+# Incremental backup defaults (full backup every N runs, 0 = never)
+DEFAULT_FULL_EVERY = 7
+TOMBSTONE_DIR = ".backupbuddy/tombstones"
+
+# Split-part upload defaults (parts allowed to wait on local disk)
+DEFAULT_UPLOAD_QUEUE = 4
+
+# Job runner defaults (total rclone transfers shared by concurrent jobs)
+DEFAULT_RUNNER_TRANSFERS = 16
+
+# Deduplicating repository layout (chunks/ and snapshots/ below the destination)
+DEDUP_REPO_DIR = "repo"
+
+# Restore downloads (parallel transfers/segments); backup pacing flags are not applied to restores
+DEFAULT_RESTORE_WORKERS = 4
+BACKUP_PACING_FLAGS = ("--tpslimit", "--tpslimit-burst")
+
+# Sharded backups (0 = one archive); shards live in shards/<RUN_ID>/ below the destination
+DEFAULT_SHARDS = 0
+
+# Versioned backups (snapshots/<RUN_ID>/ below the destination) and their GFS retention
+DEFAULT_KEEP_DAILY = 7
+DEFAULT_KEEP_WEEKLY = 4
+DEFAULT_KEEP_MONTHLY = 6
+
+# Small-file bundling for plain copies (files below the threshold go into tar bundles of about this size)
+DEFAULT_BUNDLE_THRESHOLD = "1M"
+DEFAULT_BUNDLE_SIZE = "64M"
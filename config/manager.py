@@ -6,7 +6,8 @@ Configuration management for BackupBuddy.
 import json
 from pathlib import Path
 from typing import Dict
-from config.constants import CONFIG_FILE, JOB_DEFAULTS
+from config.constants import CONFIG_FILE, JOB_DEFAULTS, STATE_DIR
+from pipeline import watch
 from utils.display import Colors
 
 
@@ -68,8 +69,9 @@ def list_jobs(config: Dict) -> None:
 
 
 def delete_job(config: Dict, job_id: str) -> bool:
-    """Remove a job from configuration."""
+    """Remove a job from configuration, stopping its change watcher."""
     if job_id in config:
+        watch.stop(STATE_DIR / job_id)
         del config[job_id]
         return save_config(config)
     return False
@@ -52,6 +52,7 @@ def check_and_install_dependencies() -> None:
             "curl": "✓",
             "rclone": "✓", 
             "pigz": "✓",
+            "zstd": "✓",
             "tar": "✓",
             "pv": "✓",
             "cron": "✓"
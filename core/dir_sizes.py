@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Background directory sizing for the local directory browser.
+
+Subtree sizes are computed by a small pool of daemon threads, so the
+browser can draw its screen at once and show each size when it is ready.
+What every directory holds directly (its file bytes and subdirectory names)
+is cached in DIR_SIZE_CACHE, keyed by the directory's device and inode and
+checked against its mtime. Sizing a tree that was seen before therefore
+costs one stat per directory instead of one per file, also in later
+sessions. As with the source pre-scan, files rewritten in place do not
+change their directory's mtime, so entries are refreshed after a day.
+"""
+
+import gzip
+import json
+import os
+import queue
+import stat
+import threading
+import time
+from typing import List, Optional
+
+from config.constants import DIR_SIZE_CACHE
+from pipeline.prescan import RACY_WINDOW, REFRESH_AFTER
+
+SIZE_WORKERS = 4
+# size() result for a directory that could not be sized
+UNREADABLE = -1
+# Totals computed in this session are shown again for this long without re-checking the tree
+TOTAL_TTL = 300
+
+
+class DirSizeCache:
+    """Direct contents of directories: {"dev:ino": [mtime_ns, scanned, file bytes, [subdirectory names]]}."""
+
+    def __init__(self, path=DIR_SIZE_CACHE):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with gzip.open(path, "rt") as file:
+                self._entries = json.load(file)
+        except (OSError, ValueError):
+            pass
+
+    def _list(self, path: str, st: os.stat_result, started: float) -> List:
+        """Return the cache entry of the directory `path`, reading it if it changed."""
+        key = f"{st.st_dev}:{st.st_ino}"
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] == st.st_mtime_ns and started - entry[1] < REFRESH_AFTER:
+            return entry
+
+        file_bytes = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for item in entries:
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            subdirs.append(item.name)
+                        elif item.is_file(follow_symlinks=False):
+                            file_bytes += item.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            return [st.st_mtime_ns, 0, 0, []]
+
+        # A directory changed during its mtime tick would look unchanged next time; don't trust it
+        racy = st.st_mtime_ns / 1e9 > started - RACY_WINDOW
+        entry = [st.st_mtime_ns, 0 if racy else started, file_bytes, subdirs]
+        with self._lock:
+            self._entries[key] = entry
+            self._dirty = True
+        return entry
+
+    def size(self, path: str) -> int:
+        """Return the total bytes of the regular files below `path`; unreadable parts count as empty."""
+        started = time.time()
+        total = 0
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            try:
+                st = os.lstat(directory)
+            except OSError:
+                continue
+            if not stat.S_ISDIR(st.st_mode):
+                continue
+            entry = self._list(directory, st, started)
+            total += entry[2]
+            stack.extend(os.path.join(directory, name) for name in entry[3])
+        return total
+
+    def save(self) -> None:
+        """Write the cache atomically, dropping entries too old to be trusted."""
+        now = time.time()
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = {key: entry for key, entry in self._entries.items() if now - entry[1] < REFRESH_AFTER}
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with gzip.open(tmp_path, "wt", compresslevel=1) as file:
+                json.dump(entries, file, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+class DirSizer:
+    """Computes directory sizes in background threads and remembers the results."""
+
+    def __init__(self, workers: int = SIZE_WORKERS):
+        self.cache = None  # type: Optional[DirSizeCache]
+        self._workers = workers
+        self._queue = queue.Queue()  # type: queue.Queue
+        self._totals = {}
+        self._queued = set()
+        self._ready = threading.Condition()
+        self._started = False
+
+    def _start(self) -> None:
+        # The cache file is read on first use, not when the menus are imported
+        self.cache = DirSizeCache()
+        for _ in range(self._workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        self._started = True
+
+    def _work(self) -> None:
+        while True:
+            path = self._queue.get()
+            with self._ready:
+                if path not in self._queued:
+                    continue
+            try:
+                size = self.cache.size(path)
+            except (OSError, RecursionError, ValueError):
+                size = UNREADABLE
+            with self._ready:
+                self._queued.discard(path)
+                self._totals[path] = (time.monotonic(), size)
+                self._ready.notify_all()
+
+    def size(self, path: str) -> Optional[int]:
+        """Return the size of `path` (UNREADABLE if it failed) if it is known, else queue it and return None."""
+        with self._ready:
+            if not self._started:
+                self._start()
+            result = self._totals.get(path)
+            if result and time.monotonic() - result[0] < TOTAL_TTL:
+                return result[1]
+            if path not in self._queued:
+                self._queued.add(path)
+                self._queue.put(path)
+        return None
+
+    def only(self, paths: List[str]) -> None:
+        """Drop queued requests for anything but `paths`; directories already being sized finish."""
+        with self._ready:
+            self._queued &= set(paths)
+
+    def wait(self, paths: List[str], timeout: float) -> List[str]:
+        """Wait up to `timeout` seconds for one of `paths` to be sized; return those that are."""
+        deadline = time.monotonic() + timeout
+        with self._ready:
+            while True:
+                done = [path for path in paths if path in self._totals and path not in self._queued]
+                remaining = deadline - time.monotonic()
+                if done or remaining <= 0:
+                    return done
+                self._ready.wait(remaining)
+
+    def save(self) -> None:
+        """Persist the per-directory cache."""
+        if self.cache is not None:
+            self.cache.save()
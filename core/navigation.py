@@ -4,11 +4,143 @@ Directory navigation utilities for BackupBuddy.
 Matrix UI implementation.
 """
 
+import contextlib
+import io
+import json
+import queue
+import shlex
+import shutil
+import sys
+import threading
+import time
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import Dict, Iterable, Optional, List, Tuple
+from core.dir_sizes import UNREADABLE, DirSizer
 from utils.commands import run_command
+from utils.rclone_rc import get_client
 from utils.matrix_ui import MatrixUI, MatrixColors
 
+# Remote listings are reused for this many seconds
+LISTING_TTL = 120
+# Child directories listed in the background at the same time
+PREFETCH_WORKERS = 4
+# Directories shown per screen (and prefetched)
+SHOWN_DIRECTORIES = 15
+
+
+class RemoteListingCache:
+    """
+    Subdirectory listings of remote paths, kept for `ttl` seconds.
+
+    Listings come from `rclone lsjson` (or the rclone daemon), so names with
+    spaces survive. prefetch() queues directories for a fixed pool of
+    `workers` background threads; a foreground request for a directory that
+    is being fetched waits for that fetch instead of starting another one.
+    """
+
+    def __init__(self, ttl: float = LISTING_TTL, workers: int = PREFETCH_WORKERS):
+        self.ttl = ttl
+        self._entries = {}  # type: Dict[Tuple[str, str], Tuple[float, List[str]]]
+        self._pending = {}  # type: Dict[Tuple[str, str], threading.Event]
+        self._lock = threading.Lock()
+        self._workers = workers
+        self._queue = queue.Queue()  # type: queue.Queue
+        self._queued = set()
+        self._started = False
+
+    @staticmethod
+    def _key(path: str) -> Tuple[str, str]:
+        remote, _, rel_path = path.partition(":")
+        return remote, rel_path.strip("/")
+
+    @staticmethod
+    def _fetch(path: str) -> List[str]:
+        client = get_client()
+        if client:
+            return sorted(client.list_dirs(path))
+        result = run_command(f"rclone lsjson --dirs-only {shlex.quote(path)}", check=False, capture_output=True)
+        if result.returncode != 0:
+            raise OSError(result.stderr.strip() or f"rclone lsjson exited with status {result.returncode}")
+        return sorted(item["Name"] for item in json.loads(result.stdout or "[]"))
+
+    def list_dirs(self, path: str) -> List[str]:
+        """
+        Return the names of the directories directly inside `path`.
+
+        Raises:
+            OSError: If the listing fails
+        """
+        key = self._key(path)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and time.monotonic() - entry[0] < self.ttl:
+                    return entry[1]
+                event = self._pending.get(key)
+                if event is None:
+                    event = self._pending[key] = threading.Event()
+                    break
+            # Another thread is listing it; use its result or retry if it failed
+            event.wait()
+
+        try:
+            names = self._fetch(path)
+            with self._lock:
+                self._entries[key] = (time.monotonic(), names)
+            return names
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+    def prefetch(self, paths: Iterable[str]) -> None:
+        """
+        List `paths` in the background unless they are cached or already being listed.
+
+        Requests still queued from an earlier call are dropped; listings that
+        have already started finish.
+        """
+        with self._lock:
+            if not self._started:
+                for _ in range(self._workers):
+                    threading.Thread(target=self._work, daemon=True).start()
+                self._started = True
+            now = time.monotonic()
+            wanted = set()
+            for path in paths:
+                key = self._key(path)
+                entry = self._entries.get(key)
+                if key in self._pending or (entry and now - entry[0] < self.ttl):
+                    continue
+                wanted.add(path)
+                if path not in self._queued:
+                    self._queue.put(path)
+            self._queued = wanted
+
+    def _work(self) -> None:
+        while True:
+            path = self._queue.get()
+            with self._lock:
+                if path not in self._queued:
+                    continue
+                self._queued.discard(path)
+            try:
+                self.list_dirs(path)
+            except Exception:
+                # The foreground listing reports the error if the user opens it
+                pass
+
+    def invalidate(self, path: str) -> None:
+        """Forget the listing of `path`, e.g. after creating a directory in it."""
+        with self._lock:
+            self._entries.pop(self._key(path), None)
+
+
+_remote_listings = RemoteListingCache()
+_dir_sizes = DirSizer()
+# Held while a background thread writes to the terminal
+_screen_lock = threading.Lock()
+
 
 def navigate_remote_directories(remote_name: str) -> Optional[str]:
     """
@@ -25,16 +157,15 @@ def navigate_remote_directories(remote_name: str) -> Optional[str]:
     while True:
         MatrixUI.clear_screen()
         
-        # List directories
+        # List directories, then the ones shown below in the background
         try:
-            result = run_command(f"rclone lsd {current_path}", capture_output=True)
-            remote_directories = [
-                line.split()[-1] for line in result.stdout.strip().splitlines()
-                if line.strip()
-            ]
+            remote_directories = _remote_listings.list_dirs(current_path)
         except Exception as e:
             MatrixUI.print_error("LIST FAILED", f"Error listing directories: {e}")
             remote_directories = []
+        _remote_listings.prefetch(
+            f"{current_path}/{directory}" for directory in remote_directories[:SHOWN_DIRECTORIES]
+        )
 
         # Show current location with Matrix UI
         breadcrumb = current_path.replace(":", " → ")
@@ -53,12 +184,12 @@ def navigate_remote_directories(remote_name: str) -> Optional[str]:
             print(f"    {MatrixColors.MATRIX_GREEN}├{'─' * 65}┤{MatrixColors.RESET}")
             print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
             
-            for idx, directory in enumerate(remote_directories[:15], start=1):
+            for idx, directory in enumerate(remote_directories[:SHOWN_DIRECTORIES], start=1):
                 dir_display = f"  ┃ {idx:2d} ┃ 📁 {directory[:50]}"
                 print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}{dir_display}{' ' * (65 - len(dir_display))}│{MatrixColors.RESET}")
             
-            if len(remote_directories) > 15:
-                more = f"  ... and {len(remote_directories) - 15} more directories"
+            if len(remote_directories) > SHOWN_DIRECTORIES:
+                more = f"  ... and {len(remote_directories) - SHOWN_DIRECTORIES} more directories"
                 print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.DIM}{more}{' ' * (65 - len(more))}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
             
             print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
@@ -82,7 +213,12 @@ def navigate_remote_directories(remote_name: str) -> Optional[str]:
             new_dir = input(f"{MatrixColors.MATRIX_GREEN}Enter new directory name: {MatrixColors.RESET}").strip()
             if new_dir:
                 try:
-                    run_command(f'rclone mkdir "{current_path}/{new_dir}"')
+                    client = get_client()
+                    if client:
+                        client.mkdir(f"{current_path}/{new_dir}")
+                    else:
+                        run_command(f'rclone mkdir "{current_path}/{new_dir}"')
+                    _remote_listings.invalidate(current_path)
                     print(f"{MatrixColors.MATRIX_GREEN}✓{MatrixColors.RESET} Directory created\n")
                     input("Press Enter to continue...")
                 except Exception as e:
@@ -109,7 +245,14 @@ def navigate_local_directories() -> Optional[str]:
         Selected path or None if user cancels
     """
     current_path = Path.home()
-    
+
+    try:
+        return _browse_local_directories(current_path)
+    finally:
+        _dir_sizes.save()
+
+
+def _browse_local_directories(current_path: Path) -> Optional[str]:
     while True:
         MatrixUI.clear_screen()
         
@@ -124,66 +267,22 @@ def navigate_local_directories() -> Optional[str]:
             current_path = current_path.parent
             continue
 
-        # Show current location with Matrix UI
-        breadcrumb = " → ".join(current_path.parts[-4:]) if len(current_path.parts) > 4 else str(current_path)
-        
-        print(f"\n{MatrixColors.MATRIX_GREEN}╔{'═' * 71}╗{MatrixColors.RESET}")
-        print(f"{MatrixColors.MATRIX_GREEN}║{MatrixColors.BOLD}  📍 LOCAL LOCATION: {str(current_path)[:48]}{' ' * (70 - min(len(str(current_path)), 48) - 20)}║{MatrixColors.RESET}")
-        print(f"{MatrixColors.MATRIX_GREEN}╠{'═' * 71}╣{MatrixColors.RESET}")
-        print(f"{MatrixColors.MATRIX_GREEN}║  Breadcrumb: ...{breadcrumb[-55:]}{' ' * (68 - min(len(breadcrumb), 55) - 3)}║{MatrixColors.RESET}")
-        print(f"{MatrixColors.MATRIX_GREEN}╚{'═' * 71}╝{MatrixColors.RESET}\n")
-
-        # Show directories
-        if directories:
-            print(f"    {MatrixColors.MATRIX_GREEN}┌{'─' * 65}┐{MatrixColors.RESET}")
-            print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.BOLD} ▓▓▓ DIRECTORIES {'▓' * 47}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
-            print(f"    {MatrixColors.MATRIX_GREEN}├{'─' * 65}┤{MatrixColors.RESET}")
-            print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
-            
-            for idx, directory in enumerate(directories[:15], start=1):
-                try:
-                    size = sum(f.stat().st_size for f in directory.rglob('*') if f.is_file())
-                    size_str = _format_size(size)
-                    item_count = len(list(directory.iterdir()))
-                except:
-                    size_str = "?"
-                    item_count = "?"
-                
-                dir_display = f"  ┃ {idx:2d} ┃ 📁 {directory.name[:30]:<30} │ {str(item_count):>4} items"
-                print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}{dir_display}{' ' * (65 - len(dir_display))}│{MatrixColors.RESET}")
-            
-            if len(directories) > 15:
-                more = f"  ... and {len(directories) - 15} more directories"
-                print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.DIM}{more}{' ' * (65 - len(more))}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
-            
-            print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
-            print(f"    {MatrixColors.MATRIX_GREEN}└{'─' * 65}┘{MatrixColors.RESET}\n")
-
-        # Show files (limited)
-        if files:
-            print(f"    {MatrixColors.MATRIX_GREEN}┌{'─' * 65}┐{MatrixColors.RESET}")
-            print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.BOLD} ▓▓▓ FILES {'▓' * 54}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
-            print(f"    {MatrixColors.MATRIX_GREEN}├{'─' * 65}┤{MatrixColors.RESET}")
-            print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
-            
-            for f in files[:3]:
-                size_str = _format_size(f.stat().st_size)
-                file_display = f"  📄 {f.name[:35]:<35} │ {size_str:>8}"
-                print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.DIM}{file_display}{' ' * (65 - len(file_display))}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
-            
-            if len(files) > 3:
-                more = f"  ... and {len(files) - 3} more files"
-                print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.DIM}{more}{' ' * (65 - len(more))}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
-            
-            print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
-            print(f"    {MatrixColors.MATRIX_GREEN}└{'─' * 65}┘{MatrixColors.RESET}\n")
-
-        # Show options
-        print(f"    {MatrixColors.MATRIX_GREEN}┏{'━' * 65}┓{MatrixColors.RESET}")
-        print(f"    {MatrixColors.MATRIX_GREEN}┃{MatrixColors.CYBER_BLUE}  [0] Select current  [..] Up  [c] Custom  [q] Cancel{' ' * 9}┃{MatrixColors.RESET}")
-        print(f"    {MatrixColors.MATRIX_GREEN}┗{'━' * 65}┛{MatrixColors.RESET}")
+        # Directory sizes are computed in the background; the screen does not wait for them
+        _dir_sizes.only([str(directory) for directory in directories[:SHOWN_DIRECTORIES]])
+        screen, pending = _draw_local_screen(current_path, directories, files)
+        sys.stdout.write(screen)
+        sys.stdout.flush()
 
-        choice = input(f"\n{MatrixColors.CYBER_BLUE}    ▸ COMMAND: {MatrixColors.RESET}").strip()
+        # Sizes are filled in while waiting for input if the screen fits, so its rows can be addressed;
+        # otherwise they show on the next redraw
+        stop = threading.Event()
+        if pending and sys.stdout.isatty() and screen.count("\n") + 2 <= shutil.get_terminal_size().lines:
+            threading.Thread(target=_fill_in_sizes, args=(pending, stop), daemon=True).start()
+        try:
+            choice = input(f"\n{MatrixColors.CYBER_BLUE}    ▸ COMMAND: {MatrixColors.RESET}").strip()
+        finally:
+            with _screen_lock:
+                stop.set()
 
         if choice.lower() == "q":
             return None
@@ -218,6 +317,104 @@ def navigate_local_directories() -> Optional[str]:
                 input("\nPress Enter to continue...")
 
 
+def _draw_local_screen(current_path: Path, directories: List[Path],
+                       files: List[Path]) -> Tuple[str, Dict[str, Tuple[int, int, str, object]]]:
+    """
+    Render the local browser screen.
+
+    Returns:
+        The screen text, and {path: (row, number, name, item count)} of the directories still being sized
+    """
+    with contextlib.redirect_stdout(io.StringIO()) as screen:
+        pending = _print_local_screen(current_path, directories, files, screen)
+    return screen.getvalue(), pending
+
+
+def _print_local_screen(current_path: Path, directories: List[Path], files: List[Path],
+                        screen: io.StringIO) -> Dict[str, Tuple[int, int, str, object]]:
+    pending = {}
+    # Show current location with Matrix UI
+    breadcrumb = " → ".join(current_path.parts[-4:]) if len(current_path.parts) > 4 else str(current_path)
+    
+    print(f"\n{MatrixColors.MATRIX_GREEN}╔{'═' * 71}╗{MatrixColors.RESET}")
+    print(f"{MatrixColors.MATRIX_GREEN}║{MatrixColors.BOLD}  📍 LOCAL LOCATION: {str(current_path)[:48]}{' ' * (70 - min(len(str(current_path)), 48) - 20)}║{MatrixColors.RESET}")
+    print(f"{MatrixColors.MATRIX_GREEN}╠{'═' * 71}╣{MatrixColors.RESET}")
+    print(f"{MatrixColors.MATRIX_GREEN}║  Breadcrumb: ...{breadcrumb[-55:]}{' ' * (68 - min(len(breadcrumb), 55) - 3)}║{MatrixColors.RESET}")
+    print(f"{MatrixColors.MATRIX_GREEN}╚{'═' * 71}╝{MatrixColors.RESET}\n")
+
+    # Show directories
+    if directories:
+        print(f"    {MatrixColors.MATRIX_GREEN}┌{'─' * 65}┐{MatrixColors.RESET}")
+        print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.BOLD} ▓▓▓ DIRECTORIES {'▓' * 47}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
+        print(f"    {MatrixColors.MATRIX_GREEN}├{'─' * 65}┤{MatrixColors.RESET}")
+        print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
+        
+        for idx, directory in enumerate(directories[:SHOWN_DIRECTORIES], start=1):
+            try:
+                item_count = len(list(directory.iterdir()))
+            except OSError:
+                item_count = "?"
+            size = _dir_sizes.size(str(directory))
+            if size is None:
+                # The screen starts at the top left, so this line is drawn on row <lines so far> + 1
+                pending[str(directory)] = (screen.getvalue().count("\n") + 1, idx, directory.name, item_count)
+            print(_local_directory_line(idx, directory.name, item_count, size))
+        
+        if len(directories) > SHOWN_DIRECTORIES:
+            more = f"  ... and {len(directories) - SHOWN_DIRECTORIES} more directories"
+            print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.DIM}{more}{' ' * (65 - len(more))}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
+        
+        print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
+        print(f"    {MatrixColors.MATRIX_GREEN}└{'─' * 65}┘{MatrixColors.RESET}\n")
+
+    # Show files (limited)
+    if files:
+        print(f"    {MatrixColors.MATRIX_GREEN}┌{'─' * 65}┐{MatrixColors.RESET}")
+        print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.BOLD} ▓▓▓ FILES {'▓' * 54}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
+        print(f"    {MatrixColors.MATRIX_GREEN}├{'─' * 65}┤{MatrixColors.RESET}")
+        print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
+        
+        for f in files[:3]:
+            size_str = _format_size(f.stat().st_size)
+            file_display = f"  📄 {f.name[:35]:<35} │ {size_str:>8}"
+            print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.DIM}{file_display}{' ' * (65 - len(file_display))}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
+        
+        if len(files) > 3:
+            more = f"  ... and {len(files) - 3} more files"
+            print(f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.DIM}{more}{' ' * (65 - len(more))}{MatrixColors.RESET}{MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}")
+        
+        print(f"    {MatrixColors.MATRIX_GREEN}│{' ' * 65}│{MatrixColors.RESET}")
+        print(f"    {MatrixColors.MATRIX_GREEN}└{'─' * 65}┘{MatrixColors.RESET}\n")
+
+    # Show options
+    print(f"    {MatrixColors.MATRIX_GREEN}┏{'━' * 65}┓{MatrixColors.RESET}")
+    print(f"    {MatrixColors.MATRIX_GREEN}┃{MatrixColors.CYBER_BLUE}  [0] Select current  [..] Up  [c] Custom  [q] Cancel{' ' * 9}┃{MatrixColors.RESET}")
+    print(f"    {MatrixColors.MATRIX_GREEN}┗{'━' * 65}┛{MatrixColors.RESET}")
+    return pending
+
+
+def _local_directory_line(idx: int, name: str, item_count: object, size: Optional[int]) -> str:
+    """One directory row of the local browser; `size` is None while it is being computed."""
+    size_str = "computing…" if size is None else "?" if size == UNREADABLE else _format_size(size)
+    dir_display = f"  ┃ {idx:2d} ┃ 📁 {name[:25]:<25} │ {str(item_count):>4} items │ {size_str:>10}"
+    return f"    {MatrixColors.MATRIX_GREEN}│{MatrixColors.RESET}{dir_display}{' ' * (65 - len(dir_display))}│{MatrixColors.RESET}"
+
+
+def _fill_in_sizes(pending: Dict[str, Tuple[int, int, str, object]], stop: threading.Event) -> None:
+    """Redraw the rows of `pending` in place as their sizes arrive, until `stop` is set."""
+    pending = dict(pending)
+    while pending and not stop.is_set():
+        for path in _dir_sizes.wait(list(pending), timeout=0.5):
+            row, idx, name, item_count = pending.pop(path)
+            line = _local_directory_line(idx, name, item_count, _dir_sizes.size(path))
+            with _screen_lock:
+                if stop.is_set():
+                    return
+                # Save the cursor (it sits in the prompt), rewrite the row, restore the cursor
+                sys.stdout.write(f"\0337\033[{row};1H\033[2K{line}\0338")
+                sys.stdout.flush()
+
+
 def _format_size(size: int) -> str:
     """Format size in bytes to human readable format."""
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
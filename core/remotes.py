@@ -6,6 +6,7 @@ Matrix UI implementation.
 
 from typing import List, Optional
 from utils.commands import run_command
+from utils.rclone_rc import get_client
 from utils.matrix_ui import MatrixUI, MatrixColors
 from utils.validation import confirm_action
 
@@ -13,6 +14,9 @@ from utils.validation import confirm_action
 def list_remotes() -> List[str]:
     """List configured rclone remotes."""
     try:
+        client = get_client()
+        if client:
+            return client.list_remotes()
         result = run_command("rclone listremotes", capture_output=True)
         remotes = result.stdout.strip().splitlines()
         return [r for r in remotes if r]
@@ -5,14 +5,20 @@ Matrix UI implementation.
 """
 
 from config.manager import save_config
-from config.constants import DEFAULT_BACKUP_FLAGS, DEFAULT_COMPRESSION_LEVEL, DEFAULT_CORES, DEFAULT_SPLIT_SIZE
+from config.constants import (
+    DEFAULT_BACKUP_FLAGS, DEFAULT_BUNDLE_SIZE, DEFAULT_BUNDLE_THRESHOLD, DEFAULT_COMPRESSION_LEVEL, DEFAULT_CORES,
+    DEFAULT_FULL_EVERY, DEFAULT_KEEP_DAILY, DEFAULT_KEEP_MONTHLY, DEFAULT_KEEP_WEEKLY, DEFAULT_SPLIT_SIZE,
+    DEFAULT_RESTORE_WORKERS, DEFAULT_SHARDS, DEFAULT_ZSTD_LEVEL
+)
 from core.navigation import navigate_local_directories, navigate_remote_directories
 from core.remotes import select_remote
+from pipeline.codecs import GZIP, LEVELS, ZSTD
+from pipeline.units import parse_age, parse_size
 from scripts.generator import generate_backup_script
 from cron.scheduler import schedule_cron
 from utils.commands import run_script
 from utils.matrix_ui import MatrixUI, MatrixColors
-from utils.validation import get_yes_no, get_int_input
+from utils.validation import get_yes_no, get_int_input, get_cores_input, get_size_input
 
 
 def create_backup_job(config: dict) -> None:
@@ -49,6 +55,12 @@ def create_backup_job(config: dict) -> None:
         input("\nPress Enter to continue...")
         return
 
+    print()
+    filters = {}
+    if get_yes_no("Exclude files from this backup (globs, size/age limits, .gitignore)?"):
+        print()
+        filters = _configure_filters()
+
     # Step 3: Select destination (remote)
     MatrixUI.clear_screen()
     MatrixUI.print_header("CREATE BACKUP JOB", f"Job: {job_id}")
@@ -77,31 +89,120 @@ def create_backup_job(config: dict) -> None:
     print(f"{MatrixColors.MATRIX_GREEN}╚{'═' * 66}╝{MatrixColors.RESET}\n")
     
     compress = get_yes_no("Do you want to compress files?")
+    codec = GZIP
+    zstd_long = False
     compression_level = None
     cores = None
     split_files = False
     split_size = None
+    stream_upload = False
+    dedup = False
+    shards = DEFAULT_SHARDS
+    skip_incompressible = False
+    content_index = False
+    bundle = False
+    bundle_threshold = DEFAULT_BUNDLE_THRESHOLD
+    bundle_size = DEFAULT_BUNDLE_SIZE
+
+    if not compress:
+        print()
+        bundle = get_yes_no("Pack small files into tar bundles (far fewer API calls for many small files)?")
+    if bundle:
+        bundle_threshold = get_size_input(
+            f"{MatrixColors.MATRIX_GREEN}Bundle files smaller than (e.g., 256K, 4M, default: {DEFAULT_BUNDLE_THRESHOLD}){MatrixColors.RESET}",
+            default=DEFAULT_BUNDLE_THRESHOLD
+        )
+        bundle_size = get_size_input(
+            f"{MatrixColors.MATRIX_GREEN}Target size per bundle (e.g., 32M, 256M, default: {DEFAULT_BUNDLE_SIZE}){MatrixColors.RESET}",
+            default=DEFAULT_BUNDLE_SIZE
+        )
 
     if compress:
         print()
+        if get_yes_no("Use zstd instead of gzip (much faster at a similar ratio)?"):
+            codec = ZSTD
+        min_level, max_level = LEVELS[codec]
+        default_level = DEFAULT_ZSTD_LEVEL if codec == ZSTD else DEFAULT_COMPRESSION_LEVEL
         compression_level = get_int_input(
-            f"{MatrixColors.MATRIX_GREEN}Compression level (1=low, 9=high, default: {DEFAULT_COMPRESSION_LEVEL}){MatrixColors.RESET}",
-            default=DEFAULT_COMPRESSION_LEVEL,
-            min_val=1,
-            max_val=9
+            f"{MatrixColors.MATRIX_GREEN}Compression level ({min_level}=low, {max_level}=high, default: {default_level}){MatrixColors.RESET}",
+            default=default_level,
+            min_val=min_level,
+            max_val=max_level
         )
-        cores = get_int_input(
-            f"{MatrixColors.MATRIX_GREEN}Number of CPU cores (default: {DEFAULT_CORES}){MatrixColors.RESET}",
-            default=DEFAULT_CORES,
-            min_val=1
+        if codec == ZSTD:
+            zstd_long = get_yes_no("Enable zstd long-distance matching (--long, better ratio on large similar files)?")
+        cores = get_cores_input(
+            f"{MatrixColors.MATRIX_GREEN}Number of CPU cores ('auto' = size at run time, default: {DEFAULT_CORES}){MatrixColors.RESET}",
+            default=DEFAULT_CORES
         )
 
+        print()
+        dedup = get_yes_no("Store backups in a deduplicating repository (upload only changed chunks)?")
+
+    if compress and not dedup:
+        print()
+        shards = get_int_input(
+            f"{MatrixColors.MATRIX_GREEN}Split the backup into N size-balanced archives built in parallel (0 = single archive, default: {DEFAULT_SHARDS}){MatrixColors.RESET}",
+            default=DEFAULT_SHARDS,
+            min_val=0
+        )
+
+    if compress and not dedup and not shards:
         print()
         split_files = get_yes_no("Do you want to split the compressed archive?")
         if split_files:
             split_size = input(
                 f"{MatrixColors.MATRIX_GREEN}Maximum size per part (e.g., 10M, 1G, default: {DEFAULT_SPLIT_SIZE}): {MatrixColors.RESET}"
             ).strip() or DEFAULT_SPLIT_SIZE
+        else:
+            # Split archives are uploaded part by part as they are cut; streaming only applies to single archives
+            print()
+            stream_upload = get_yes_no("Stream the archive directly to the remote (no local staging)?")
+
+        print()
+        skip_incompressible = get_yes_no("Store already-compressed files (media, archives) without recompressing them?")
+
+    if compress and not dedup and not shards and not skip_incompressible:
+        print()
+        content_index = get_yes_no("Write a content index (restore single files without downloading the whole backup)?")
+
+    incremental = False
+    full_every = None
+    watch = False
+    if not dedup and not shards:
+        print()
+        incremental = get_yes_no("Enable incremental backups (only new and changed files)?")
+    if incremental:
+        full_every = get_int_input(
+            f"{MatrixColors.MATRIX_GREEN}Run a full backup every N runs (0 = never, default: {DEFAULT_FULL_EVERY}){MatrixColors.RESET}",
+            default=DEFAULT_FULL_EVERY,
+            min_val=0
+        )
+        watch = get_yes_no("Track changes with a background watcher (inotify) instead of scanning the source every run?")
+
+    snapshots = False
+    keep_daily = DEFAULT_KEEP_DAILY
+    keep_weekly = DEFAULT_KEEP_WEEKLY
+    keep_monthly = DEFAULT_KEEP_MONTHLY
+    if compress and not dedup and not shards:
+        print()
+        snapshots = get_yes_no("Keep every backup as a versioned snapshot (with daily/weekly/monthly retention)?")
+    if snapshots:
+        keep_daily = get_int_input(
+            f"{MatrixColors.MATRIX_GREEN}Keep the newest snapshot of each of the last N days (default: {DEFAULT_KEEP_DAILY}){MatrixColors.RESET}",
+            default=DEFAULT_KEEP_DAILY,
+            min_val=0
+        )
+        keep_weekly = get_int_input(
+            f"{MatrixColors.MATRIX_GREEN}Keep the newest snapshot of each of the last N weeks (default: {DEFAULT_KEEP_WEEKLY}){MatrixColors.RESET}",
+            default=DEFAULT_KEEP_WEEKLY,
+            min_val=0
+        )
+        keep_monthly = get_int_input(
+            f"{MatrixColors.MATRIX_GREEN}Keep the newest snapshot of each of the last N months (default: {DEFAULT_KEEP_MONTHLY}){MatrixColors.RESET}",
+            default=DEFAULT_KEEP_MONTHLY,
+            min_val=0
+        )
 
     # Step 5: Configure rclone flags
     MatrixUI.clear_screen()
@@ -110,16 +211,42 @@ def create_backup_job(config: dict) -> None:
     
     rclone_flags = _configure_rclone_flags(job_id, DEFAULT_BACKUP_FLAGS)
 
+    print()
+    restore_workers = get_int_input(
+        f"{MatrixColors.MATRIX_GREEN}Parallel downloads when restoring (not limited by the backup throttling, default: {DEFAULT_RESTORE_WORKERS}){MatrixColors.RESET}",
+        default=DEFAULT_RESTORE_WORKERS,
+        min_val=1
+    )
+
     # Save configuration
     config[job_id] = {
         "source_dir": source_dir,
         "destination": destination_path,
         "compress": compress,
+        "codec": codec,
         "compression_level": compression_level,
         "split_files": split_files,
         "split_size": split_size,
         "cores": cores,
+        "stream_upload": stream_upload,
+        "incremental": incremental,
+        "full_every": full_every,
+        "watch": watch,
+        "dedup": dedup,
+        "shards": shards,
+        "skip_incompressible": skip_incompressible,
+        "content_index": content_index,
+        "bundle": bundle,
+        "bundle_threshold": bundle_threshold,
+        "bundle_size": bundle_size,
+        "snapshots": snapshots,
+        "keep_daily": keep_daily,
+        "keep_weekly": keep_weekly,
+        "keep_monthly": keep_monthly,
+        "zstd_long": zstd_long,
+        "filters": filters,
         "rclone_flags": rclone_flags,
+        "restore_workers": restore_workers,
     }
     
     if not save_config(config):
@@ -169,6 +296,38 @@ def create_backup_job(config: dict) -> None:
     input("\nPress Enter to continue...")
 
 
+def _configure_filters() -> dict:
+    """
+    Ask for the job's include/exclude rules with Matrix UI.
+    """
+    print(f"{MatrixColors.DIM}Globs use .gitignore syntax (e.g. node_modules/, *.iso, /build); separate them with commas{MatrixColors.RESET}\n")
+
+    def globs(prompt: str) -> list:
+        value = input(f"{MatrixColors.MATRIX_GREEN}{prompt}: {MatrixColors.RESET}").strip()
+        return [glob.strip() for glob in value.split(",") if glob.strip()]
+
+    def limit(prompt: str, parse) -> str:
+        while True:
+            value = input(f"{MatrixColors.MATRIX_GREEN}{prompt}: {MatrixColors.RESET}").strip()
+            try:
+                if value:
+                    parse(value)
+                return value
+            except ValueError as e:
+                MatrixUI.print_warning("INVALID INPUT", str(e))
+
+    filters = {
+        "exclude": globs("Exclude (e.g. node_modules/, .cache/, *.iso)"),
+        "include": globs("Always include, overriding excludes and limits (optional)"),
+        "max_size": limit("Skip files larger than (e.g. 4G, empty = no limit)", parse_size),
+        "max_age": limit("Skip files not modified within (e.g. 30d, 1y, empty = no limit)", parse_age),
+    }
+    if get_yes_no("Honor .gitignore files in the source tree?"):
+        filters["ignore_file"] = ".gitignore"
+
+    return {key: value for key, value in filters.items() if value}
+
+
 def _configure_rclone_flags(job_id: str, default_flags: dict) -> dict:
     """
     Configure rclone flags for the job with Matrix UI.
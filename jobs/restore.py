@@ -4,9 +4,14 @@ Restore job management for BackupBuddy.
 Matrix UI implementation.
 """
 
+import os
+from typing import List, Optional
+
+from pipeline.snapshots import SNAPSHOT_DIR, load_catalog, run_time
 from scripts.generator import generate_restore_script
 from utils.commands import run_script
 from utils.matrix_ui import MatrixUI, MatrixColors
+from utils.validation import get_int_input, get_yes_no
 
 
 def restore_backup_job(config: dict) -> None:
@@ -65,11 +70,35 @@ def restore_backup_job(config: dict) -> None:
                 input("\nPress Enter to continue...")
                 continue
             
+            paths = None
+            stream = False
+            snapshot = None
+            if job_data.get("compress") and job_data.get("snapshots") and not (job_data.get("dedup") or job_data.get("shards")):
+                print()
+                if get_yes_no("Restore an older snapshot instead of the newest one?"):
+                    snapshot = _ask_snapshot(job_data["destination"])
+                    if not snapshot:
+                        input("\nPress Enter to continue...")
+                        continue
+            
+            if job_data.get("compress") and job_data.get("content_index"):
+                print()
+                if get_yes_no("Restore only selected files or directories (uses the content index)?"):
+                    paths = _ask_restore_paths(job_data.get('source_dir', ''))
+                    if not paths:
+                        MatrixUI.print_warning("CANCELLED", "No paths entered")
+                        input("\nPress Enter to continue...")
+                        continue
+            
+            if paths is None and job_data.get("compress") and not (job_data.get("dedup") or job_data.get("shards")):
+                print()
+                stream = get_yes_no("Stream the backup straight into the target (no local copy in the temp directory)?")
+            
             # Generate and run restore script
             MatrixUI.clear_screen()
             print(f"\n{MatrixColors.MATRIX_GREEN}⣾{MatrixColors.RESET} Generating restore script...\n")
             
-            script_path = generate_restore_script(config, job_id)
+            script_path = generate_restore_script(config, job_id, paths, stream, snapshot)
             
             print(f"{MatrixColors.MATRIX_GREEN}✓{MatrixColors.RESET} Restore script generated: {script_path}\n")
             print(f"{MatrixColors.MATRIX_GREEN}⣾{MatrixColors.RESET} Running restore job '{job_id}'...\n")
@@ -103,6 +132,56 @@ def restore_backup_job(config: dict) -> None:
             input("\nPress Enter to continue...")
 
 
+def _ask_restore_paths(source_dir: str) -> List[str]:
+    """
+    Ask for the paths to restore, one per line, until an empty line.
+    
+    Absolute paths below the job's source directory are made relative to it.
+    """
+    print(f"\n{MatrixColors.DIM}Enter files or directories relative to {source_dir} "
+          f"(or absolute below it), one per line. Empty line to finish.{MatrixColors.RESET}\n")
+    
+    source = source_dir.rstrip("/")
+    paths = []
+    while True:
+        path = input(f"{MatrixColors.CYBER_BLUE}Path: {MatrixColors.RESET}").strip()
+        if not path:
+            return paths
+        if os.path.isabs(path):
+            if path != source and not path.startswith(source + "/"):
+                MatrixUI.print_warning("OUTSIDE SOURCE", f"{path} is not below {source_dir}")
+                continue
+            path = os.path.relpath(path, source)
+        paths.append(path)
+
+
+def _ask_snapshot(destination: str) -> Optional[str]:
+    """List the job's snapshots from the remote catalog and let the user pick one."""
+    print(f"\n{MatrixColors.MATRIX_GREEN}⣾{MatrixColors.RESET} Reading snapshot catalog...\n")
+    try:
+        snapshots = load_catalog(f"{destination}/{SNAPSHOT_DIR}")["snapshots"]
+    except OSError as e:
+        MatrixUI.print_error("CATALOG UNAVAILABLE", str(e))
+        return None
+    if not snapshots:
+        MatrixUI.print_warning("NO SNAPSHOTS", f"No snapshots found in {destination}/{SNAPSHOT_DIR}")
+        return None
+    
+    for i, snapshot in enumerate(snapshots, start=1):
+        runs = f", {len(snapshot['runs'])} incremental run(s)" if snapshot["runs"] else ""
+        print(f"{MatrixColors.MATRIX_GREEN}{i}.{MatrixColors.RESET} "
+              f"{run_time(snapshot['updated']):%Y-%m-%d %H:%M:%S}"
+              f"{MatrixColors.DIM} (snapshot {snapshot['id']}{runs}){MatrixColors.RESET}")
+    
+    print()
+    choice = get_int_input(
+        f"{MatrixColors.CYBER_BLUE}Snapshot to restore (1-{len(snapshots)}){MatrixColors.RESET}",
+        min_val=1,
+        max_val=len(snapshots)
+    )
+    return snapshots[choice - 1]["id"]
+
+
 def _display_job_info(job_id: str, job_data: dict) -> None:
     """Display information about a job with Matrix UI."""
     print(f"{MatrixColors.MATRIX_GREEN}╔{'═' * 66}╗{MatrixColors.RESET}")
@@ -115,6 +194,10 @@ def _display_job_info(job_id: str, job_data: dict) -> None:
     print(f"{MatrixColors.BOLD}Encrypted:{MatrixColors.RESET} {job_data.get('encrypt', False)}")
     print(f"{MatrixColors.BOLD}Compressed:{MatrixColors.RESET} {job_data.get('compress', False)}")
     print(f"{MatrixColors.BOLD}Split files:{MatrixColors.RESET} {job_data.get('split_files', False)}")
+    print(f"{MatrixColors.BOLD}Content index:{MatrixColors.RESET} {job_data.get('content_index', False)}")
+    if job_data.get("snapshots"):
+        print(f"{MatrixColors.BOLD}Snapshots:{MatrixColors.RESET} keep {job_data.get('keep_daily')} daily, "
+              f"{job_data.get('keep_weekly')} weekly, {job_data.get('keep_monthly')} monthly")
     
     if job_data.get("encrypt"):
         print(f"\n{MatrixColors.WARNING_AMBER}⚠ Note:{MatrixColors.RESET} This job is encrypted.")
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Concurrent job runner for BackupBuddy.
+
+Runs a set of saved jobs at the same time while keeping the host-wide
+totals of pigz cores, rclone transfers and bandwidth within a budget.
+Each job gets a share of the budget when it starts (passed to its script as
+BB_CORES / BB_TRANSFERS / BB_BWLIMIT) and returns it when it finishes, so
+the sum of all running jobs never exceeds the configured totals. Helpers
+that run several rclone processes divide BB_BWLIMIT between them.
+
+The bytes each job moved are read from rclone's statistics in its log once
+it has finished: every rclone process of a runner-started job reports them
+exactly once, when it exits.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config.constants import CORES_AUTO, DEFAULT_RUNNER_TRANSFERS, STATE_DIR
+from config.manager import load_config
+from pipeline.cpu import available_cores, cpu_limit
+from pipeline.units import parse_size
+from scripts.generator import generate_backup_script, generate_transfer_script
+from utils.matrix_ui import MatrixUI, MatrixColors
+from utils.validation import get_int_input
+
+RUNNER_LOG = "runner.log"
+POLL_INTERVAL = 0.5
+# One statistics report per rclone process, when it exits (unless a run takes longer than this)
+RCLONE_STATS_ENV = {"RCLONE_STATS": "24h", "RCLONE_STATS_ONE_LINE": "true", "RCLONE_STATS_LOG_LEVEL": "NOTICE"}
+# rclone's transferred bytes, e.g. "1.234 GiB / 1.234 GiB, 100%" (older versions: "1.234 GBytes")
+_STATS_BYTES = re.compile(r"(\d+(?:\.\d+)?) ?([kKMGTPE]?)(?:i?B|Bytes) / \d+(?:\.\d+)? ?[kKMGTPE]?(?:i?B|Bytes),")
+_STATS_UNITS = {"": 1, "k": 1024, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4,
+                "P": 1024 ** 5, "E": 1024 ** 6}
+
+
+class Budget:
+    """Host-wide resource pool shared by concurrently running jobs."""
+
+    def __init__(self, cores: int, transfers: int, bandwidth: int):
+        self.total = {"cores": cores, "transfers": transfers, "bandwidth": bandwidth}
+        self.free = dict(self.total)
+
+    def take(self, wants: Dict[str, int], slots: int) -> Optional[Dict[str, int]]:
+        """
+        Reserve resources for one job.
+
+        A job gets what it asks for, capped at an equal share of the total
+        (`total // slots`) and at what is still free. Bandwidth 0 means
+        unlimited and is not reserved.
+
+        Returns:
+            The reserved amounts, or None if a resource is exhausted
+        """
+        grant = {}
+        for resource, want in wants.items():
+            if resource == "bandwidth" and not self.total["bandwidth"]:
+                grant[resource] = 0
+                continue
+            share = max(1, self.total[resource] // slots)
+            amount = min(want or share, share, self.free[resource])
+            if amount < 1:
+                return None
+            grant[resource] = amount
+
+        for resource, amount in grant.items():
+            if self.total[resource]:
+                self.free[resource] -= amount
+        return grant
+
+    def release(self, grant: Dict[str, int]) -> None:
+        """Return a job's reservation to the pool."""
+        for resource, amount in grant.items():
+            if self.total[resource]:
+                self.free[resource] += amount
+
+
+def job_wants(job: Dict) -> Dict[str, int]:
+    """Return the cores and transfers a job is configured to use."""
+    flags = job.get("rclone_flags", {})
+    try:
+        transfers = int(flags.get("--transfers", 4))
+    except ValueError:
+        transfers = 4
+
+    if job.get("type") != "transfer" and job.get("compress"):
+        cores = available_cores() if job.get("cores") == CORES_AUTO else int(job.get("cores") or 1)
+    else:
+        cores = 1
+
+    return {"cores": cores, "transfers": transfers, "bandwidth": 0}
+
+
+def job_logs(job_id: str, job: Dict) -> List[Tuple[Path, int]]:
+    """Return the logs rclone writes to during a run, with their current sizes (where the run starts)."""
+    logs = [STATE_DIR / job_id / RUNNER_LOG]
+    log_file = job.get("rclone_flags", {}).get("--log-file")
+    if log_file:
+        logs.append(Path(log_file))
+    return [(path, path.stat().st_size if path.exists() and path != logs[0] else 0) for path in logs]
+
+
+def transferred_bytes(logs: List[Tuple[Path, int]]) -> Optional[int]:
+    """
+    Add up the bytes reported by the rclone statistics written to `logs` from the given offsets.
+
+    Returns:
+        None if no rclone process reported statistics
+    """
+    total = None
+    for path, offset in logs:
+        try:
+            with open(path, "rb") as file:
+                file.seek(offset)
+                text = file.read().decode(errors="replace")
+        except OSError:
+            continue
+        for match in _STATS_BYTES.finditer(text):
+            total = (total or 0) + int(float(match.group(1)) * _STATS_UNITS[match.group(2)])
+    return total
+
+
+def _prepare_script(config: Dict, job_id: str) -> Path:
+    """Regenerate a job's script so it honours the runner overrides."""
+    if config[job_id].get("type") == "transfer":
+        return generate_transfer_script(config, job_id)
+    return generate_backup_script(config, job_id)
+
+
+def _start(job_id: str, script_path: Path, grant: Dict[str, int]) -> subprocess.Popen:
+    """Launch a job script with its share of the budget in the environment."""
+    env = dict(os.environ, BB_CORES=str(grant["cores"]), BB_TRANSFERS=str(grant["transfers"]), **RCLONE_STATS_ENV)
+    if grant["bandwidth"]:
+        env["BB_BWLIMIT"] = f"{max(1, grant['bandwidth'] // 1024)}K"
+
+    command = ["bash", str(script_path)]
+    if os.geteuid() != 0:
+        preserved = ",".join(["BB_CORES", "BB_TRANSFERS", "BB_BWLIMIT", *RCLONE_STATS_ENV])
+        command = ["sudo", f"--preserve-env={preserved}"] + command
+
+    log_path = STATE_DIR / job_id / RUNNER_LOG
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "w") as log_file:
+        return subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def run_jobs(config: Dict, job_ids: List[str], cores: int, transfers: int,
+             bandwidth: int = 0, parallel: Optional[int] = None) -> List[Dict]:
+    """
+    Run jobs concurrently within a host-wide budget.
+
+    Args:
+        config: Configuration dictionary
+        job_ids: Jobs to run, started in this order
+        cores: Total pigz cores for all running jobs
+        transfers: Total rclone --transfers for all running jobs
+        bandwidth: Total upload bandwidth in bytes/s (0 = unlimited)
+        parallel: Maximum number of jobs running at once (default: as many as the budget allows)
+
+    Returns:
+        One result dict per job (job_id, returncode, seconds, bytes, log)
+    """
+    cores, transfers = max(1, cores), max(1, transfers)
+    budget = Budget(cores, transfers, bandwidth)
+    parallel = max(1, min(parallel or len(job_ids), cores, transfers))
+    pending = list(job_ids)
+    running = {}  # type: Dict[str, tuple]
+    results = []
+    # Logs are read after a job ends, away from the scheduling loop
+    log_reader = ThreadPoolExecutor(max_workers=1)
+    sizes = []  # type: List[Tuple[Dict, Future]]
+
+    while pending or running:
+        while pending and len(running) < parallel:
+            job_id = pending[0]
+            wants = job_wants(config[job_id])
+            if bandwidth:
+                wants["bandwidth"] = bandwidth
+            grant = budget.take(wants, min(parallel, len(pending) + len(running)))
+            if grant is None:
+                break
+
+            pending.pop(0)
+            logs = job_logs(job_id, config[job_id])
+            process = _start(job_id, _prepare_script(config, job_id), grant)
+            running[job_id] = (process, grant, time.time(), logs)
+            print(f"[{job_id}] started: {grant['cores']} cores, {grant['transfers']} transfers"
+                  + (f", {grant['bandwidth'] // 1024}K/s" if grant["bandwidth"] else ""), flush=True)
+
+        time.sleep(POLL_INTERVAL)
+        for job_id, (process, grant, started, logs) in list(running.items()):
+            if process.poll() is None:
+                continue
+
+            seconds = time.time() - started
+            budget.release(grant)
+            del running[job_id]
+            result = {
+                "job_id": job_id,
+                "returncode": process.returncode,
+                "seconds": seconds,
+                "bytes": None,
+                "log": str(STATE_DIR / job_id / RUNNER_LOG),
+            }
+            results.append(result)
+            status = "finished" if process.returncode == 0 else f"FAILED (exit {process.returncode})"
+            print(f"[{job_id}] {status} in {seconds:.1f}s", flush=True)
+            sizes.append((result, log_reader.submit(transferred_bytes, logs)))
+
+    for result, size in sizes:
+        result["bytes"] = size.result()
+    log_reader.shutdown()
+    return results
+
+
+def format_report(results: List[Dict], wall_seconds: float) -> List[str]:
+    """Build the per-job and total throughput report."""
+    lines = [f"{'JOB':<24} {'STATUS':<8} {'TIME':>9} {'SIZE':>11} {'RATE':>12}"]
+    total_bytes = 0
+    for result in results:
+        size = result["bytes"]
+        total_bytes += size or 0
+        status = "ok" if result["returncode"] == 0 else "failed"
+        size_text = f"{size / 1024 ** 2:.1f} MiB" if size is not None else "-"
+        rate_text = f"{size / 1024 ** 2 / result['seconds']:.1f} MiB/s" if size and result["seconds"] > 0 else "-"
+        lines.append(f"{result['job_id'][:24]:<24} {status:<8} {result['seconds']:>8.1f}s {size_text:>11} {rate_text:>12}")
+
+    rate = f"{total_bytes / 1024 ** 2 / wall_seconds:.1f} MiB/s" if wall_seconds > 0 else "-"
+    lines.append(f"{'TOTAL':<24} {'':<8} {wall_seconds:>8.1f}s {total_bytes / 1024 ** 2:>7.1f} MiB {rate:>12}")
+    return lines
+
+
+def run_multiple_jobs(config: Dict, job_ids: List[str]) -> None:
+    """
+    Ask for the host-wide budget and run the selected jobs concurrently.
+    """
+    MatrixUI.print_header("RUN JOBS CONCURRENTLY", f"{len(job_ids)} jobs selected")
+
+    cpu_count = cpu_limit()
+    cores = get_int_input(
+        f"{MatrixColors.MATRIX_GREEN}Total CPU cores for all jobs (default: {cpu_count}){MatrixColors.RESET}",
+        default=cpu_count,
+        min_val=1
+    )
+    transfers = get_int_input(
+        f"{MatrixColors.MATRIX_GREEN}Total rclone transfers for all jobs (default: {DEFAULT_RUNNER_TRANSFERS}){MatrixColors.RESET}",
+        default=DEFAULT_RUNNER_TRANSFERS,
+        min_val=1
+    )
+    bwlimit = input(
+        f"{MatrixColors.MATRIX_GREEN}Total bandwidth limit (e.g., 50M, default: unlimited): {MatrixColors.RESET}"
+    ).strip() or "0"
+    try:
+        bandwidth = parse_size(bwlimit)
+    except ValueError as e:
+        MatrixUI.print_error("INVALID INPUT", str(e))
+        return
+
+    print()
+    started = time.time()
+    results = run_jobs(config, job_ids, cores, transfers, bandwidth)
+    wall_seconds = time.time() - started
+
+    print()
+    for line in format_report(results, wall_seconds):
+        print(f"{MatrixColors.MATRIX_GREEN}{line}{MatrixColors.RESET}")
+
+    failed = [result for result in results if result["returncode"] != 0]
+    if failed:
+        MatrixUI.print_error(
+            "JOBS FAILED",
+            f"{len(failed)} of {len(results)} jobs encountered an error",
+            actions=[f"Check {result['log']}" for result in failed]
+        )
+    else:
+        MatrixUI.print_success("JOBS COMPLETED", f"All {len(results)} jobs executed successfully")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("job_ids", nargs="*", help="Jobs to run (default: all saved jobs)")
+    parser.add_argument("--cores", type=int, default=cpu_limit(), help="Total compression cores (default: CPU limit)")
+    parser.add_argument("--transfers", type=int, default=DEFAULT_RUNNER_TRANSFERS, help="Total rclone transfers")
+    parser.add_argument("--bwlimit", default="0", help="Total bandwidth, e.g. 50M (default: unlimited)")
+    parser.add_argument("--parallel", type=int, help="Maximum jobs running at once")
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    job_ids = args.job_ids or list(config)
+    unknown = [job_id for job_id in job_ids if job_id not in config]
+    if unknown:
+        parser.error(f"unknown job(s): {', '.join(unknown)}")
+
+    started = time.time()
+    results = run_jobs(config, job_ids, args.cores, args.transfers, parse_size(args.bwlimit), args.parallel)
+    print("\n".join(format_report(results, time.time() - started)))
+    return 0 if all(result["returncode"] == 0 for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
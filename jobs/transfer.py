@@ -4,15 +4,20 @@ Transfer job creation and management for BackupBuddy.
 Matrix UI implementation.
 """
 
+import os
+
 from config.manager import save_config
-from config.constants import DEFAULT_TRANSFER_FLAGS, DEFAULT_COMPRESSION_LEVEL, DEFAULT_CORES, DEFAULT_SPLIT_SIZE
+from config.constants import (
+    DEFAULT_TRANSFER_FLAGS, DEFAULT_BUNDLE_SIZE, DEFAULT_BUNDLE_THRESHOLD, DEFAULT_COMPRESSION_LEVEL,
+    DEFAULT_FULL_EVERY, DEFAULT_SPLIT_SIZE
+)
 from core.navigation import navigate_local_directories, navigate_remote_directories
 from core.remotes import select_remote
 from scripts.generator import generate_transfer_script
 from cron.scheduler import schedule_cron
 from utils.commands import run_script
 from utils.matrix_ui import MatrixUI, MatrixColors
-from utils.validation import get_yes_no, get_int_input, get_user_choice
+from utils.validation import get_yes_no, get_int_input, get_size_input, get_user_choice
 
 
 def create_transfer(config: dict) -> None:
@@ -48,6 +53,37 @@ def create_transfer(config: dict) -> None:
         input("\nPress Enter to continue...")
         return
 
+    watch = False
+    bundle = False
+    bundle_threshold = DEFAULT_BUNDLE_THRESHOLD
+    bundle_size = DEFAULT_BUNDLE_SIZE
+    if os.path.isdir(source):
+        print()
+        watch = get_yes_no("Track changes with a background watcher (inotify) so later runs copy only changed files?")
+        bundle = get_yes_no("Pack small files into tar bundles (far fewer API calls for many small files)?")
+
+    if bundle:
+        bundle_threshold = get_size_input(
+            f"{MatrixColors.MATRIX_GREEN}Bundle files smaller than (e.g., 256K, 4M, default: {DEFAULT_BUNDLE_THRESHOLD}){MatrixColors.RESET}",
+            default=DEFAULT_BUNDLE_THRESHOLD
+        )
+        bundle_size = get_size_input(
+            f"{MatrixColors.MATRIX_GREEN}Target size per bundle (e.g., 32M, 256M, default: {DEFAULT_BUNDLE_SIZE}){MatrixColors.RESET}",
+            default=DEFAULT_BUNDLE_SIZE
+        )
+
+    topup = False
+    full_every = DEFAULT_FULL_EVERY
+    if not watch:
+        print()
+        topup = get_yes_no("Top up: copy only files modified since the last successful run (no destination listing)?")
+    if topup:
+        full_every = get_int_input(
+            f"{MatrixColors.MATRIX_GREEN}Fully reconcile source and destination every N runs (0 = never, default: {DEFAULT_FULL_EVERY}){MatrixColors.RESET}",
+            default=DEFAULT_FULL_EVERY,
+            min_val=0
+        )
+
     # Step 3: Select destination
     MatrixUI.clear_screen()
     MatrixUI.print_header("CREATE TRANSFER JOB", f"Job: {job_id}")
@@ -70,7 +106,6 @@ def create_transfer(config: dict) -> None:
     
     compress = get_yes_no("Do you want to compress files before transfer?")
     compression_level = None
-    cores = None
     split_files = False
     split_size = None
 
@@ -82,11 +117,6 @@ def create_transfer(config: dict) -> None:
             min_val=1,
             max_val=9
         )
-        cores = get_int_input(
-            f"{MatrixColors.MATRIX_GREEN}Number of CPU cores (default: {DEFAULT_CORES}){MatrixColors.RESET}",
-            default=DEFAULT_CORES,
-            min_val=1
-        )
 
         print()
         split_files = get_yes_no("Do you want to split the compressed archive?")
@@ -111,7 +141,12 @@ def create_transfer(config: dict) -> None:
         "compression_level": compression_level,
         "split_files": split_files,
         "split_size": split_size,
-        "cores": cores,
+        "watch": watch,
+        "topup": topup,
+        "full_every": full_every,
+        "bundle": bundle,
+        "bundle_threshold": bundle_threshold,
+        "bundle_size": bundle_size,
         "rclone_flags": rclone_flags,
     }
     
@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+"""
+Pipeline package for BackupBuddy.
+
+Helpers in this package are invoked by the generated shell scripts
+(`python3 -m pipeline.<module>`) and must only depend on the standard library.
+"""
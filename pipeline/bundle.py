@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Small-file bundling for plain copy backups and transfers.
+
+Every file rclone copies costs at least one API call, so a tree of millions
+of small files takes days on a remote limited to a few transactions per
+second. `pack` stores the files below a size threshold in plain tar
+bundles of about the target size under `<remote>/.backupbuddy/bundles/`;
+larger files are still copied as they are (by rclone with `--min-size`).
+The number of uploads then grows with the bytes, not with the file count.
+
+Bundles are named after the paths, sizes and mtimes of their members, and
+the cut points between them are chosen by a hash of the member paths, so a
+change to one file only changes the bundle holding it: a repeated run lists
+the bundle directory once, uploads the bundles that are not stored yet and
+deletes the ones no longer referenced. `index.json.gz` maps every bundle to
+its files and is replaced only after all bundles are uploaded.
+
+`unpack` extracts every bundle of the index into a target directory,
+several at a time. It runs after the large files have been restored.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import stat
+import subprocess
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AbstractSet, Dict, List, Optional, Set, Tuple
+
+from pipeline.filters import load_excluded
+from pipeline.rclone import rclone_command, run_rclone, share_bandwidth
+from pipeline.units import parse_size
+from pipeline.walk import walk_tree
+
+BUNDLE_DIR = ".backupbuddy/bundles"
+INDEX_FILE = "index.json.gz"
+INDEX_VERSION = 1
+# tar stores every member as a 512-byte header plus its data padded to 512 bytes
+TAR_BLOCK = 512
+
+
+def _tar_size(size: int) -> int:
+    return TAR_BLOCK + -(-size // TAR_BLOCK) * TAR_BLOCK
+
+
+def _is_cut(path: str, weight: int, target: int) -> bool:
+    """Whether a bundle ends after `path`; about one cut per `target` bytes past the minimum size."""
+    return zlib.crc32(os.fsencode(path)) < (1 << 32) * min(1.0, weight / (target * 3 / 4))
+
+
+def _bundle_name(files: List[List]) -> str:
+    digest = hashlib.sha256()
+    for path, size, mtime in files:
+        digest.update(os.fsencode(path) + f"\0{size}\0{mtime}\n".encode())
+    return f"{digest.hexdigest()[:32]}.tar"
+
+
+def plan_bundles(source: str, threshold: int, target: int, exclude: AbstractSet[str] = frozenset()) -> List[Dict]:
+    """
+    Group the regular files below `threshold` bytes into bundles of about `target` bytes.
+
+    Files are taken in path order. A bundle is at least a quarter and at
+    most twice the target size; in between, it ends after a file whose path
+    hash says so, which keeps the other bundles stable when files are added,
+    changed or removed.
+
+    Returns:
+        [{"name": str, "bytes": int, "files": [[path, size, mtime_ns]]}]
+    """
+    small = sorted(
+        [path, st.st_size, st.st_mtime_ns] for path, st in walk_tree(source, exclude)
+        if stat.S_ISREG(st.st_mode) and st.st_size < threshold
+    )
+
+    bundles = []
+    current = []
+    weight = 0
+    for entry in small:
+        current.append(entry)
+        file_weight = _tar_size(entry[1])
+        weight += file_weight
+        if weight >= target * 2 or (weight >= target // 4 and _is_cut(entry[0], file_weight, target)):
+            bundles.append({"name": _bundle_name(current), "bytes": weight, "files": current})
+            current = []
+            weight = 0
+    if current:
+        bundles.append({"name": _bundle_name(current), "bytes": weight, "files": current})
+    return bundles
+
+
+def _list_stored(bundle_dir: str, rclone_flags: str) -> Set[str]:
+    """Return the file names in the remote bundle directory (one listing, no recursion)."""
+    try:
+        result = run_rclone(["lsf", "--files-only", f"{bundle_dir}/"], rclone_flags, capture_output=True)
+    except subprocess.CalledProcessError:
+        return set()
+    return {line for line in result.stdout.decode().splitlines() if line.strip()}
+
+
+def _check(processes: List[Tuple[subprocess.Popen, str]]) -> None:
+    for process, name in processes:
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, name)
+
+
+def _upload_bundle(source: str, list_path: Path, destination: str, rclone_flags: str) -> None:
+    """Stream tar | rclone rcat for one bundle."""
+    # A file removed since the scan is left out; its bundle is rebuilt on the next run
+    tar = subprocess.Popen(
+        ["tar", "-cf", "-", "-C", source, "--ignore-failed-read", "--null", "--no-recursion", "-T", str(list_path)],
+        stdout=subprocess.PIPE
+    )
+    upload = subprocess.Popen(rclone_command(["rcat", destination], rclone_flags), stdin=tar.stdout)
+    tar.stdout.close()
+    _check([(upload, "rclone rcat"), (tar, "tar")])
+
+
+def pack(source: str, remote: str, work_dir: Path, threshold: int, target: int, workers: int = 4,
+         rclone_flags: str = "", exclude_from: Optional[Path] = None) -> Dict:
+    """
+    Upload the small files of `source` as bundles and replace the bundle index.
+
+    Args:
+        source: Source directory
+        remote: Remote directory the large files are copied to
+        work_dir: Directory for the bundle file lists
+        threshold: Files smaller than this many bytes are bundled
+        target: Average bundle size in bytes
+        workers: Bundles uploaded at the same time
+        rclone_flags: Job rclone flags
+        exclude_from: Excluded paths written by pipeline.filters
+
+    Returns:
+        The uploaded index
+    """
+    started = time.time()
+    bundles = plan_bundles(source, threshold, target, load_excluded(exclude_from))
+    bundle_dir = f"{remote.rstrip('/')}/{BUNDLE_DIR}"
+    stored = _list_stored(bundle_dir, rclone_flags)
+    missing = [bundle for bundle in bundles if bundle["name"] not in stored]
+    print(f"Bundling {sum(len(bundle['files']) for bundle in bundles)} small files into {len(bundles)} bundles, "
+          f"{len(missing)} new or changed", file=sys.stderr)
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    upload_flags = share_bandwidth(rclone_flags, min(max(1, workers), len(missing)))
+
+    def upload(bundle: Dict) -> None:
+        list_path = work_dir / f"{bundle['name']}.lst"
+        with open(list_path, "wb") as file:
+            for path, _, _ in bundle["files"]:
+                file.write(os.fsencode(path) + b"\0")
+        try:
+            _upload_bundle(source, list_path, f"{bundle_dir}/{bundle['name']}", upload_flags)
+        finally:
+            list_path.unlink()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for future in [pool.submit(upload, bundle) for bundle in missing]:
+            future.result()
+
+    index = {
+        "version": INDEX_VERSION,
+        "created": int(time.time()),
+        "threshold": threshold,
+        "bundles": [{"name": bundle["name"], "bytes": bundle["bytes"],
+                     "files": [path for path, _, _ in bundle["files"]]} for bundle in bundles],
+    }
+    index_path = work_dir / INDEX_FILE
+    with gzip.open(index_path, "wt") as file:
+        json.dump(index, file, separators=(",", ":"))
+    run_rclone(["copyto", str(index_path), f"{bundle_dir}/{INDEX_FILE}"], rclone_flags)
+
+    stale = sorted(stored - {bundle["name"] for bundle in bundles} - {INDEX_FILE})
+    if stale:
+        list_path = work_dir / "stale.lst"
+        list_path.write_text("".join(f"{name}\n" for name in stale))
+        run_rclone(["delete", bundle_dir, "--files-from-raw", str(list_path)], rclone_flags)
+
+    print(f"Uploaded {len(missing)} bundles ({sum(bundle['bytes'] for bundle in missing) / 1024 ** 2:.1f} MiB), "
+          f"removed {len(stale)} in {time.time() - started:.1f} s", file=sys.stderr)
+    return index
+
+
+def load_index(remote: str, rclone_flags: str = "") -> Optional[Dict]:
+    """Return the bundle index stored below `remote`, or None if it has none."""
+    try:
+        result = run_rclone(["cat", f"{remote.rstrip('/')}/{BUNDLE_DIR}/{INDEX_FILE}"], rclone_flags,
+                            capture_output=True)
+        return json.loads(gzip.decompress(result.stdout))
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None
+
+
+def _extract_bundle(source: str, target: str, rclone_flags: str) -> None:
+    """Stream rclone cat | tar -x for one bundle."""
+    download = subprocess.Popen(rclone_command(["cat", source], rclone_flags), stdout=subprocess.PIPE)
+    tar = subprocess.Popen(["tar", "-xf", "-", "-C", target], stdin=download.stdout)
+    download.stdout.close()
+    _check([(tar, "tar"), (download, "rclone cat")])
+
+
+def unpack(remote: str, target: str, workers: int = 4, rclone_flags: str = "") -> Optional[Dict]:
+    """
+    Extract every bundle listed in the index below `remote` into `target`.
+
+    Returns:
+        The index, or None if `remote` holds no bundles
+    """
+    index = load_index(remote, rclone_flags)
+    if index is None:
+        print(f"No bundles found under {remote}", file=sys.stderr)
+        return None
+
+    bundle_dir = f"{remote.rstrip('/')}/{BUNDLE_DIR}"
+    os.makedirs(target, exist_ok=True)
+    print(f"Extracting {len(index['bundles'])} bundles, {max(1, workers)} at a time...", file=sys.stderr)
+    download_flags = share_bandwidth(rclone_flags, min(max(1, workers), len(index["bundles"])))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(_extract_bundle, f"{bundle_dir}/{bundle['name']}", target, download_flags)
+                   for bundle in index["bundles"]]
+        for future in futures:
+            future.result()
+    return index
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="Upload the small files of a source as bundles")
+    pack_parser.add_argument("--source", required=True)
+    pack_parser.add_argument("--remote", required=True, help="Remote directory the large files are copied to")
+    pack_parser.add_argument("--work-dir", required=True, type=Path)
+    pack_parser.add_argument("--threshold", default="1M", help="Bundle files smaller than this")
+    pack_parser.add_argument("--size", default="64M", help="Average bundle size")
+    pack_parser.add_argument("--workers", type=int, default=4, help="Parallel bundle uploads")
+    pack_parser.add_argument("--rclone-flags", default="")
+    pack_parser.add_argument("--exclude-from", type=Path, help="Excluded paths written by pipeline.filters")
+
+    unpack_parser = subparsers.add_parser("unpack", help="Extract the bundles of a remote directory")
+    unpack_parser.add_argument("--remote", required=True)
+    unpack_parser.add_argument("--target", required=True)
+    unpack_parser.add_argument("--workers", type=int, default=4, help="Parallel bundle downloads")
+    unpack_parser.add_argument("--rclone-flags", default="")
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "pack":
+            pack(args.source, args.remote, args.work_dir, parse_size(args.threshold), parse_size(args.size),
+                 args.workers, args.rclone_flags, args.exclude_from)
+        else:
+            unpack(args.remote, args.target, args.workers, args.rclone_flags)
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        print(f"Bundle {args.command} failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
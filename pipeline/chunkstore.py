@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Content-defined chunking deduplication store for backup jobs.
+
+`backup` reads a tar stream from stdin, cuts it into content-defined chunks,
+and uploads only the chunks the repository does not hold yet. Chunks are
+addressed by the SHA-256 of their content and stored as
+`<repo>/chunks/<aa>/<hash>`; every run writes a snapshot manifest
+`<repo>/snapshots/<run id>.json` listing its chunk IDs in order.
+
+A local chunk index (one hash per line in the job's state directory)
+answers "already stored?" without remote listings. It is rebuilt from a
+single remote listing when missing.
+
+`restore` writes the tar stream of a snapshot to stdout, fetching chunks in
+batches while the previous batch is being written out.
+"""
+
+import argparse
+import hashlib
+import json
+import shutil
+import subprocess
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from pipeline.rclone import run_rclone
+
+READ_SIZE = 4 * 1024 * 1024
+MIN_CHUNK = 512 * 1024
+MAX_CHUNK = 8 * 1024 * 1024
+SCAN_STEP = 1024 * 1024
+UPLOAD_BATCH = 128 * 1024 * 1024
+RESTORE_BATCH = 64 * 1024 * 1024
+
+INDEX_FILE = "chunks.idx"
+RAW, DEFLATED = b"R", b"Z"
+
+# Cut-point fingerprint: each position gets an 8-bit lane hash of the next
+# WINDOW bytes (XOR of per-offset lookup tables). Positions whose lane is 0
+# are candidates; a candidate becomes a cut point when the CRC-32 of the
+# STRONG_WINDOW bytes before it matches CUT_MASK. That gives one cut roughly
+# every 256 * 4096 bytes past MIN_CHUNK, independent of where the data sits
+# in the stream. The lanes are computed with bytes.translate and big-integer
+# XOR/shift so the scan runs at C speed instead of one Python step per byte.
+WINDOW = 8
+STRONG_WINDOW = 64
+CUT_MASK = 0xFFF
+_SEED = hashlib.sha256(b"backupbuddy-chunker-v1").digest()
+_LANE_TABLES = [
+    bytes(hashlib.sha256(_SEED + bytes([offset, value])).digest()[0] for value in range(256))
+    for offset in range(WINDOW)
+]
+
+
+class Chunker:
+    """Split a byte stream into content-defined chunks."""
+
+    def __init__(self, min_size: int = MIN_CHUNK, max_size: int = MAX_CHUNK):
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def chunks(self, stream) -> Iterator[bytes]:
+        """Yield consecutive chunks of `stream` until EOF."""
+        pending = b""
+        eof = False
+
+        while True:
+            if not eof and len(pending) < self.max_size + WINDOW:
+                parts = [pending]
+                size = len(pending)
+                while size < self.max_size + WINDOW:
+                    data = stream.read(READ_SIZE)
+                    if not data:
+                        eof = True
+                        break
+                    parts.append(data)
+                    size += len(data)
+                pending = b"".join(parts)
+
+            if not pending:
+                return
+
+            cut = self.find_cut(pending)
+            yield pending[:cut]
+            pending = pending[cut:]
+
+    def find_cut(self, data: bytes) -> int:
+        """Return the length of the next chunk at the start of `data`."""
+        limit = min(len(data), self.max_size)
+        if limit <= self.min_size:
+            return limit
+
+        # Candidate positions p cut the chunk at p + WINDOW
+        start = self.min_size - WINDOW
+        end = min(len(data), self.max_size) - WINDOW + 1
+        while start < end:
+            stop = min(start + SCAN_STEP, end)
+            lanes = _lane_hashes(data[start:stop + WINDOW - 1])
+            position = lanes.find(0, 0, stop - start)
+            while position != -1:
+                cut = start + position + WINDOW
+                if zlib.crc32(data[cut - STRONG_WINDOW:cut]) & CUT_MASK == 0:
+                    return cut
+                position = lanes.find(0, position + 1, stop - start)
+            start = stop
+
+        return limit
+
+
+def _lane_hashes(data: bytes) -> bytes:
+    """Return the 8-bit window hash for every position of `data`."""
+    value = 0
+    for offset, table in enumerate(_LANE_TABLES):
+        value ^= int.from_bytes(data.translate(table), "little") >> (8 * offset)
+    return value.to_bytes(len(data), "little")
+
+
+class ChunkIndex:
+    """Local record of the chunk IDs already stored in the repository."""
+
+    def __init__(self, state_dir: Path, repo: str, rclone_flags: str):
+        self.path = state_dir / INDEX_FILE
+        self.repo = repo
+        self.rclone_flags = rclone_flags
+        self.hashes = set()
+
+    def load(self) -> None:
+        """Load the index, rebuilding it from one remote listing if missing."""
+        if self.path.exists():
+            with open(self.path) as file:
+                self.hashes = {line.strip() for line in file if line.strip()}
+            return
+
+        print("Chunk index missing, rebuilding from remote listing...", file=sys.stderr)
+        try:
+            result = run_rclone(["lsf", "-R", "--files-only", f"{self.repo}/chunks"],
+                                self.rclone_flags, capture_output=True)
+            names = result.stdout.decode().splitlines()
+        except subprocess.CalledProcessError:
+            names = []
+        self.hashes = {name.rsplit("/", 1)[-1] for name in names if name.strip()}
+        self.add(sorted(self.hashes))
+
+    def add(self, hashes: List[str]) -> None:
+        """Record chunks confirmed on the remote."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as file:
+            for chunk_id in hashes:
+                file.write(chunk_id + "\n")
+        self.hashes.update(hashes)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.hashes
+
+
+def object_path(chunk_id: str) -> str:
+    """Return the repository-relative object path of a chunk."""
+    return f"{chunk_id[:2]}/{chunk_id}"
+
+
+def encode_chunk(data: bytes, level: int) -> bytes:
+    """Deflate a chunk, keeping it raw when compression does not pay off."""
+    compressed = zlib.compress(data, level)
+    if len(compressed) < len(data):
+        return DEFLATED + compressed
+    return RAW + data
+
+
+def decode_chunk(blob: bytes) -> bytes:
+    """Reverse encode_chunk."""
+    if blob[:1] == DEFLATED:
+        return zlib.decompress(blob[1:])
+    return blob[1:]
+
+
+class BatchUploader:
+    """Spool new chunks locally and upload them in batches with `rclone copy`."""
+
+    def __init__(self, index: ChunkIndex, work_dir: Path, threads: int):
+        self.index = index
+        self.work_dir = work_dir
+        self._compress_pool = ThreadPoolExecutor(max_workers=max(1, threads))
+        self._upload_pool = ThreadPoolExecutor(max_workers=1)
+        self._upload = None
+        self._batch_number = 0
+        self._new_batch()
+
+    def add(self, chunk_id: str, data: bytes, level: int) -> None:
+        """Queue a chunk for compression and upload."""
+        self._futures.append(self._compress_pool.submit(self._spool, chunk_id, data, level))
+        self._ids.append(chunk_id)
+        self._size += len(data)
+        if self._size >= UPLOAD_BATCH:
+            self.flush()
+
+    def flush(self) -> None:
+        """Hand the current batch to the uploader (at most one batch in flight)."""
+        for future in self._futures:
+            future.result()
+        if self._ids:
+            if self._upload is not None:
+                self._upload.result()
+            self._upload = self._upload_pool.submit(self._send, self._batch_dir, list(self._ids))
+        self._new_batch()
+
+    def close(self) -> None:
+        """Upload everything still pending."""
+        self.flush()
+        if self._upload is not None:
+            self._upload.result()
+        self._compress_pool.shutdown()
+        self._upload_pool.shutdown()
+
+    def _new_batch(self) -> None:
+        self._batch_number += 1
+        self._batch_dir = self.work_dir / f"batch-{self._batch_number}"
+        self._futures = []
+        self._ids = []
+        self._size = 0
+
+    def _spool(self, chunk_id: str, data: bytes, level: int) -> None:
+        path = self._batch_dir / object_path(chunk_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(encode_chunk(data, level))
+
+    def _send(self, batch_dir: Path, chunk_ids: List[str]) -> None:
+        run_rclone(["copy", str(batch_dir), f"{self.index.repo}/chunks"], self.index.rclone_flags)
+        self.index.add(chunk_ids)
+        shutil.rmtree(batch_dir)
+
+
+def backup(stream, state_dir: Path, repo: str, work_dir: Path, run_id: str,
+           level: int, threads: int, rclone_flags: str) -> dict:
+    """
+    Store the stream in the repository and write a snapshot manifest.
+
+    Returns:
+        The snapshot manifest
+    """
+    work_dir.mkdir(parents=True, exist_ok=True)
+    index = ChunkIndex(state_dir, repo, rclone_flags)
+    index.load()
+    uploader = BatchUploader(index, work_dir, threads)
+
+    chunk_ids = []
+    queued = set()
+    total = new_bytes = 0
+
+    try:
+        for data in Chunker().chunks(stream):
+            chunk_id = hashlib.sha256(data).hexdigest()
+            chunk_ids.append(chunk_id)
+            total += len(data)
+            if chunk_id not in index and chunk_id not in queued:
+                queued.add(chunk_id)
+                new_bytes += len(data)
+                uploader.add(chunk_id, data, level)
+    finally:
+        uploader.close()
+
+    manifest = {
+        "version": 1,
+        "run_id": run_id,
+        "created": int(time.time()),
+        "size": total,
+        "chunks": chunk_ids,
+    }
+    manifest_path = work_dir / f"{run_id}.json"
+    manifest_path.write_text(json.dumps(manifest))
+    run_rclone(["copyto", str(manifest_path), f"{repo}/snapshots/{run_id}.json"], rclone_flags)
+    manifest_path.unlink()
+
+    print(f"Snapshot {run_id}: {len(chunk_ids)} chunks, {total} bytes, "
+          f"{len(queued)} new chunks ({new_bytes} bytes) uploaded", file=sys.stderr)
+    return manifest
+
+
+def load_manifest(repo: str, snapshot: Optional[str], rclone_flags: str) -> dict:
+    """Fetch a snapshot manifest, defaulting to the newest one."""
+    if not snapshot:
+        result = run_rclone(["lsf", "--files-only", f"{repo}/snapshots"], rclone_flags, capture_output=True)
+        names = sorted(name for name in result.stdout.decode().splitlines() if name.endswith(".json"))
+        if not names:
+            raise FileNotFoundError(f"No snapshots found in {repo}")
+        snapshot = names[-1][:-len(".json")]
+
+    result = run_rclone(["cat", f"{repo}/snapshots/{snapshot}.json"], rclone_flags, capture_output=True)
+    return json.loads(result.stdout)
+
+
+def restore(output, state_dir: Path, repo: str, work_dir: Path, snapshot: Optional[str],
+            rclone_flags: str) -> None:
+    """Write the tar stream of a snapshot to `output`."""
+    manifest = load_manifest(repo, snapshot, rclone_flags)
+    chunk_ids = manifest["chunks"]
+
+    index = ChunkIndex(state_dir, repo, rclone_flags)
+    if index.path.exists():
+        index.load()
+        unknown = {chunk_id for chunk_id in chunk_ids if chunk_id not in index}
+        if unknown:
+            print(f"Warning: {len(unknown)} chunks are not in the local index", file=sys.stderr)
+
+    batches = _plan_batches(chunk_ids)
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        pending = prefetch.submit(_fetch_batch, repo, work_dir, 0, batches[0], rclone_flags) if batches else None
+        for number, batch in enumerate(batches):
+            batch_dir = pending.result()
+            if number + 1 < len(batches):
+                pending = prefetch.submit(_fetch_batch, repo, work_dir, number + 1, batches[number + 1], rclone_flags)
+
+            for chunk_id in batch:
+                data = decode_chunk((batch_dir / object_path(chunk_id)).read_bytes())
+                if hashlib.sha256(data).hexdigest() != chunk_id:
+                    raise ValueError(f"Chunk {chunk_id} is corrupt")
+                output.write(data)
+            shutil.rmtree(batch_dir)
+
+    output.flush()
+
+
+def _plan_batches(chunk_ids: List[str]) -> List[List[str]]:
+    """Group the manifest into download batches of roughly RESTORE_BATCH bytes."""
+    average_chunk = MIN_CHUNK + 256 * (CUT_MASK + 1)
+    per_batch = max(1, RESTORE_BATCH // average_chunk)
+    return [chunk_ids[i:i + per_batch] for i in range(0, len(chunk_ids), per_batch)]
+
+
+def _fetch_batch(repo: str, work_dir: Path, number: int, batch: List[str], rclone_flags: str) -> Path:
+    batch_dir = work_dir / f"restore-{number}"
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    list_path = work_dir / f"restore-{number}.lst"
+    list_path.write_text("".join(object_path(chunk_id) + "\n" for chunk_id in sorted(set(batch))))
+    run_rclone(["copy", f"{repo}/chunks", str(batch_dir), "--files-from-raw", str(list_path)], rclone_flags)
+    list_path.unlink()
+    return batch_dir
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("backup", "restore"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--state-dir", required=True, type=Path)
+        sub.add_argument("--repo", required=True, help="Remote repository directory")
+        sub.add_argument("--work-dir", required=True, type=Path)
+        sub.add_argument("--rclone-flags", default="")
+        if name == "backup":
+            sub.add_argument("--run-id", required=True)
+            sub.add_argument("--level", type=int, default=6)
+            sub.add_argument("--threads", type=int, default=4)
+        else:
+            sub.add_argument("--snapshot", help="Snapshot ID (default: newest)")
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "backup":
+            backup(sys.stdin.buffer, args.state_dir, args.repo, args.work_dir, args.run_id,
+                   args.level, args.threads, args.rclone_flags)
+        else:
+            restore(sys.stdout.buffer, args.state_dir, args.repo, args.work_dir, args.snapshot,
+                    args.rclone_flags)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        print(f"Chunk store {args.command} failed: {e}", file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
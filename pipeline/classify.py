@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Route incompressible content around the compressor.
+
+`pack` sorts the entries of a backup into two streams: files that are
+already compressed (media, archives; recognised by extension or by a
+trial compression of their first bytes) and everything else. The regular
+entries are compressed at the job's level, the incompressible ones with
+the codec's cheapest setting (`pigz -0`, i.e. stored, for gzip), and both
+members are written to stdout one after the other. The result is a single
+valid .tar.gz/.tar.zst whose two tar archives are extracted with `tar -i`
+(--ignore-zeros).
+
+Per-run statistics (bytes in/out and CPU seconds per stream) are printed
+and written to a JSON file for the job.
+"""
+
+import argparse
+import json
+import os
+import resource
+import stat
+import subprocess
+import sys
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pipeline.codecs import CODECS, GZIP, compress_command, stored_command
+from pipeline.filters import load_excluded
+from pipeline.walk import walk_tree
+
+# Extensions whose content is compressed already
+INCOMPRESSIBLE_EXTENSIONS = {
+    # images
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "heif", "avif", "jxl",
+    # video / audio
+    "mp4", "m4v", "mov", "mkv", "avi", "webm", "wmv", "flv", "mpg", "mpeg",
+    "mp3", "m4a", "aac", "ogg", "oga", "opus", "flac", "wma",
+    # archives and compressed files
+    "zip", "gz", "tgz", "bz2", "tbz2", "xz", "txz", "zst", "lz4", "lzma", "7z", "rar",
+    "jar", "war", "apk", "deb", "rpm", "cab", "br",
+    # zip based documents and fonts
+    "docx", "xlsx", "pptx", "odt", "ods", "odp", "epub", "woff", "woff2",
+}
+
+SAMPLE_SIZE = 32 * 1024
+# Files below this size always go to the compressed stream; sampling them
+# would cost more I/O than storing them uncompressed saves
+MIN_SAMPLE_FILE = 64 * 1024
+# A sample that deflates to more than this fraction counts as incompressible
+INCOMPRESSIBLE_RATIO = 0.97
+
+STATS_FILE = "compression_stats.json"
+COPY_SIZE = 1024 * 1024
+
+
+def sample_ratio(path: str) -> float:
+    """Return compressed/original size of the first SAMPLE_SIZE bytes of `path`."""
+    try:
+        with open(path, "rb") as file:
+            sample = file.read(SAMPLE_SIZE)
+    except OSError:
+        return 0.0
+    if not sample:
+        return 0.0
+    return len(zlib.compress(sample, 1)) / len(sample)
+
+
+def is_incompressible(path: str, size: int) -> bool:
+    """Decide whether a regular file should bypass the compressor."""
+    extension = os.path.splitext(path)[1][1:].lower()
+    if extension in INCOMPRESSIBLE_EXTENSIONS:
+        return True
+    if size < MIN_SAMPLE_FILE:
+        return False
+    return sample_ratio(path) > INCOMPRESSIBLE_RATIO
+
+
+def classify(source: str, entries: Iterable[Tuple[str, os.stat_result]]) -> Tuple[List[str], List[str], Dict]:
+    """
+    Split entries into the compressed and the stored stream.
+
+    Directories, symlinks and special files always go to the compressed
+    stream, so directories are created before the stored files land in them.
+
+    Returns:
+        (compress_list, store_list, input byte counts per stream)
+    """
+    compress, store = [], []
+    sizes = {"compressed": 0, "stored": 0}
+
+    for rel_path, st in entries:
+        if stat.S_ISREG(st.st_mode) and is_incompressible(os.path.join(source, rel_path), st.st_size):
+            store.append(rel_path)
+            sizes["stored"] += st.st_size
+        else:
+            compress.append(rel_path)
+            if stat.S_ISREG(st.st_mode):
+                sizes["compressed"] += st.st_size
+
+    return sorted(compress), sorted(store), sizes
+
+
+def listed_entries(source: str, list_path: Path) -> Iterable[Tuple[str, os.stat_result]]:
+    """Yield (path, lstat) for a NUL separated path list, skipping vanished entries."""
+    with open(list_path, "rb") as file:
+        names = file.read().split(b"\0")
+    for name in names:
+        if not name:
+            continue
+        rel_path = os.fsdecode(name)
+        try:
+            yield rel_path, os.lstat(os.path.join(source, rel_path))
+        except OSError:
+            continue
+
+
+def _write_list(path: Path, entries: List[str]) -> None:
+    with open(path, "wb") as file:
+        for entry in entries:
+            file.write(os.fsencode(entry) + b"\0")
+
+
+def _run_member(source: str, list_path: Path, compressor: List[str], output) -> Tuple[int, float]:
+    """
+    Archive the entries in `list_path` as one compressed member written to `output`.
+
+    Returns:
+        (bytes written, CPU seconds used by tar and the compressor)
+    """
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    tar = subprocess.Popen(
+        ["tar", "-cf", "-", "-C", source, "--null", "--no-recursion", "-T", str(list_path)],
+        stdout=subprocess.PIPE
+    )
+    compress = subprocess.Popen(compressor, stdin=tar.stdout, stdout=subprocess.PIPE)
+    tar.stdout.close()
+
+    written = 0
+    while True:
+        data = compress.stdout.read(COPY_SIZE)
+        if not data:
+            break
+        output.write(data)
+        written += len(data)
+
+    compress.wait()
+    tar.wait()
+    for process, name in ((tar, "tar"), (compress, compressor[0])):
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, name)
+
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return written, cpu
+
+
+def pack(source: str, work_dir: Path, level: int, cores: int, output,
+         from_list: Optional[Path] = None, stats_path: Optional[Path] = None,
+         codec: str = GZIP, long_mode: bool = False, exclude_from: Optional[Path] = None) -> Dict:
+    """
+    Write the classified two-member archive of `source` to `output`.
+
+    Args:
+        source: Source directory
+        work_dir: Directory for the temporary path lists
+        level: Compression level for the compressed stream
+        cores: Compressor threads
+        output: Binary stream to write to
+        from_list: Optional NUL separated list of entries to archive (default: whole tree)
+        stats_path: Where to write the run statistics
+        codec: "gzip" or "zstd"
+        long_mode: Use zstd long-distance matching for the compressed stream
+        exclude_from: Excluded paths written by pipeline.filters (whole-tree runs only)
+
+    Returns:
+        The run statistics
+    """
+    entries = listed_entries(source, from_list) if from_list else walk_tree(source, load_excluded(exclude_from))
+    compress, store, sizes = classify(source, entries)
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    lists = {"compressed": work_dir / "compress.lst", "stored": work_dir / "store.lst"}
+    _write_list(lists["compressed"], compress)
+    _write_list(lists["stored"], store)
+
+    compressors = {
+        "compressed": compress_command(codec, level, cores, long_mode),
+        "stored": stored_command(codec, cores),
+    }
+    stats = {"created": int(time.time()), "codec": codec, "level": level}
+    for name, count in (("compressed", len(compress)), ("stored", len(store))):
+        written, cpu = _run_member(source, lists[name], compressors[name], output)
+        stats[name] = {"entries": count, "input_bytes": sizes[name], "output_bytes": written, "cpu_seconds": round(cpu, 2)}
+        lists[name].unlink()
+    output.flush()
+
+    if stats_path:
+        stats_path.parent.mkdir(parents=True, exist_ok=True)
+        stats_path.write_text(json.dumps(stats, indent=2))
+
+    _print_stats(stats)
+    return stats
+
+
+def _print_stats(stats: Dict) -> None:
+    mib = 1024 ** 2
+    compressed, stored = stats["compressed"], stats["stored"]
+    saved = compressed["input_bytes"] - compressed["output_bytes"]
+    print(f"Compressed stream: {compressed['entries']} entries, {compressed['input_bytes'] / mib:.1f} MiB -> "
+          f"{compressed['output_bytes'] / mib:.1f} MiB, saved {saved / mib:.1f} MiB "
+          f"using {compressed['cpu_seconds']:.1f} CPU s", file=sys.stderr)
+    print(f"Stored stream: {stored['entries']} files, {stored['input_bytes'] / mib:.1f} MiB passed through "
+          f"using {stored['cpu_seconds']:.1f} CPU s", file=sys.stderr)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="Write a classified .tar.gz to stdout")
+    pack_parser.add_argument("--source", required=True)
+    pack_parser.add_argument("--work-dir", required=True, type=Path)
+    pack_parser.add_argument("--codec", choices=CODECS, default=GZIP)
+    pack_parser.add_argument("--level", type=int, default=6)
+    pack_parser.add_argument("--long", action="store_true", help="zstd long-distance matching")
+    pack_parser.add_argument("--cores", type=int, default=4)
+    pack_parser.add_argument("--from", dest="from_list", type=Path, help="NUL separated entry list (default: whole tree)")
+    pack_parser.add_argument("--stats-file", type=Path)
+    pack_parser.add_argument("--exclude-from", type=Path, help="Excluded paths written by pipeline.filters")
+
+    args = parser.parse_args(argv)
+
+    try:
+        pack(args.source, args.work_dir, args.level, args.cores, sys.stdout.buffer, args.from_list, args.stats_file,
+             args.codec, args.long, args.exclude_from)
+    except subprocess.CalledProcessError as e:
+        print(f"Archiving failed: {e}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Compression codecs for BackupBuddy archives.
+
+Backups are written with gzip (pigz) or zstd. Restore does not rely on the
+job configuration to pick the decompressor: `decompressor` reads the
+archive's magic bytes, so archives written before a job switched codecs
+still restore.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List
+
+GZIP = "gzip"
+ZSTD = "zstd"
+CODECS = (GZIP, ZSTD)
+
+EXTENSIONS = {GZIP: "gz", ZSTD: "zst"}
+LEVELS = {GZIP: (1, 9), ZSTD: (1, 19)}
+
+_MAGIC = {
+    b"\x1f\x8b": GZIP,
+    b"\x28\xb5\x2f\xfd": ZSTD,
+}
+
+
+def compress_command(codec: str, level, threads, long_mode: bool = False) -> List[str]:
+    """
+    Return the argv of a compressor reading stdin and writing stdout.
+
+    `level` and `threads` may be shell expressions when the command is
+    embedded in a generated script.
+    """
+    if codec == ZSTD:
+        command = ["zstd", f"-{level}", f"-T{threads}", "-q", "-c"]
+        if long_mode:
+            command.append("--long")
+        return command
+    return ["pigz", f"-{level}", "-p", str(threads)]
+
+
+def stored_command(codec: str, threads) -> List[str]:
+    """Return the argv of the cheapest compressor setting for incompressible data."""
+    if codec == ZSTD:
+        # zstd has no stored level, but level 1 emits raw blocks for
+        # incompressible input at close to copy speed
+        return ["zstd", "-1", f"-T{threads}", "-q", "-c"]
+    return ["pigz", "-0", "-p", str(threads)]
+
+
+def decompress_command(codec: str) -> List[str]:
+    """Return the argv of a decompressor reading stdin and writing stdout."""
+    if codec == ZSTD:
+        # --long=31 only raises the window limit, so it also reads archives
+        # written without --long
+        return ["zstd", "-d", "-c", "-q", "--long=31"]
+    return ["pigz", "-d", "-c"]
+
+
+def codec_from_magic(head: bytes) -> str:
+    """
+    Identify a codec from the first bytes of an archive.
+
+    Raises:
+        ValueError: If the data is neither gzip nor zstd
+    """
+    for magic, codec in _MAGIC.items():
+        if head.startswith(magic):
+            return codec
+    raise ValueError("unknown archive format")
+
+
+def detect_codec(path: Path) -> str:
+    """
+    Identify an archive file's codec from its first bytes.
+
+    Raises:
+        ValueError: If the file is neither gzip nor zstd
+    """
+    with open(path, "rb") as file:
+        head = file.read(4)
+    try:
+        return codec_from_magic(head)
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    detect_parser = subparsers.add_parser("decompressor", help="Print the decompress command for an archive")
+    detect_parser.add_argument("archive", type=Path)
+
+    args = parser.parse_args(argv)
+
+    try:
+        print(" ".join(decompress_command(detect_codec(args.archive))))
+    except (OSError, ValueError) as e:
+        print(f"Cannot detect codec: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Run-time CPU sizing for jobs configured with `cores: auto`.
+
+The usable core count is the smallest of:
+  - the CPUs this process may run on (sched_getaffinity),
+  - the cgroup CPU quota (v2 `cpu.max`, or v1 `cpu.cfs_quota_us`),
+  - the CPUs the host currently leaves idle (CPU count minus 1-minute load).
+
+The CLI prints "<cores> <checkers>" for the generated script and explains
+the decision on stderr.
+"""
+
+import argparse
+import math
+import os
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+MAX_CHECKERS = 16
+
+
+def affinity_cpus() -> int:
+    """Return the number of CPUs this process is allowed to run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _cgroup_paths() -> dict:
+    """Map cgroup controllers (and "" for the v2 hierarchy) to this process' cgroup path."""
+    paths = {}
+    try:
+        with open("/proc/self/cgroup") as file:
+            for line in file:
+                _, controllers, path = line.rstrip("\n").split(":", 2)
+                for controller in controllers.split(","):
+                    paths[controller] = path
+    except (OSError, ValueError):
+        pass
+    return paths
+
+
+def cgroup_quota() -> Optional[float]:
+    """
+    Return the CPU quota of this process' cgroup in CPUs, or None if unlimited.
+
+    For cgroup v2 every level up to the root is checked, since a parent's
+    `cpu.max` limits its children too.
+    """
+    paths = _cgroup_paths()
+    quotas = []
+
+    if "" in paths:
+        directory = CGROUP_ROOT / paths[""].lstrip("/")
+        while True:
+            try:
+                quota, period = (directory / "cpu.max").read_text().split()
+                if quota != "max":
+                    quotas.append(int(quota) / int(period))
+            except (OSError, ValueError):
+                pass
+            if directory == CGROUP_ROOT or CGROUP_ROOT not in directory.parents:
+                break
+            directory = directory.parent
+
+    if "cpu" in paths:
+        for mount in ("cpu", "cpu,cpuacct"):
+            directory = CGROUP_ROOT / mount / paths["cpu"].lstrip("/")
+            try:
+                quota = int((directory / "cpu.cfs_quota_us").read_text())
+                period = int((directory / "cpu.cfs_period_us").read_text())
+            except (OSError, ValueError):
+                continue
+            if quota > 0 and period > 0:
+                quotas.append(quota / period)
+            break
+
+    return min(quotas) if quotas else None
+
+
+def idle_cpus() -> float:
+    """Return the host's CPU count minus its 1-minute load average."""
+    try:
+        load = os.getloadavg()[0]
+    except OSError:
+        load = 0.0
+    return (os.cpu_count() or 1) - load
+
+
+def cpu_limit() -> int:
+    """Return the CPUs this process may use at most (affinity and cgroup quota)."""
+    quota = cgroup_quota()
+    affinity = affinity_cpus()
+    return affinity if quota is None else max(1, min(affinity, math.ceil(quota)))
+
+
+def available_cores(explain: bool = False) -> int:
+    """Return the number of compression threads to use right now (at least 1)."""
+    limit = cpu_limit()
+    idle = idle_cpus()
+    cores = max(1, min(limit, int(idle)))
+
+    if explain:
+        quota = cgroup_quota()
+        quota_text = "none" if quota is None else f"{quota:g} CPUs"
+        print(f"CPU sizing: affinity {affinity_cpus()}, cgroup quota {quota_text}, idle {max(idle, 0):.1f} "
+              f"-> {cores} cores", file=sys.stderr)
+    return cores
+
+
+def checkers_for(cores: int) -> int:
+    """Size rclone --checkers to the core count."""
+    return max(1, min(cores, MAX_CHECKERS))
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quiet", action="store_true", help="Do not explain the decision on stderr")
+    args = parser.parse_args(argv)
+
+    cores = available_cores(explain=not args.quiet)
+    print(cores, checkers_for(cores))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
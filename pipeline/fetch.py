@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Fetch backup archives from the remote for restore.
+
+`download` copies the archive files into a local cache directory. Every
+file is checked against the backup's checksum manifest (pipeline.manifest)
+and re-fetched if it is damaged; progress is kept in RESUME_FILE, so an
+interrupted restore resumes with the missing files, and a partly
+downloaded file continues from its last byte.
+
+`stream` finds the archive in a remote backup directory (the ordered
+`backup-part-*` files of a split backup, or the newest `backup.tar.*`),
+downloads it with parallel ranged reads (pipeline.prefetch) and pipes it, in
+order, through the decompressor matching its magic bytes. The tar stream is
+written to stdout, so a restore is `python3 -m pipeline.fetch stream ... |
+tar -x` and needs no local copy of the archive.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from pipeline.codecs import codec_from_magic, decompress_command
+from pipeline.manifest import load_manifest
+from pipeline.prefetch import RETRIES, PrefetchReader
+from pipeline.rclone import rclone_command, run_rclone, share_bandwidth
+from pipeline.workdir import OWNER_FILE, RESUME_FILE
+
+PART_PREFIX = "backup-part-"
+ARCHIVE_PREFIX = "backup.tar."
+MAGIC_SIZE = 4
+HASH_BLOCK = 1024 * 1024
+# Name of the per-job restore download cache below TEMP_DIR/<job>
+CACHE_DIR = "restore-cache"
+
+
+def find_archive(remote: str, parts: bool, rclone_flags: str = "") -> List[Tuple[str, int]]:
+    """
+    Return (name, size) of the remote files that make up the archive, in order.
+
+    Backups are listed from their checksum manifest when they have one,
+    which ignores stray parts and archives of older backups.
+
+    Args:
+        remote: Remote backup directory
+        parts: Look for split parts instead of a single archive
+        rclone_flags: Job rclone flags
+
+    Raises:
+        FileNotFoundError: If the directory holds no archive
+    """
+    manifest = load_manifest(remote, rclone_flags)
+    if manifest:
+        return [(item["name"], item["size"]) for item in manifest["files"]]
+    return _list_archive(remote, parts, rclone_flags)
+
+
+def _list_archive(remote: str, parts: bool, rclone_flags: str) -> List[Tuple[str, int]]:
+    """Find the archive of a backup without a manifest by listing the directory."""
+    result = run_rclone(["lsjson", "--files-only", remote], rclone_flags, capture_output=True)
+    files = json.loads(result.stdout or b"[]")
+
+    if parts:
+        names = sorted((item["Name"], item["Size"]) for item in files if item["Name"].startswith(PART_PREFIX))
+    else:
+        # rclone prints ModTime in one RFC 3339 format per remote, so the strings sort by time
+        archives = sorted(
+            (item for item in files if item["Name"].startswith(ARCHIVE_PREFIX)),
+            key=lambda item: item.get("ModTime", "")
+        )
+        names = [(archives[-1]["Name"], archives[-1]["Size"])] if archives else []
+
+    if not names:
+        raise FileNotFoundError(f"no archive found in {remote}")
+    return names
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _download_file(remote: str, directory: Path, name: str, size: int, sha256: Optional[str],
+                   rclone_flags: str) -> None:
+    """Download one file, continuing a partial download and verifying the result."""
+    final = directory / name
+    partial = directory / f"{name}.partial"
+    error = "no attempt"
+
+    for _ in range(RETRIES):
+        offset = partial.stat().st_size if partial.exists() else 0
+        if offset > size:
+            partial.unlink()
+            offset = 0
+        if offset < size:
+            args = ["cat", f"{remote.rstrip('/')}/{name}"] + (["--offset", str(offset)] if offset else [])
+            with open(partial, "ab") as output:
+                returncode = subprocess.run(rclone_command(args, rclone_flags), stdout=output).returncode
+            if returncode != 0:
+                error = f"rclone cat exited with {returncode}"
+                continue
+        elif not partial.exists():
+            partial.touch()
+
+        received = partial.stat().st_size
+        if received != size:
+            error = f"got {received} of {size} bytes"
+            continue
+        if sha256 and _sha256_file(partial) != sha256:
+            error = "checksum mismatch"
+            print(f"{name}: checksum mismatch, downloading again", file=sys.stderr)
+            partial.unlink()
+            continue
+        os.replace(partial, final)
+        return
+
+    raise OSError(f"cannot download {name}: {error}")
+
+
+def _clear_cache(directory: Path) -> None:
+    """Empty a cache directory, keeping the marker of the run that owns it."""
+    if not directory.is_dir():
+        return
+    for path in directory.iterdir():
+        if path.name == OWNER_FILE:
+            continue
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink()
+
+
+def download(remote: str, directory: Path, parts: bool, workers: int, rclone_flags: str = "") -> int:
+    """
+    Download the archive files into `directory`, verified and resumable.
+
+    The file list and checksums come from the backup's manifest; backups
+    written without one are checked by size only. A cache left by an
+    interrupted restore of the same backup is reused, any other is dropped.
+
+    Returns:
+        Number of files downloaded by this call
+    """
+    manifest = load_manifest(remote, rclone_flags)
+    if manifest:
+        files = [[item["name"], item["size"], item["sha256"]] for item in manifest["files"]]
+    else:
+        files = [[name, size, None] for name, size in _list_archive(remote, parts, rclone_flags)]
+
+    state_path = directory / RESUME_FILE
+    try:
+        state = json.loads(state_path.read_text())
+    except (OSError, ValueError):
+        state = {}
+    if state.get("remote") != remote or state.get("files") != files:
+        _clear_cache(directory)
+        state = {"remote": remote, "files": files, "done": []}
+    directory.mkdir(parents=True, exist_ok=True)
+
+    lock = threading.Lock()
+    download_flags = share_bandwidth(rclone_flags, max(1, workers))
+
+    def save() -> None:
+        tmp_path = state_path.with_name(state_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, state_path)
+
+    def cached(name: str, size: int, sha256: Optional[str]) -> bool:
+        path = directory / name
+        if name not in state["done"] or not path.is_file() or path.stat().st_size != size:
+            return False
+        if sha256 and _sha256_file(path) != sha256:
+            print(f"{name}: cached copy is damaged, downloading again", file=sys.stderr)
+            path.unlink()
+            return False
+        return True
+
+    def fetch(name: str, size: int, sha256: Optional[str]) -> bool:
+        if cached(name, size, sha256):
+            return False
+        _download_file(remote, directory, name, size, sha256, download_flags)
+        with lock:
+            if name not in state["done"]:
+                state["done"].append(name)
+            save()
+        return True
+
+    save()
+    resumed = sum(1 for item in files if item[0] in state["done"])
+    if resumed:
+        print(f"Resuming restore: {resumed} of {len(files)} files already downloaded", file=sys.stderr)
+    if not manifest:
+        print(f"No checksum manifest in {remote}; checking sizes only", file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(fetch, *item) for item in files]
+    return sum(1 for future in futures if future.result())
+
+
+def read_remote(remote: str, files: List[Tuple[str, int]], workers: int, rclone_flags: str = "") -> Iterator[bytes]:
+    """Yield the concatenated content of `files` below `remote`, `workers` segments downloading at a time."""
+    reads = [(f"{remote.rstrip('/')}/{name}", 0, size) for name, size in files]
+    return iter(PrefetchReader(reads, workers, rclone_flags))
+
+
+def decompress_stream(chunks: Iterator[bytes], output) -> str:
+    """
+    Pipe an archive given as chunks through the matching decompressor into `output`.
+
+    Returns:
+        The detected codec
+    """
+    head = b""
+    for data in chunks:
+        head += data
+        if len(head) >= MAGIC_SIZE:
+            break
+    codec = codec_from_magic(head)
+
+    decompressor = decompress_command(codec)
+    output.flush()
+    decompress = subprocess.Popen(decompressor, stdin=subprocess.PIPE, stdout=output)
+    try:
+        decompress.stdin.write(head)
+        for data in chunks:
+            decompress.stdin.write(data)
+    finally:
+        try:
+            decompress.stdin.close()
+        except BrokenPipeError:
+            pass
+    if decompress.wait() != 0:
+        raise subprocess.CalledProcessError(decompress.returncode, decompressor[0])
+    return codec
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stream_parser = subparsers.add_parser("stream", help="Write the decompressed tar stream to stdout")
+    stream_parser.add_argument("--remote", required=True, help="Remote backup directory")
+    stream_parser.add_argument("--parts", action="store_true", help="The backup is split into backup-part-* files")
+    stream_parser.add_argument("--workers", type=int, default=4, help="Parallel segment downloads")
+    stream_parser.add_argument("--rclone-flags", default="")
+
+    download_parser = subparsers.add_parser("download", help="Download the archive into a resumable cache")
+    download_parser.add_argument("--remote", required=True, help="Remote backup directory")
+    download_parser.add_argument("--dir", required=True, type=Path, help="Local cache directory")
+    download_parser.add_argument("--parts", action="store_true", help="The backup is split into backup-part-* files")
+    download_parser.add_argument("--workers", type=int, default=4, help="Parallel downloads")
+    download_parser.add_argument("--rclone-flags", default="")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "download":
+        try:
+            count = download(args.remote, args.dir, args.parts, args.workers, args.rclone_flags)
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            print(f"Download failed: {e}", file=sys.stderr)
+            return 1
+        print(f"Downloaded {count} file(s) from {args.remote}", file=sys.stderr)
+        return 0
+
+    try:
+        files = find_archive(args.remote, args.parts, args.rclone_flags)
+        print(f"Streaming {len(files)} file(s) from {args.remote} with {args.workers} parallel downloads",
+              file=sys.stderr)
+        decompress_stream(read_remote(args.remote, files, args.workers, args.rclone_flags), sys.stdout.buffer)
+    except BrokenPipeError:
+        return 1
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        print(f"Streaming restore failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Per-job file-state index for incremental backups.
+
+`scan` walks the source, compares every entry's size, mtime, inode and
+ctime with the index of the last successful run, and writes the list of
+new/changed entries plus a tombstone list of deleted ones. It prints the
+backup mode ("full" or "incremental") for the calling script. The new
+index is only promoted by `commit`, after the upload succeeded.
+
+Plain copies never delete from the remote, so for them the index also
+keeps every path deleted since and not re-created; whenever that set
+changes it is written to TOMBSTONE_FILE for the restore to apply.
+
+With `--watch`, the walk is replaced by re-reading only the paths the
+job's change watcher (pipeline.watch) journaled since the last run, unless
+the watcher asks for a full rescan.
+
+Filters come either as the list compiled by `pipeline.filters compile`
+(`--exclude-from`) or, for jobs that need no such list, as the rules
+themselves (`--rules`), which are then checked for every path read.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import stat
+import sys
+import time
+from pathlib import Path
+from typing import AbstractSet, Dict, Iterable, List, Optional, Tuple
+
+from pipeline import watch
+from pipeline.filters import FilterRules, exclude_key, load_excluded, rules_key, walk_included
+from pipeline.walk import walk_tree
+
+INDEX_FILE = "index.json.gz"
+PENDING_FILE = "index.pending.json.gz"
+CHANGED_FILE = {"tar": "changed.lst", "rclone": "changed.txt"}
+DELETED_FILE = {"tar": "deleted.lst", "rclone": "deleted.txt"}
+TOMBSTONE_FILE = "tombstones.txt"
+
+
+def load_index(state_dir: Path, name: str = INDEX_FILE) -> Dict:
+    """Load an index file, returning an empty index if it does not exist."""
+    path = state_dir / name
+    if not path.exists():
+        return {}
+
+    with gzip.open(path, "rt") as file:
+        return json.load(file)
+
+
+def save_index(state_dir: Path, index: Dict, name: str = PENDING_FILE) -> None:
+    """Write an index file atomically."""
+    state_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_dir / f"{name}.tmp"
+
+    with gzip.open(tmp_path, "wt", compresslevel=1) as file:
+        json.dump(index, file, separators=(",", ":"))
+    os.replace(tmp_path, state_dir / name)
+
+
+def snapshot_tree(source: str, exclude: AbstractSet[str] = frozenset(),
+                  rules: Optional[FilterRules] = None) -> Dict[str, List[int]]:
+    """Return {path: [size, mtime_ns, inode, ctime_ns, is_dir]} for the whole tree, minus `exclude` or `rules`."""
+    entries = walk_included(source, rules) if rules else walk_tree(source, exclude)
+    return {rel_path: _entry(st) for rel_path, st in entries}
+
+
+def _entry(st: os.stat_result) -> List[int]:
+    is_dir = stat.S_ISDIR(st.st_mode)
+    return [0 if is_dir else st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns, int(is_dir)]
+
+
+def _is_excluded(rel_path: str, exclude: AbstractSet[str]) -> bool:
+    """Whether the path or one of its parent directories is excluded."""
+    while rel_path:
+        if rel_path in exclude:
+            return True
+        rel_path = rel_path.rpartition("/")[0]
+    return False
+
+
+def apply_dirty(source: str, previous: Dict[str, List[int]], dirty: Iterable[str],
+                exclude: AbstractSet[str] = frozenset(),
+                rules: Optional[FilterRules] = None) -> Tuple[Dict[str, List[int]], List[str], List[str]]:
+    """
+    Update a tree snapshot from the paths a change watcher reported.
+
+    Only the dirty paths are read; directories that are new (or were
+    replaced) since `previous` are walked, as everything below them is new.
+    With `rules`, a dirty path they now exclude (e.g. a file grown past
+    the size limit) counts as deleted.
+
+    Returns:
+        (current snapshot, changed, deleted) like snapshot_tree and diff_trees
+    """
+    current = dict(previous)
+    touched = set()
+    removed = []
+    dropped_dirs = set()
+    new_dirs = []
+
+    for rel_path in sorted(dirty):
+        if not rel_path or _is_excluded(rel_path, exclude):
+            continue
+        old = current.get(rel_path)
+        try:
+            st = os.lstat(os.path.join(source, rel_path))
+            if rules and rules.excludes_path(rel_path, st):
+                raise FileNotFoundError(rel_path)
+        except OSError:
+            if old is not None:
+                del current[rel_path]
+                removed.append(rel_path)
+                if old[4]:
+                    dropped_dirs.add(rel_path)
+            continue
+
+        entry = _entry(st)
+        current[rel_path] = entry
+        touched.add(rel_path)
+        if entry[4] and (old is None or old[2] != entry[2] or not old[4]):
+            new_dirs.append(rel_path)
+            dropped_dirs.add(rel_path)
+        elif old is not None and old[4] and not entry[4]:
+            dropped_dirs.add(rel_path)
+
+    if dropped_dirs:
+        # One pass over the snapshot removes everything below deleted or replaced directories
+        for rel_path in [path for path in current if _is_excluded(path.rpartition("/")[0], dropped_dirs)]:
+            del current[rel_path]
+            removed.append(rel_path)
+
+    for rel_dir in new_dirs:
+        if rel_dir not in current:
+            continue
+        if rules:
+            entries = walk_included(source, rules, rel_dir)
+        else:
+            prefix = rel_dir + "/"
+            below = {path[len(prefix):] for path in exclude if path.startswith(prefix)}
+            entries = ((prefix + rel_path, st) for rel_path, st in walk_tree(os.path.join(source, rel_dir), below))
+        for rel_path, st in entries:
+            current[rel_path] = _entry(st)
+            touched.add(rel_path)
+
+    changed = sorted(path for path in touched if path in current and previous.get(path) != current[path])
+    deleted = sorted(path for path in set(removed) if path not in current)
+    return current, changed, deleted
+
+
+def fingerprint(source: str, exclude: AbstractSet[str] = frozenset()) -> str:
+    """Return a SHA-256 over the file state of the backed up tree; an unchanged tree keeps its fingerprint."""
+    digest = hashlib.sha256()
+    for rel_path, state in sorted(snapshot_tree(source, exclude).items()):
+        digest.update(json.dumps([rel_path, state]).encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+def diff_trees(previous: Dict[str, List[int]], current: Dict[str, List[int]]) -> Tuple[List[str], List[str]]:
+    """
+    Compare two tree snapshots.
+
+    Returns:
+        (changed, deleted) path lists. Changed entries are sorted so parent
+        directories precede their contents in the archive.
+    """
+    changed = sorted(path for path, state in current.items() if previous.get(path) != state)
+    deleted = sorted(path for path in previous if path not in current)
+    return changed, deleted
+
+
+def write_list(path: Path, entries: List[str], fmt: str) -> None:
+    """Write a path list NUL separated for tar, newline separated for rclone."""
+    separator = "\0" if fmt == "tar" else "\n"
+    with open(path, "w", encoding="utf-8", errors="surrogateescape") as file:
+        for entry in entries:
+            file.write(entry + separator)
+
+
+def scan(state_dir: Path, source: str, full_every: int, fmt: str, force_full: bool = False,
+         exclude_from: Optional[Path] = None, use_watch: bool = False, rules: Optional[Dict] = None) -> str:
+    """
+    Scan `source` and prepare the change lists for this run.
+
+    Args:
+        state_dir: Per-job state directory
+        source: Source directory
+        full_every: Force a full backup after this many incremental runs (0 = never)
+        fmt: List format, "tar" or "rclone"
+        force_full: Run a full backup regardless of the index
+        exclude_from: Excluded paths compiled by pipeline.filters; they are
+            left out of the index, so newly excluded entries count as deleted
+        use_watch: Re-read only the paths journaled by the job's change watcher
+        rules: The job's filters, applied directly instead of `exclude_from`
+
+    Returns:
+        "full" or "incremental"
+    """
+    previous = load_index(state_dir)
+    exclude = load_excluded(exclude_from)
+    filter_rules = FilterRules(rules) if rules else None
+    key = rules_key(rules) if rules else exclude_key(exclude)
+    dirty = watch.take(state_dir, source) if use_watch else None
+    if dirty is not None and previous.get("exclude") != key:
+        print("Filters changed since the last run; scanning the whole tree", file=sys.stderr)
+        dirty = None
+    if dirty is not None and previous:
+        current, changed, deleted = apply_dirty(source, previous["files"], dirty, exclude, filter_rules)
+        print(f"Read {len(dirty)} path(s) journaled by the change watcher", file=sys.stderr)
+    else:
+        current = snapshot_tree(source, exclude, filter_rules)
+        changed, deleted = diff_trees(previous.get("files", {}), current)
+
+    runs_since_full = previous.get("runs_since_full", 0) + 1
+    if force_full or not previous or (full_every and runs_since_full >= full_every):
+        mode = "full"
+        runs_since_full = 0
+    else:
+        mode = "incremental"
+
+    if mode == "full":
+        changed = sorted(current)
+    index = {
+        "version": 1,
+        "created": int(time.time()),
+        "mode": mode,
+        "runs_since_full": runs_since_full,
+        "exclude": key,
+        "files": current,
+    }
+
+    state_dir.mkdir(parents=True, exist_ok=True)
+    if fmt == "rclone":
+        # rclone --files-from only takes files; directories are implied
+        changed = [path for path in changed if not current[path][4]]
+        deleted = [path for path in deleted if not previous["files"][path][4]]
+        previous_tombstones = previous.get("tombstones", [])
+        index["tombstones"] = sorted((set(previous_tombstones) | set(deleted)) - current.keys())
+        if index["tombstones"] != previous_tombstones:
+            write_list(state_dir / TOMBSTONE_FILE, index["tombstones"], fmt)
+        else:
+            (state_dir / TOMBSTONE_FILE).unlink(missing_ok=True)
+
+    write_list(state_dir / CHANGED_FILE[fmt], changed, fmt)
+    write_list(state_dir / DELETED_FILE[fmt], deleted, fmt)
+    save_index(state_dir, index)
+
+    print(f"{mode.capitalize()} scan: {len(current)} entries, "
+          f"{len(changed)} new/changed, {len(deleted)} deleted", file=sys.stderr)
+    return mode
+
+
+def commit(state_dir: Path) -> None:
+    """Promote the pending index after a successful run."""
+    pending = state_dir / PENDING_FILE
+    if pending.exists():
+        os.replace(pending, state_dir / INDEX_FILE)
+    watch.release(state_dir)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan", help="Build change lists for the next run")
+    scan_parser.add_argument("--state-dir", required=True, type=Path)
+    scan_parser.add_argument("--source", required=True)
+    scan_parser.add_argument("--full-every", type=int, default=0)
+    scan_parser.add_argument("--format", choices=sorted(CHANGED_FILE), default="tar")
+    scan_parser.add_argument("--full", action="store_true", help="Force a full backup")
+    scan_parser.add_argument("--exclude-from", type=Path, help="Excluded paths written by pipeline.filters")
+    scan_parser.add_argument("--rules", type=json.loads, help="The job's filters as JSON, instead of --exclude-from")
+    scan_parser.add_argument("--watch", action="store_true", help="Use the change watcher's journal if it is complete")
+
+    commit_parser = subparsers.add_parser("commit", help="Promote the pending index")
+    commit_parser.add_argument("--state-dir", required=True, type=Path)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "scan":
+        print(scan(args.state_dir, args.source, args.full_every, args.format, args.full, args.exclude_from,
+                   args.watch, args.rules))
+    else:
+        commit(args.state_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Per-job include/exclude rules.
+
+A job's `filters` setting holds gitignore-style exclude globs, include globs
+that override them, size and age limits for regular files, and optionally
+the name of an ignore file (e.g. `.gitignore`) honoured in every directory:
+
+    {"exclude": ["node_modules/", "*.iso"], "include": ["keep.iso"],
+     "max_size": "4G", "max_age": "1y", "ignore_file": ".gitignore"}
+
+The rules are compiled once into one regular expression per rule set.
+`compile` walks the source a single time, never descending into excluded
+directories, and writes the result as explicit path lists:
+
+    excluded.lst       NUL separated paths for the pipeline walkers
+    tar-exclude.lst    for `tar --anchored --no-wildcards --exclude-from`
+
+tar and the Python stages read the same list, so they skip exactly the
+same data, and an excluded directory is pruned as a whole by both.
+
+rclone gets the rules themselves: `rclone-filter.txt` (for
+`rclone --filter-from`) holds the job's globs translated to rclone
+patterns, and the size and age limits become `--max-size`/`--max-age`.
+Only paths left out by ignore files, which rclone cannot read, are listed
+one by one. Jobs whose only consumer is rclone write the filter file with
+`rclone` and never walk the source. rclone's first-match rules differ from
+the walk in one respect: an include glob below an excluded directory
+brings the included files back.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import stat
+import sys
+import time
+from pathlib import Path
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pipeline.units import parse_age, parse_size
+
+EXCLUDED_LIST = "excluded.lst"
+TAR_EXCLUDES = "tar-exclude.lst"
+RCLONE_FILTERS = "rclone-filter.txt"
+# rclone glob characters that must be escaped in literal filter paths
+_RCLONE_SPECIAL = re.compile(r"([\\*?\[\]{}])")
+# Characters that are literal in gitignore globs but special in rclone's
+_RCLONE_BRACES = re.compile(r"([{}])")
+# Why compile_rules left an entry out
+BY_RULE, BY_IGNORE_FILE, BY_LIMIT = "rule", "ignore_file", "limit"
+
+
+def _translate(pattern: str) -> str:
+    """Translate the glob part of a gitignore pattern into a regular expression."""
+    result = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            result.append("(?:.*/)?")
+            index += 3
+            continue
+        if pattern.startswith("**", index):
+            # A trailing "/**" matches everything inside the directory, not the directory itself
+            result.append(".+" if index + 2 == len(pattern) and pattern[index - 1:index] == "/" else ".*")
+            index += 2
+            continue
+        if char == "*":
+            result.append("[^/]*")
+        elif char == "?":
+            result.append("[^/]")
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            result.append(re.escape(pattern[index]))
+        elif char == "[":
+            end = pattern.find("]", index + 2)
+            if end == -1:
+                result.append(re.escape(char))
+            else:
+                body = pattern[index + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                result.append(f"[{body.replace(chr(92), chr(92) * 2)}]")
+                index = end
+        else:
+            result.append(re.escape(char))
+        index += 1
+    return "".join(result)
+
+
+def parse_pattern(line: str) -> Optional[Tuple[str, bool]]:
+    """
+    Turn one gitignore-style line into (regex, negated).
+
+    The regex matches a path relative to the rule set's directory, with a
+    trailing '/' for directories. Returns None for blank lines and comments.
+    """
+    line = line.rstrip("\n")
+    if line.endswith(" ") and not line.endswith("\\ "):
+        line = line.rstrip(" ")
+    if not line or line.startswith("#"):
+        return None
+
+    negated = line.startswith("!")
+    if negated or line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+
+    # A slash anywhere but at the end anchors the pattern; otherwise it matches at any depth
+    anchored = "/" in line
+    line = line.lstrip("/")
+    regex = ("" if anchored else "(?:.*/)?") + _translate(line) + ("/" if dir_only else "/?")
+    return regex, negated
+
+
+class RuleSet:
+    """Patterns of one ignore file (or the job), combined into a single regex."""
+
+    def __init__(self, base: str, patterns: Iterable[Tuple[str, bool]]):
+        self.base = base
+        patterns = list(patterns)
+        # Later patterns win, so they come first in the alternation; the group that matched names the rule
+        self.negated = [negated for _, negated in reversed(patterns)]
+        self.regex = re.compile("|".join(f"({regex})" for regex, _ in reversed(patterns))) if patterns else None
+
+    def match(self, rel_path: str, is_dir: bool) -> Optional[bool]:
+        """Return True if the path is excluded, False if re-included, None if no pattern matches."""
+        if self.regex is None:
+            return None
+        if self.base:
+            if not rel_path.startswith(self.base + "/"):
+                return None
+            rel_path = rel_path[len(self.base) + 1:]
+        match = self.regex.fullmatch(rel_path + "/" if is_dir else rel_path)
+        if match is None:
+            return None
+        return not self.negated[match.lastindex - 1]
+
+
+def load_rule_set(base: str, path: str) -> Optional[RuleSet]:
+    """Read an ignore file into a RuleSet for the directory `base`, or None if it cannot be read."""
+    try:
+        with open(path, encoding="utf-8", errors="surrogateescape") as file:
+            patterns = [pattern for pattern in map(parse_pattern, file) if pattern]
+    except OSError as e:
+        print(f"Warning: cannot read {path}: {e}", file=sys.stderr)
+        return None
+    return RuleSet(base, patterns) if patterns else None
+
+
+class FilterRules:
+    """
+    A job's compiled filter rules.
+
+    Job patterns are checked first and includes beat excludes; paths they do
+    not match fall through to the ignore files, deepest directory first,
+    where the last matching line wins as in git. Size and age limits apply
+    to every regular file that is not excluded otherwise, as rclone's
+    --max-size/--max-age do.
+    """
+
+    def __init__(self, rules: Dict, now: Optional[float] = None):
+        patterns = [parse_pattern(glob) for glob in rules.get("exclude") or []]
+        patterns += [parse_pattern("!" + glob.lstrip("!")) for glob in rules.get("include") or []]
+        self.job = RuleSet("", [pattern for pattern in patterns if pattern])
+        self.ignore_file = rules.get("ignore_file") or None
+        self.max_size = parse_size(rules["max_size"]) if rules.get("max_size") else None
+        max_age = parse_age(rules["max_age"]) if rules.get("max_age") else None
+        self.min_mtime = (now if now is not None else time.time()) - max_age if max_age is not None else None
+
+    def reason(self, rel_path: str, st: os.stat_result, ignore_sets: List[RuleSet]) -> Optional[str]:
+        """Return why the entry is left out of the backup (BY_RULE, BY_IGNORE_FILE, BY_LIMIT), or None."""
+        is_dir = stat.S_ISDIR(st.st_mode)
+        decision = self.job.match(rel_path, is_dir)
+        if decision:
+            return BY_RULE
+        if decision is None:
+            for rule_set in reversed(ignore_sets):
+                decision = rule_set.match(rel_path, is_dir)
+                if decision is not None:
+                    break
+            if decision:
+                return BY_IGNORE_FILE
+
+        if stat.S_ISREG(st.st_mode):
+            if self.max_size is not None and st.st_size > self.max_size:
+                return BY_LIMIT
+            if self.min_mtime is not None and st.st_mtime < self.min_mtime:
+                return BY_LIMIT
+        return None
+
+    def excluded(self, rel_path: str, st: os.stat_result, ignore_sets: List[RuleSet]) -> bool:
+        """Whether the entry is left out of the backup."""
+        return self.reason(rel_path, st, ignore_sets) is not None
+
+    def excludes_path(self, rel_path: str, st: os.stat_result) -> bool:
+        """
+        Whether a single entry is left out, also if one of its parent directories is.
+
+        Used for the paths a change watcher reports, without a walk; ignore
+        files are not consulted.
+        """
+        parents = rel_path.split("/")[:-1]
+        for depth in range(1, len(parents) + 1):
+            if self.job.match("/".join(parents[:depth]), True):
+                return True
+        return self.excluded(rel_path, st, [])
+
+
+def _walk(source: str, rules: FilterRules, start: str = "") -> Iterator[Tuple[str, os.stat_result, Optional[str]]]:
+    """
+    Walk `source` (from the subdirectory `start`) and yield (path, lstat, reason) of every entry.
+
+    `reason` is None for entries that are backed up. Excluded directories
+    are yielded once and not entered. Ignore files above `start` are not read.
+    """
+    stack = [(start, [])]  # type: List[Tuple[str, List[RuleSet]]]
+
+    while stack:
+        rel_dir, ignore_sets = stack.pop()
+        directory = os.path.join(source, rel_dir) if rel_dir else source
+        try:
+            with os.scandir(directory) as iterator:
+                entries = list(iterator)
+        except OSError as e:
+            print(f"Warning: cannot read {rel_dir or source}: {e}", file=sys.stderr)
+            continue
+
+        if rules.ignore_file and any(entry.name == rules.ignore_file for entry in entries):
+            rule_set = load_rule_set(rel_dir, os.path.join(directory, rules.ignore_file))
+            if rule_set:
+                ignore_sets = ignore_sets + [rule_set]
+
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            reason = rules.reason(rel_path, st, ignore_sets)
+            yield rel_path, st, reason
+            if reason is None and stat.S_ISDIR(st.st_mode):
+                stack.append((rel_path, ignore_sets))
+
+
+def compile_rules(source: str, rules: FilterRules) -> Iterator[Tuple[str, os.stat_result, str]]:
+    """Walk `source` and yield (path, lstat, reason) of every excluded entry."""
+    return ((rel_path, st, reason) for rel_path, st, reason in _walk(source, rules) if reason)
+
+
+def walk_included(source: str, rules: FilterRules, start: str = "") -> Iterator[Tuple[str, os.stat_result]]:
+    """Like pipeline.walk.walk_tree, but apply `rules` instead of a compiled list; paths are relative to `source`."""
+    return ((rel_path, st) for rel_path, st, reason in _walk(source, rules, start) if reason is None)
+
+
+def _rclone_patterns(glob: str) -> List[str]:
+    """Translate a job glob into rclone patterns matching the same paths and everything below them."""
+    glob = glob.strip()
+    if glob.startswith("\\!") or glob.startswith("\\#"):
+        glob = glob[1:]
+    dir_only = glob.endswith("/")
+    glob = glob.rstrip("/")
+    # A leading **/ matches at any depth, like a pattern without a slash
+    while glob.startswith("**/"):
+        glob = glob[3:]
+    if not glob or glob.startswith("#"):
+        return []
+    anchored = "/" in glob
+    glob = _RCLONE_BRACES.sub(r"\\\1", glob.lstrip("/")).replace("[!", "[^")
+    if anchored:
+        glob = "/" + glob
+    return [glob + "/**"] if dir_only else [glob, glob + "/**"]
+
+
+def rclone_rules(rules: Dict) -> List[str]:
+    """
+    Translate the job's include/exclude globs into rclone filter lines.
+
+    rclone stops at the first matching rule, so the globs are emitted in
+    reverse: later globs, and includes, win as they do in FilterRules.
+    """
+    globs = [("-", glob) for glob in rules.get("exclude") or []]
+    globs += [("+", glob.lstrip("!")) for glob in rules.get("include") or []]
+    lines = []
+    for sign, glob in reversed(globs):
+        if sign == "-" and glob.startswith("!"):
+            sign, glob = "+", glob[1:]
+        lines.extend(f"{sign} {pattern}" for pattern in _rclone_patterns(glob))
+    return lines
+
+
+def rclone_limit_args(rules: Dict) -> List[str]:
+    """rclone flags for the job's size and age limits."""
+    args = []
+    if rules.get("max_size"):
+        args += ["--max-size", f"{parse_size(rules['max_size'])}B"]
+    if rules.get("max_age"):
+        args += ["--max-age", f"{parse_age(rules['max_age'])}s"]
+    return args
+
+
+def write_lists(out_dir: Path, excluded: List[Tuple[str, bool]]) -> None:
+    """Write the excluded (path, is_dir) entries in the pipeline and tar formats."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / EXCLUDED_LIST, "wb") as native, open(out_dir / TAR_EXCLUDES, "wb") as tar:
+        for rel_path, is_dir in excluded:
+            name = os.fsencode(rel_path)
+            native.write(name + b"\0")
+            if b"\n" in name:
+                print(f"Warning: cannot exclude {rel_path!r} from tar (newline in name)", file=sys.stderr)
+                continue
+            # `tar -C source .` names members ./path, `-T list` names them path
+            tar.write(name + b"\n./" + name + b"\n")
+
+
+def write_rclone_filters(out_dir: Path, rules: Dict, ignored: Iterable[Tuple[str, bool]] = ()) -> None:
+    """Write the rclone filter file: the `ignored` (path, is_dir) entries, then the job's globs."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / RCLONE_FILTERS, "wb") as rclone:
+        for rel_path, is_dir in ignored:
+            if "\n" in rel_path:
+                print(f"Warning: cannot exclude {rel_path!r} from rclone (newline in name)", file=sys.stderr)
+                continue
+            escaped = os.fsencode(_RCLONE_SPECIAL.sub(r"\\\1", rel_path))
+            rclone.write(b"- /" + escaped + (b"/**\n" if is_dir else b"\n"))
+        for line in rclone_rules(rules):
+            rclone.write(os.fsencode(line) + b"\n")
+
+
+def load_excluded(path: Optional[Path]) -> Set[str]:
+    """Read an EXCLUDED_LIST written by `compile`; no path means nothing is excluded."""
+    if path is None:
+        return set()
+    with open(path, "rb") as file:
+        return {os.fsdecode(name) for name in file.read().split(b"\0") if name}
+
+
+def exclude_key(exclude: AbstractSet[str]) -> str:
+    """Return a digest identifying a set of excluded paths."""
+    digest = hashlib.sha256()
+    for rel_path in sorted(exclude):
+        digest.update(os.fsencode(rel_path) + b"\0")
+    return digest.hexdigest()
+
+
+def rules_key(rules: Dict) -> str:
+    """Return a digest identifying a job's filter rules (for stages that apply them without a list)."""
+    return "rules:" + hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+
+
+def tar_exclude_args(excluded_path: Optional[Path]) -> List[str]:
+    """tar arguments that apply the lists compiled next to `excluded_path`."""
+    if excluded_path is None:
+        return []
+    return ["--anchored", "--no-wildcards", "--exclude-from", str(excluded_path.with_name(TAR_EXCLUDES))]
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = subparsers.add_parser("compile", help="Write the exclude lists of a source tree")
+    compile_parser.add_argument("--source", required=True)
+    compile_parser.add_argument("--rules", required=True, help="The job's filters as JSON")
+    compile_parser.add_argument("--out-dir", required=True, type=Path)
+
+    rclone_parser = subparsers.add_parser("rclone", help="Write the rclone filter file from the rules alone")
+    rclone_parser.add_argument("--rules", required=True, help="The job's filters as JSON")
+    rclone_parser.add_argument("--out-dir", required=True, type=Path)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "rclone":
+        try:
+            write_rclone_filters(args.out_dir, json.loads(args.rules))
+        except (OSError, ValueError) as e:
+            print(f"Filter compilation failed: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    started = time.time()
+    try:
+        raw_rules = json.loads(args.rules)
+        rules = FilterRules(raw_rules)
+        excluded = []
+        ignored = []
+        files = 0
+        size = 0
+        for rel_path, st, reason in compile_rules(args.source, rules):
+            is_dir = stat.S_ISDIR(st.st_mode)
+            excluded.append((rel_path, is_dir))
+            if reason == BY_IGNORE_FILE:
+                ignored.append((rel_path, is_dir))
+            if not is_dir:
+                files += 1
+                size += st.st_size
+        excluded.sort()
+        write_lists(args.out_dir, excluded)
+        write_rclone_filters(args.out_dir, raw_rules, sorted(ignored))
+    except (OSError, ValueError) as e:
+        print(f"Filter compilation failed: {e}", file=sys.stderr)
+        return 1
+
+    print(f"Filters exclude {len(excluded) - files} directories and {files} files "
+          f"({size / 1024 ** 2:.1f} MiB) in {time.time() - started:.1f} s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
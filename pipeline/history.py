@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Run history and top-up planning for transfer jobs.
+
+Every successful transfer is recorded in `history.json` in the job's state
+directory with its start time. A top-up run only copies what changed since
+then: `plan` prints `topup <seconds>` for rclone `--max-age`, measured from
+the start of the last successful run (minus WATERMARK_SLACK), so files
+written while that run was listing the source are picked up again.
+Top-ups pass `--no-traverse`, so the destination is never listed either.
+
+`--max-age` looks at modification times only. Files moved or copied into
+the source with an old mtime are missed, so `plan` asks for a full
+reconciliation every `full_every` runs, when the history is missing, and
+when the job's source or destination changed.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+HISTORY_FILE = "history.json"
+# Runs kept in the history
+KEEP_RUNS = 100
+# Overlap with the previous run for coarse mtimes (FAT: 2 s) and clock steps
+WATERMARK_SLACK = 60
+FULL, TOPUP = "full", "topup"
+
+
+def load_history(state_dir: Path) -> Dict:
+    """Return the job's run history, or an empty one."""
+    try:
+        return json.loads((state_dir / HISTORY_FILE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def plan(state_dir: Path, source: str, destination: str, full_every: int, now: float = None) -> str:
+    """
+    Decide how the next transfer runs.
+
+    Args:
+        state_dir: Per-job state directory
+        source: Transfer source
+        destination: Transfer destination
+        full_every: Reconcile fully after this many top-ups (0 = never)
+        now: Current time (default: time.time())
+
+    Returns:
+        "full", or "topup <seconds>" with the --max-age of the top-up
+    """
+    history = load_history(state_dir)
+    runs = history.get("runs") or []
+    if not runs or (history.get("source"), history.get("destination")) != (source, destination):
+        return FULL
+    if full_every and history.get("topups_since_full", 0) + 1 >= full_every:
+        return FULL
+
+    now = time.time() if now is None else now
+    max_age = max(1, int(now - runs[-1]["started"]) + WATERMARK_SLACK)
+    return f"{TOPUP} {max_age}s"
+
+
+def record(state_dir: Path, source: str, destination: str, started: int, mode: str) -> Dict:
+    """Record a successful run that started at `started` (epoch seconds)."""
+    history = load_history(state_dir)
+    if (history.get("source"), history.get("destination")) != (source, destination):
+        history = {}
+    runs = history.get("runs") or []
+    runs.append({"started": started, "finished": int(time.time()), "mode": mode})
+
+    history.update({
+        "source": source,
+        "destination": destination,
+        "topups_since_full": history.get("topups_since_full", 0) + 1 if mode == TOPUP else 0,
+        "runs": runs[-KEEP_RUNS:],
+    })
+    state_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_dir / f"{HISTORY_FILE}.tmp"
+    tmp_path.write_text(json.dumps(history, indent=2))
+    os.replace(tmp_path, state_dir / HISTORY_FILE)
+    return history
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, help_text in (("plan", "Print 'full' or 'topup <max-age>' for the next run"),
+                            ("record", "Record a successful run")):
+        command_parser = subparsers.add_parser(name, help=help_text)
+        command_parser.add_argument("--state-dir", required=True, type=Path, help="Per-job state directory")
+        command_parser.add_argument("--source", required=True)
+        command_parser.add_argument("--destination", required=True)
+        if name == "plan":
+            command_parser.add_argument("--full-every", type=int, default=7,
+                                        help="Full reconciliation after this many top-ups (0 = never)")
+        else:
+            command_parser.add_argument("--started", required=True, type=int, help="Run start (epoch seconds)")
+            command_parser.add_argument("--mode", required=True, choices=(FULL, TOPUP))
+
+    args = parser.parse_args(argv)
+
+    if args.command == "plan":
+        print(plan(args.state_dir, args.source, args.destination, args.full_every))
+        return 0
+
+    try:
+        record(args.state_dir, args.source, args.destination, args.started, args.mode)
+    except OSError as e:
+        print(f"Recording the run failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Compressed archives with a content index for single-file restore.
+
+`pack` reads a tar stream on stdin and writes it compressed to stdout as a
+series of independently compressed frames of FRAME_SIZE input bytes
+(concatenated gzip members or zstd frames, so the output is still a regular
+.tar.gz/.tar.zst). Frames are compressed by a pool of workers. While the
+stream passes through, the tar headers are parsed and every entry is
+recorded in a content index: its path, its byte range in the tar stream and
+its size. The frame table maps tar offsets to compressed offsets and, for
+split backups, to part numbers.
+
+`extract` loads the index from the remote, picks the entries below the
+requested paths and fetches only the frames that hold them with parallel
+ranged `rclone cat --offset/--count` reads (pipeline.prefetch). The entries are cut out of the
+decompressed frames and fed to `tar -x` as a new, minimal archive.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import subprocess
+import sys
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pipeline.codecs import CODECS, GZIP, compress_command, decompress_command
+from pipeline.prefetch import PrefetchReader
+from pipeline.rclone import run_rclone
+from pipeline.split_upload import part_suffix
+from pipeline.units import parse_size
+
+INDEX_FILE = "backup.index.gz"
+INDEX_VERSION = 1
+FRAME_SIZE = 8 * 1024 * 1024
+BLOCK = 512
+COPY_SIZE = 1024 * 1024
+
+# Header types whose data belongs to the entry that follows them
+_META_TYPES = {b"L", b"K", b"x"}
+# Link and device entries carry no data even if the size field is set
+_NO_DATA_TYPES = {b"1", b"2", b"3", b"4", b"5", b"6"}
+
+
+def _padded(size: int) -> int:
+    return (size + BLOCK - 1) // BLOCK * BLOCK
+
+
+def _parse_number(field: bytes) -> int:
+    """Decode a tar numeric field (octal, or GNU base-256 for large values)."""
+    if field and field[0] & 0x80:
+        value = field[0] & 0x7F
+        for byte in field[1:]:
+            value = (value << 8) | byte
+        return value
+    digits = field.split(b"\0", 1)[0].strip()
+    return int(digits, 8) if digits else 0
+
+
+def _parse_pax_path(data: bytes) -> Optional[str]:
+    """Return the `path` record of a pax extended header, if any."""
+    while data:
+        length, _, _ = data.partition(b" ")
+        try:
+            record_length = int(length)
+        except ValueError:
+            return None
+        key, _, value = data[len(length) + 1:record_length - 1].partition(b"=")
+        if key == b"path":
+            return os.fsdecode(value)
+        data = data[record_length:]
+    return None
+
+
+def normalize(path: str) -> str:
+    """Turn a tar member or user supplied path into the index form (no ./ or leading /)."""
+    path = path.strip()
+    while path.startswith("./"):
+        path = path[2:]
+    path = path.strip("/")
+    return "" if path == "." else path
+
+
+class TarIndexer:
+    """Follow a tar stream fed in pieces and record the range of every entry."""
+
+    def __init__(self):
+        self.entries = []  # type: List[Dict]
+        self._offset = 0
+        self._skip = 0
+        self._collect = None  # type: Optional[bytearray]
+        self._collect_type = b""
+        self._collect_size = 0
+        self._entry_start = None  # type: Optional[int]
+        self._long_name = None  # type: Optional[str]
+        self._pax_path = None  # type: Optional[str]
+        self._header = bytearray()
+
+    def feed(self, data: bytes) -> None:
+        view = memoryview(data)
+        position = 0
+        while position < len(view):
+            if self._skip:
+                take = min(self._skip, len(view) - position)
+                if self._collect is not None:
+                    self._collect += view[position:position + take]
+                position += take
+                self._skip -= take
+                self._offset += take
+                if not self._skip and self._collect is not None:
+                    self._finish_meta()
+                continue
+
+            take = min(BLOCK - len(self._header), len(view) - position)
+            self._header += view[position:position + take]
+            position += take
+            self._offset += take
+            if len(self._header) == BLOCK:
+                header, self._header = bytes(self._header), bytearray()
+                self._parse_header(header)
+
+    def _parse_header(self, header: bytes) -> None:
+        if header == b"\0" * BLOCK:
+            return
+        header_start = self._offset - BLOCK
+        type_flag = header[156:157]
+        size = _parse_number(header[124:136])
+
+        if type_flag == b"g":
+            self._skip = _padded(size)
+            return
+        if self._entry_start is None:
+            self._entry_start = header_start
+
+        if type_flag in _META_TYPES:
+            self._collect = bytearray()
+            self._collect_type = type_flag
+            self._collect_size = size
+            self._skip = _padded(size)
+            if not self._skip:
+                self._finish_meta()
+            return
+
+        name = self._pax_path or self._long_name
+        if name is None:
+            name = os.fsdecode(header[0:100].split(b"\0", 1)[0])
+            if header[257:262] == b"ustar":
+                prefix = os.fsdecode(header[345:500].split(b"\0", 1)[0])
+                if prefix:
+                    name = f"{prefix}/{name}"
+        data_size = 0 if type_flag in _NO_DATA_TYPES else size
+        end = self._offset + _padded(data_size)
+
+        self.entries.append({
+            "path": normalize(name),
+            "start": self._entry_start,
+            "length": end - self._entry_start,
+            "size": data_size,
+            "type": type_flag.strip(b"\0").decode() or "0",
+        })
+        self._entry_start = None
+        self._long_name = None
+        self._pax_path = None
+        self._skip = _padded(data_size)
+
+    def _finish_meta(self) -> None:
+        data = bytes(self._collect[:self._collect_size])
+        if self._collect_type == b"L":
+            self._long_name = os.fsdecode(data.split(b"\0", 1)[0])
+        elif self._collect_type == b"x":
+            self._pax_path = _parse_pax_path(data) or self._pax_path
+        self._collect = None
+
+
+def _read_full(stream, size: int) -> bytes:
+    chunks = []
+    remaining = size
+    while remaining:
+        data = stream.read(remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    return b"".join(chunks)
+
+
+def _frame_compressor(codec: str, level: int, long_mode: bool):
+    """Return a function compressing one frame into a self-contained gzip member or zstd frame."""
+    if codec == GZIP:
+        # zlib releases the GIL, so worker threads compress in parallel
+        def compress(data: bytes) -> bytes:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            return compressor.compress(data) + compressor.flush()
+        return compress
+
+    command = compress_command(codec, level, 1, long_mode)
+
+    def compress(data: bytes) -> bytes:
+        return subprocess.run(command, input=data, stdout=subprocess.PIPE, check=True).stdout
+    return compress
+
+
+def pack(stream, output, index_path: Path, codec: str, level: int, cores: int, long_mode: bool = False,
+         archive: Optional[str] = None, part_size: int = 0, frame_size: int = FRAME_SIZE) -> Dict:
+    """
+    Compress a tar stream frame by frame and write its content index.
+
+    Args:
+        stream: Binary tar stream to read
+        output: Binary stream for the compressed archive
+        index_path: Where to write the gzip compressed index
+        codec: "gzip" or "zstd"
+        level: Compression level
+        cores: Frames compressed at the same time
+        long_mode: zstd long-distance matching
+        archive: Remote name of the archive (single-file backups)
+        part_size: Part size of split backups (0 = not split)
+        frame_size: Input bytes per frame
+
+    Returns:
+        The index header
+    """
+    compress = _frame_compressor(codec, level, long_mode)
+    indexer = TarIndexer()
+    frames = []
+    pending = deque()
+    tar_offset = 0
+    written = 0
+
+    def write_oldest() -> None:
+        nonlocal written
+        start, length, future = pending.popleft()
+        data = future.result()
+        output.write(data)
+        frames.append({"tar_offset": start, "tar_length": length, "offset": written, "length": len(data)})
+        written += len(data)
+
+    with ThreadPoolExecutor(max_workers=max(1, cores)) as pool:
+        while True:
+            data = _read_full(stream, frame_size)
+            if not data:
+                break
+            indexer.feed(data)
+            pending.append((tar_offset, len(data), pool.submit(compress, data)))
+            tar_offset += len(data)
+            while len(pending) > cores + 1:
+                write_oldest()
+        while pending:
+            write_oldest()
+    output.flush()
+
+    if part_size:
+        for frame in frames:
+            frame["part"] = frame["offset"] // part_size
+            frame["part_offset"] = frame["offset"] % part_size
+
+    header = {
+        "version": INDEX_VERSION,
+        "codec": codec,
+        "archive": archive,
+        "part_size": part_size,
+        "tar_bytes": tar_offset,
+        "compressed_bytes": written,
+        "frames": len(frames),
+        "entries": len(indexer.entries),
+    }
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(index_path, "wt", encoding="utf-8", errors="surrogateescape") as file:
+        file.write(json.dumps(header) + "\n")
+        for frame in frames:
+            file.write(json.dumps(frame) + "\n")
+        for entry in indexer.entries:
+            file.write(json.dumps(entry) + "\n")
+
+    print(f"Indexed {len(indexer.entries)} entries in {len(frames)} frames", file=sys.stderr)
+    return header
+
+
+def load_index(remote: str, rclone_flags: str = "") -> Tuple[Dict, List[Dict], List[Dict]]:
+    """
+    Download and parse the content index stored in the remote directory.
+
+    Returns:
+        (header, frames, entries)
+    """
+    result = run_rclone(["cat", f"{remote.rstrip('/')}/{INDEX_FILE}"], rclone_flags, capture_output=True)
+    lines = gzip.decompress(result.stdout).decode("utf-8", "surrogateescape").splitlines()
+    header = json.loads(lines[0])
+    frames = [json.loads(line) for line in lines[1:header["frames"] + 1]]
+    entries = [json.loads(line) for line in lines[header["frames"] + 1:]]
+    return header, frames, entries
+
+
+def select_entries(entries: List[Dict], paths: List[str]) -> List[Dict]:
+    """Return the entries at or below any of `paths` (an empty path selects everything)."""
+    wanted = [normalize(path) for path in paths]
+    if "" in wanted:
+        return list(entries)
+    selected = []
+    for entry in entries:
+        path = entry["path"]
+        if any(path == prefix or path.startswith(prefix + "/") for prefix in wanted):
+            selected.append(entry)
+    return selected
+
+
+def plan_reads(frames: List[Dict], entries: List[Dict]) -> List[Tuple[int, int, List[Tuple[int, int]]]]:
+    """
+    Group the tar ranges of `entries` into runs of consecutive frames.
+
+    Returns:
+        [(first frame, last frame, [(tar start, tar end)])]
+    """
+    starts = [frame["tar_offset"] for frame in frames]
+    runs = []
+    for entry in sorted(entries, key=lambda item: item["start"]):
+        start, end = entry["start"], entry["start"] + entry["length"]
+        first = _frame_at(starts, start)
+        last = _frame_at(starts, end - 1)
+        if runs and first <= runs[-1][1] + 1:
+            run_first, run_last, ranges = runs[-1]
+            if ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+            runs[-1] = (run_first, max(run_last, last), ranges)
+        else:
+            runs.append((first, last, [(start, end)]))
+    return runs
+
+
+def _frame_at(starts: List[int], offset: int) -> int:
+    low, high = 0, len(starts) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if starts[middle] <= offset:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _byte_ranges(remote: str, header: Dict, first: Dict, last: Dict) -> List[Tuple[str, int, int]]:
+    """Map a run of frames to (remote file, offset, count) reads."""
+    remote = remote.rstrip("/")
+    start, end = first["offset"], last["offset"] + last["length"]
+    part_size = header.get("part_size")
+    if not part_size:
+        return [(f"{remote}/{header['archive']}", start, end - start)]
+
+    reads = []
+    while start < end:
+        part, offset = divmod(start, part_size)
+        count = min(part_size - offset, end - start)
+        reads.append((f"{remote}/backup-part-{part_suffix(part)}", offset, count))
+        start += count
+    return reads
+
+
+def _decompressed_run(reads: List[Tuple[str, int, int]], codec: str, workers: int,
+                      rclone_flags: str) -> Iterator[bytes]:
+    """Yield the decompressed bytes of a run of frames fetched with ranged reads."""
+    decompressor = decompress_command(codec)
+    decompress = subprocess.Popen(decompressor, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    failures = []
+
+    def feed() -> None:
+        try:
+            for data in PrefetchReader(reads, workers, rclone_flags):
+                decompress.stdin.write(data)
+        except BrokenPipeError:
+            pass
+        except OSError as e:
+            failures.append(e)
+        finally:
+            decompress.stdin.close()
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    while True:
+        data = decompress.stdout.read(COPY_SIZE)
+        if not data:
+            break
+        yield data
+    feeder.join()
+    if failures:
+        raise failures[0]
+    if decompress.wait() != 0:
+        raise subprocess.CalledProcessError(decompress.returncode, decompressor[0])
+
+
+def extract(remote: str, target: str, paths: List[str], workers: int = 4, rclone_flags: str = "") -> int:
+    """
+    Restore the entries below `paths` from the indexed backup in `remote`.
+
+    Returns:
+        Number of entries restored
+    """
+    header, frames, entries = load_index(remote, rclone_flags)
+    selected = select_entries(entries, paths)
+    if not selected:
+        print(f"No matching entries in {remote}", file=sys.stderr)
+        return 0
+
+    runs = plan_reads(frames, selected)
+    fetched = sum(frames[last]["offset"] + frames[last]["length"] - frames[first]["offset"] for first, last, _ in runs)
+    print(f"Restoring {len(selected)} entries, fetching {fetched / 1024 ** 2:.1f} of "
+          f"{header['compressed_bytes'] / 1024 ** 2:.1f} MiB", file=sys.stderr)
+
+    os.makedirs(target, exist_ok=True)
+    tar = subprocess.Popen(["tar", "-xf", "-", "-C", target], stdin=subprocess.PIPE)
+    try:
+        for first, last, ranges in runs:
+            position = frames[first]["tar_offset"]
+            pending = deque(ranges)
+            for data in _decompressed_run(_byte_ranges(remote, header, frames[first], frames[last]),
+                                          header["codec"], workers, rclone_flags):
+                data_end = position + len(data)
+                while pending and pending[0][0] < data_end:
+                    start, end = pending[0]
+                    tar.stdin.write(data[max(start, position) - position:min(end, data_end) - position])
+                    if end > data_end:
+                        break
+                    pending.popleft()
+                position = data_end
+        tar.stdin.write(b"\0" * BLOCK * 2)
+    finally:
+        tar.stdin.close()
+    if tar.wait() != 0:
+        raise subprocess.CalledProcessError(tar.returncode, "tar")
+    return len(selected)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="Compress a tar stream from stdin and index it")
+    pack_parser.add_argument("--index", required=True, type=Path, help="Index file to write")
+    pack_parser.add_argument("--codec", choices=CODECS, default=GZIP)
+    pack_parser.add_argument("--level", type=int, default=6)
+    pack_parser.add_argument("--long", action="store_true", help="zstd long-distance matching")
+    pack_parser.add_argument("--cores", type=int, default=4)
+    pack_parser.add_argument("--archive", help="Remote archive name (single-file backups)")
+    pack_parser.add_argument("--part-size", default="0", help="Part size of split backups (e.g. 100M)")
+
+    extract_parser = subparsers.add_parser("extract", help="Restore selected paths using the index")
+    extract_parser.add_argument("--remote", required=True, help="Remote directory holding the archive and index")
+    extract_parser.add_argument("--target", required=True)
+    extract_parser.add_argument("--path", dest="paths", action="append", default=[],
+                                help="Path relative to the source directory (repeatable)")
+    extract_parser.add_argument("--workers", type=int, default=4, help="Parallel segment downloads")
+    extract_parser.add_argument("--rclone-flags", default="")
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "pack":
+            pack(sys.stdin.buffer, sys.stdout.buffer, args.index, args.codec, args.level, args.cores, args.long,
+                 args.archive, parse_size(args.part_size) if args.part_size != "0" else 0)
+        else:
+            extract(args.remote, args.target, args.paths or [""], args.workers, args.rclone_flags)
+    except (subprocess.CalledProcessError, ValueError, KeyError, OSError) as e:
+        print(f"Indexed {args.command} failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
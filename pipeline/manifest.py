@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Checksum manifest stored next to a backup.
+
+The manifest lists the files of an archive (the `backup-part-*` files of a
+split backup, or the single `backup.tar.*`) with their sizes and MD5, SHA-1
+and SHA-256 sums, plus the size and SHA-256 of the whole archive. The sums
+are computed while the archive is produced, so no file is read twice. It is
+written at backup time and lets restores verify every download and re-fetch
+only the parts that are missing or damaged.
+
+`tee` copies stdin to stdout while hashing it and writes the manifest of a
+single archive. `verify` compares a remote backup with its manifest using
+the hashes the remote already stores (`rclone lsjson --hash`), so checking
+a backup costs one listing instead of a download.
+"""
+
+import argparse
+import hashlib
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pipeline.rclone import run_rclone
+
+MANIFEST_FILE = "backup.manifest.json"
+MANIFEST_VERSION = 2
+# Hashes recorded per file; most rclone backends store at least one of them
+HASH_TYPES = ("md5", "sha1", "sha256")
+READ_SIZE = 1024 * 1024
+
+
+class StreamHasher:
+    """Compute every HASH_TYPES digest and the size of data fed in chunks."""
+
+    def __init__(self):
+        self.size = 0
+        self._digests = [hashlib.new(name) for name in HASH_TYPES]
+
+    def update(self, data: bytes) -> None:
+        self.size += len(data)
+        for digest in self._digests:
+            digest.update(data)
+
+    def hexdigests(self) -> Dict[str, str]:
+        return {name: digest.hexdigest() for name, digest in zip(HASH_TYPES, self._digests)}
+
+
+def build_manifest(files: List[Dict], archive_sha256: str = None) -> Dict:
+    """
+    Return a manifest for `files` ([{"name", "size", <hashes>}], in archive order).
+
+    Args:
+        files: One entry per remote file
+        archive_sha256: SHA-256 of the whole archive; defaults to the only
+            file's sum for single-file archives
+    """
+    files = sorted(files, key=lambda item: item["name"])
+    if archive_sha256 is None and len(files) == 1:
+        archive_sha256 = files[0]["sha256"]
+    return {
+        "version": MANIFEST_VERSION,
+        "created": int(time.time()),
+        "archive": {"size": sum(item["size"] for item in files), "sha256": archive_sha256},
+        "files": files,
+    }
+
+
+def write_manifest(manifest: Dict, local_path: Path) -> None:
+    """Write the manifest to `local_path`."""
+    local_path.write_text(json.dumps(manifest, indent=2))
+
+
+def upload_manifest(manifest: Dict, local_path: Path, remote: str, rclone_flags: str = "") -> None:
+    """Write the manifest to `local_path` and upload it into the remote backup directory."""
+    write_manifest(manifest, local_path)
+    run_rclone(["copyto", str(local_path), f"{remote.rstrip('/')}/{MANIFEST_FILE}"], rclone_flags)
+
+
+def load_manifest(remote: str, rclone_flags: str = "") -> Optional[Dict]:
+    """Return the manifest stored in the remote backup directory, or None if it has none."""
+    try:
+        result = run_rclone(["cat", f"{remote.rstrip('/')}/{MANIFEST_FILE}"], rclone_flags, capture_output=True)
+        return json.loads(result.stdout)
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def tee(source, output, name: str, manifest_path: Path) -> Dict:
+    """Copy `source` to `output`, hashing it on the way, and write the manifest of archive `name`."""
+    hasher = StreamHasher()
+    for data in iter(lambda: source.read(READ_SIZE), b""):
+        hasher.update(data)
+        output.write(data)
+    output.flush()
+
+    manifest = build_manifest([{"name": name, "size": hasher.size, **hasher.hexdigests()}])
+    write_manifest(manifest, manifest_path)
+    return manifest
+
+
+def verify(remote: str, rclone_flags: str = "") -> List[str]:
+    """
+    Compare the files in a remote backup directory with its manifest.
+
+    Sizes are always compared; hashes are compared for every type the remote
+    reports. Nothing is downloaded apart from the manifest itself.
+
+    Returns:
+        A list of problems, empty if the backup matches
+
+    Raises:
+        FileNotFoundError: If the directory has no manifest
+    """
+    manifest = load_manifest(remote, rclone_flags)
+    if manifest is None:
+        raise FileNotFoundError(f"no {MANIFEST_FILE} in {remote}")
+
+    result = run_rclone(["lsjson", "--files-only", "--hash", remote], rclone_flags, capture_output=True)
+    listing = {item["Name"]: item for item in json.loads(result.stdout or b"[]")}
+
+    problems = []
+    compared = set()
+    for entry in manifest["files"]:
+        item = listing.get(entry["name"])
+        if item is None:
+            problems.append(f"{entry['name']}: missing")
+            continue
+        if item["Size"] != entry["size"]:
+            problems.append(f"{entry['name']}: size {item['Size']}, expected {entry['size']}")
+            continue
+        remote_hashes = {name.lower(): value.lower() for name, value in (item.get("Hashes") or {}).items() if value}
+        for name in HASH_TYPES:
+            if name in remote_hashes and name in entry:
+                compared.add(name)
+                if remote_hashes[name] != entry[name]:
+                    problems.append(f"{entry['name']}: {name} mismatch")
+                    break
+
+    print(f"Checked {len(manifest['files'])} file(s) in {remote}: {', '.join(['size', *sorted(compared)])}",
+          file=sys.stderr)
+    if not compared and not problems:
+        print(f"{remote} reports none of the hashes {', '.join(HASH_TYPES)}; only sizes were compared",
+              file=sys.stderr)
+    return problems
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    tee_parser = subparsers.add_parser("tee", help="Copy stdin to stdout and write the archive's manifest")
+    tee_parser.add_argument("--name", required=True, help="Remote name of the archive")
+    tee_parser.add_argument("--manifest", required=True, type=Path, help="Local path of the manifest to write")
+
+    verify_parser = subparsers.add_parser("verify", help="Check a remote backup against its manifest")
+    verify_parser.add_argument("--remote", required=True, help="Remote backup directory")
+    verify_parser.add_argument("--rclone-flags", default="")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "tee":
+        try:
+            tee(sys.stdin.buffer, sys.stdout.buffer, args.name, args.manifest)
+        except BrokenPipeError:
+            return 1
+        return 0
+
+    try:
+        problems = verify(args.remote, args.rclone_flags)
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        print(f"Verification failed: {e}", file=sys.stderr)
+        return 1
+    for problem in problems:
+        print(f"Verification failed: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
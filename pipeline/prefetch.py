@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Parallel ranged downloads delivered in order.
+
+Restores read an archive as one ordered byte stream, but a single rclone
+download rarely fills the link. `PrefetchReader` cuts the remote files into
+segments of at most SEGMENT_SIZE bytes, downloads up to `workers` of them at
+a time with `rclone cat --offset/--count` and yields them strictly in order
+as soon as the next one is complete. At most `workers * 2` segments are held
+in memory, so a slow consumer (the decompressor) throttles the downloads.
+"""
+
+import subprocess
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+
+from pipeline.rclone import run_rclone, share_bandwidth
+
+SEGMENT_SIZE = 16 * 1024 * 1024
+RETRIES = 3
+
+
+def segments(reads: List[Tuple[str, int, int]], segment_size: int = SEGMENT_SIZE) -> List[Tuple[str, int, int]]:
+    """Cut (remote file, offset, count) reads into segments of at most `segment_size` bytes."""
+    result = []
+    for source, offset, count in reads:
+        end = offset + count
+        while offset < end:
+            size = min(segment_size, end - offset)
+            result.append((source, offset, size))
+            offset += size
+    return result
+
+
+class PrefetchReader:
+    """Download segments concurrently and yield their data in order."""
+
+    def __init__(self, reads: List[Tuple[str, int, int]], workers: int, rclone_flags: str = "",
+                 segment_size: int = SEGMENT_SIZE):
+        self.segments = segments(reads, segment_size)
+        self.workers = max(1, workers)
+        self.rclone_flags = share_bandwidth(rclone_flags, self.workers)
+
+    def __iter__(self) -> Iterator[bytes]:
+        window = self.workers * 2
+        queue = iter(self.segments)
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                for segment in queue:
+                    pending.append(pool.submit(self._fetch, *segment))
+                    if len(pending) >= window:
+                        break
+                while pending:
+                    data = pending.popleft().result()
+                    for segment in queue:
+                        pending.append(pool.submit(self._fetch, *segment))
+                        break
+                    yield data
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _fetch(self, source: str, offset: int, count: int) -> bytes:
+        for attempt in range(1, RETRIES + 1):
+            try:
+                data = run_rclone(
+                    ["cat", "--offset", str(offset), "--count", str(count), source],
+                    self.rclone_flags, capture_output=True
+                ).stdout
+                if len(data) == count:
+                    return data
+                error = f"short read ({len(data)} of {count} bytes)"
+            except subprocess.CalledProcessError as e:
+                error = (e.stderr or b"").decode(errors="replace").strip() or str(e)
+            if attempt < RETRIES:
+                print(f"Retrying {source} at offset {offset}: {error}", file=sys.stderr)
+        raise OSError(f"cannot read {source} at offset {offset}: {error}")
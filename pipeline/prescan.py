@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Source pre-scan with a per-directory cache.
+
+`scan` lists the source with a pool of scanner threads (pipeline.walk) and
+reports the total bytes, the file count, a file size histogram and the
+largest directories. It prints the total bytes for the calling script,
+which hands them to `pv -s` for a progress ETA and can check them against
+the free space of the staging directory.
+
+The totals of every directory are cached in the job's state directory,
+keyed by the directory's mtime. A directory whose mtime has not changed
+still has the same entries, so a repeat scan of an unchanged tree costs one
+stat per directory instead of a stat per file. Files rewritten in place do
+not touch their directory's mtime; cached totals are therefore refreshed
+once they are older than REFRESH_AFTER.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import AbstractSet, Dict, List
+
+from pipeline.filters import exclude_key, load_excluded
+from pipeline.walk import list_directory, scan_tree
+
+CACHE_FILE = "prescan.json.gz"
+CACHE_VERSION = 1
+# Cached directory totals are trusted for this long, then read again
+REFRESH_AFTER = 24 * 3600
+# Directories modified this close to the scan may change again within the same mtime tick
+RACY_WINDOW = 2
+# Upper bounds of the size histogram buckets; the last bucket is open-ended
+HISTOGRAM_BOUNDS = [4 * 1024, 64 * 1024, 1024 ** 2, 16 * 1024 ** 2, 256 * 1024 ** 2, 4 * 1024 ** 3]
+HISTOGRAM_LABELS = ["<4K", "4K-64K", "64K-1M", "1M-16M", "16M-256M", "256M-4G", ">=4G"]
+LARGEST_DIRS = 10
+
+
+class DirSummary:
+    """Totals of the files directly inside one directory."""
+
+    __slots__ = ("mtime", "scanned", "files", "bytes", "histogram", "dirs")
+
+    def __init__(self, mtime: int = 0, scanned: float = 0):
+        self.mtime = mtime
+        self.scanned = scanned
+        self.files = 0
+        self.bytes = 0
+        self.histogram = [0] * len(HISTOGRAM_LABELS)
+        self.dirs = []  # type: List[str]
+
+    def to_json(self) -> List:
+        return [self.mtime, self.scanned, self.files, self.bytes, self.histogram, self.dirs]
+
+    @classmethod
+    def from_json(cls, data: List) -> "DirSummary":
+        summary = cls(data[0], data[1])
+        summary.files, summary.bytes, summary.histogram, summary.dirs = data[2:6]
+        return summary
+
+
+def _bucket(size: int) -> int:
+    for index, bound in enumerate(HISTOGRAM_BOUNDS):
+        if size < bound:
+            return index
+    return len(HISTOGRAM_BOUNDS)
+
+
+def load_cache(state_dir: Path, source: str, exclude: AbstractSet[str]) -> Dict[str, DirSummary]:
+    """Return the cached directory totals, or nothing if they were made for another source or filter."""
+    try:
+        with gzip.open(state_dir / CACHE_FILE, "rt") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if (cache.get("version"), cache.get("source"), cache.get("exclude")) != \
+            (CACHE_VERSION, source, exclude_key(exclude)):
+        return {}
+    return {rel_dir: DirSummary.from_json(data) for rel_dir, data in cache["dirs"].items()}
+
+
+def save_cache(state_dir: Path, source: str, exclude: AbstractSet[str], tree: Dict[str, DirSummary],
+               summary: Dict) -> None:
+    """Write the directory totals and the scan summary atomically."""
+    state_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_dir / f"{CACHE_FILE}.tmp"
+    with gzip.open(tmp_path, "wt", compresslevel=1) as file:
+        json.dump({
+            "version": CACHE_VERSION,
+            "source": source,
+            "exclude": exclude_key(exclude),
+            "summary": summary,
+            "dirs": {rel_dir: item.to_json() for rel_dir, item in tree.items()},
+        }, file, separators=(",", ":"))
+    os.replace(tmp_path, state_dir / CACHE_FILE)
+
+
+def scan(source: str, state_dir: Path, workers: int = 8, exclude: AbstractSet[str] = frozenset()) -> Dict:
+    """
+    Pre-scan `source`, reusing the cached totals of unchanged directories.
+
+    Returns:
+        {"total_bytes", "files", "dirs", "histogram", "largest_dirs", "cached_dirs", "seconds"}
+    """
+    started = time.time()
+    cache = load_cache(state_dir, source, exclude)
+    cached_dirs = [0]
+    lock = threading.Lock()
+
+    def lister(root: str, rel_dir: str, exclude: AbstractSet[str]) -> DirSummary:
+        path = os.path.join(root, rel_dir) if rel_dir else root
+        try:
+            mtime = os.lstat(path).st_mtime_ns
+        except OSError:
+            return DirSummary()
+        cached = cache.get(rel_dir)
+        if cached and cached.mtime == mtime and started - cached.scanned < REFRESH_AFTER:
+            with lock:
+                cached_dirs[0] += 1
+            return cached
+
+        # A directory changed during its mtime tick would look unchanged next time; don't trust it
+        racy = mtime / 1e9 > started - RACY_WINDOW
+        summary = DirSummary(mtime, 0 if racy else started)
+        listing = list_directory(root, rel_dir, exclude)
+        for _, size in listing.files:
+            summary.files += 1
+            summary.bytes += size
+            summary.histogram[_bucket(size)] += 1
+        summary.dirs = listing.dirs
+        return summary
+
+    tree = scan_tree(source, workers, exclude, lister)
+
+    subtree = {}
+    for rel_dir in sorted(tree, key=lambda path: path.count("/") + bool(path), reverse=True):
+        subtree[rel_dir] = tree[rel_dir].bytes + sum(
+            subtree.get(f"{rel_dir}/{name}" if rel_dir else name, 0) for name in tree[rel_dir].dirs
+        )
+    largest = sorted(((size, rel_dir) for rel_dir, size in subtree.items() if rel_dir), reverse=True)
+    histogram = [sum(column) for column in zip(*(item.histogram for item in tree.values()))]
+
+    summary = {
+        "scanned": int(started),
+        "total_bytes": subtree.get("", 0),
+        "files": sum(item.files for item in tree.values()),
+        "dirs": len(tree),
+        "histogram": dict(zip(HISTOGRAM_LABELS, histogram)),
+        "largest_dirs": [[rel_dir, size] for size, rel_dir in largest[:LARGEST_DIRS]],
+        "cached_dirs": cached_dirs[0],
+        "seconds": round(time.time() - started, 2),
+    }
+    save_cache(state_dir, source, exclude, tree, summary)
+    return summary
+
+
+def _print_summary(summary: Dict) -> None:
+    mib = 1024 ** 2
+    print(f"Source: {summary['total_bytes'] / mib:.1f} MiB in {summary['files']} files, {summary['dirs']} directories "
+          f"(scanned in {summary['seconds']:.1f} s, {summary['cached_dirs']} directories unchanged)", file=sys.stderr)
+    print("File sizes: " + ", ".join(f"{label} {count}" for label, count in summary["histogram"].items() if count),
+          file=sys.stderr)
+    for rel_dir, size in summary["largest_dirs"][:3]:
+        print(f"  {size / mib:10.1f} MiB  {rel_dir}", file=sys.stderr)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan", help="Print the total bytes of the source")
+    scan_parser.add_argument("--source", required=True)
+    scan_parser.add_argument("--state-dir", required=True, type=Path, help="Per-job state directory")
+    scan_parser.add_argument("--workers", type=int, default=8, help="Scanner threads")
+    scan_parser.add_argument("--exclude-from", type=Path, help="Excluded paths written by pipeline.filters")
+    scan_parser.add_argument("--staging-dir", help="Warn if this directory has less free space than the source")
+
+    args = parser.parse_args(argv)
+
+    try:
+        summary = scan(args.source, args.state_dir, args.workers, load_excluded(args.exclude_from))
+    except (OSError, ValueError) as e:
+        # The estimate is advisory; the backup runs without it
+        print(f"Pre-scan failed: {e}", file=sys.stderr)
+        return 1
+    _print_summary(summary)
+
+    if args.staging_dir:
+        free = shutil.disk_usage(args.staging_dir).free
+        if free < summary["total_bytes"]:
+            gib = 1024 ** 3
+            print(f"Warning: the archive is staged in {args.staging_dir}, which has {free / gib:.1f} GiB free "
+                  f"for up to {summary['total_bytes'] / gib:.1f} GiB of source data", file=sys.stderr)
+
+    print(summary["total_bytes"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
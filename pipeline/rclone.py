@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+rclone invocation helpers for BackupBuddy pipeline stages.
+"""
+
+import shlex
+import subprocess
+from typing import List
+
+from pipeline.units import parse_size
+
+# Flags that only make sense for a single interactive rclone process
+_INTERACTIVE_FLAGS = {"--progress", "-P"}
+
+
+def split_flags(flags: str) -> List[str]:
+    """
+    Turn the job's rclone flag string into an argument list.
+    
+    Progress output is dropped because pipeline stages run several
+    rclone processes side by side.
+    """
+    return [arg for arg in shlex.split(flags or "") if arg not in _INTERACTIVE_FLAGS]
+
+
+def _divide_bwlimit(value: str, workers: int) -> str:
+    """Divide a `--bwlimit` value ("10M" or upload:download "10M:2M") between `workers` processes."""
+    try:
+        rates = [parse_size(rate) if rate.lower() != "off" else 0 for rate in value.split(":")]
+    except ValueError:
+        # Timetables and other forms are kept as they are
+        return value
+    return ":".join(f"{max(1, rate // workers // 1024)}K" if rate else "off" for rate in rates)
+
+
+def share_bandwidth(flags: str, workers: int) -> str:
+    """
+    Return the job flags for one of `workers` rclone processes running side by side.
+    
+    `--bwlimit` limits a single process, so it is divided between the
+    workers to keep their sum within the job's (or the job runner's) limit.
+    """
+    if workers <= 1:
+        return flags
+    args = shlex.split(flags or "")
+    for index, arg in enumerate(args):
+        if arg == "--bwlimit" and index + 1 < len(args):
+            args[index + 1] = _divide_bwlimit(args[index + 1], workers)
+        elif arg.startswith("--bwlimit="):
+            args[index] = "--bwlimit=" + _divide_bwlimit(arg.split("=", 1)[1], workers)
+    return shlex.join(args)
+
+
+def rclone_command(args: List[str], flags: str = "") -> List[str]:
+    """Return the argv of an rclone call with the job flags appended."""
+    return ["rclone"] + list(args) + split_flags(flags)
+
+
+def run_rclone(args: List[str], flags: str = "", capture_output: bool = False) -> subprocess.CompletedProcess:
+    """
+    Run rclone with the job flags appended.
+    
+    Args:
+        args: rclone subcommand and its arguments
+        flags: Job rclone flags as a single string
+        capture_output: If True, capture stdout/stderr
+    
+    Returns:
+        subprocess.CompletedProcess object
+    
+    Raises:
+        subprocess.CalledProcessError: If rclone exits with an error
+    """
+    return subprocess.run(
+        rclone_command(args, flags),
+        check=True,
+        capture_output=capture_output
+    )
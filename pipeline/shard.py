@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Size-balanced sharded archives.
+
+`backup` scans the source with a pool of threads, partitions it into N
+shards of roughly equal byte size and builds every shard as an independent
+compressed tar archive, several at a time. Each shard is streamed straight
+to `<remote>/shards/<RUN_ID>/shard-NNN.tar.<ext>`; a `manifest.json` next to
+them records which paths live in which shard. Older runs are removed once
+the manifest of the new one is uploaded.
+
+Subtrees larger than a fair share are split into their entries, so one big
+directory does not end up as one big shard. The directories that were split
+(and the source root) are stored without their contents in a separate
+directory shard, which restore extracts last so their modes and mtimes
+survive the extraction of the data shards.
+
+`restore` downloads and extracts all shards of the newest run in parallel.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AbstractSet, Dict, List, Optional, Tuple
+
+from pipeline.codecs import CODECS, EXTENSIONS, GZIP, compress_command, decompress_command
+from pipeline.cpu import available_cores
+from pipeline.filters import load_excluded, tar_exclude_args
+from pipeline.rclone import rclone_command, run_rclone, share_bandwidth
+from pipeline.walk import scan_tree, subtree_sizes
+
+MANIFEST_FILE = "manifest.json"
+SHARD_DIR = "shards"
+DIRS_SHARD = "dirs"
+MANIFEST_VERSION = 1
+
+
+def _join(rel_dir: str, name: str) -> str:
+    return f"{rel_dir}/{name}" if rel_dir else name
+
+
+def plan_units(source: str, count: int, scan_workers: int = 8,
+               exclude: AbstractSet[str] = frozenset()) -> Tuple[List[Tuple[str, int]], List[str], int]:
+    """
+    Cut the source tree into archivable units of at most a fair share each.
+
+    Returns:
+        (units as (path, bytes), directories stored without contents, total bytes)
+    """
+    tree = scan_tree(source, scan_workers, exclude)
+    sizes = subtree_sizes(tree)
+    total = sizes.get("", 0)
+    share = total / max(1, count)
+
+    units = []
+    split_dirs = []
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        split_dirs.append(rel_dir or ".")
+        listing = tree[rel_dir]
+        units.extend((_join(rel_dir, name), size) for name, size in listing.files)
+        units.extend((_join(rel_dir, name), 0) for name in listing.other)
+        for name in listing.dirs:
+            rel_path = _join(rel_dir, name)
+            if sizes.get(rel_path, 0) > share and rel_path in tree:
+                pending.append(rel_path)
+            else:
+                units.append((rel_path, sizes.get(rel_path, 0)))
+
+    return units, sorted(split_dirs), total
+
+
+def balance(units: List[Tuple[str, int]], count: int) -> List[Dict]:
+    """
+    Assign units to `count` shards, largest first to the currently smallest shard.
+
+    Returns:
+        [{"bytes": int, "paths": [str]}], empty shards dropped
+    """
+    shards = [{"bytes": 0, "paths": []} for _ in range(max(1, count))]
+    heap = [(0, index) for index in range(len(shards))]
+    for path, size in sorted(units, key=lambda unit: (-unit[1], unit[0])):
+        load, index = heapq.heappop(heap)
+        shards[index]["bytes"] += size
+        shards[index]["paths"].append(path)
+        heapq.heappush(heap, (load + size, index))
+    for shard in shards:
+        shard["paths"].sort()
+    return [shard for shard in shards if shard["paths"]]
+
+
+def _write_list(path: Path, entries: List[str]) -> None:
+    with open(path, "wb") as file:
+        for entry in entries:
+            file.write(os.fsencode(entry) + b"\0")
+
+
+def _check(processes: List[Tuple[subprocess.Popen, str]]) -> None:
+    for process, name in processes:
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, name)
+
+
+def _upload_shard(source: str, list_path: Path, recursive: bool, compressor: List[str],
+                  destination: str, rclone_flags: str, exclude_args: List[str]) -> None:
+    """Stream tar | compressor | rclone rcat for one shard."""
+    tar_command = ["tar", "-cf", "-", "-C", source] + exclude_args + ["--null"]
+    if not recursive:
+        tar_command.append("--no-recursion")
+    tar = subprocess.Popen(tar_command + ["-T", str(list_path)], stdout=subprocess.PIPE)
+    compress = subprocess.Popen(compressor, stdin=tar.stdout, stdout=subprocess.PIPE)
+    tar.stdout.close()
+    upload = subprocess.Popen(rclone_command(["rcat", destination], rclone_flags), stdin=compress.stdout)
+    compress.stdout.close()
+    _check([(upload, "rclone rcat"), (compress, compressor[0]), (tar, "tar")])
+
+
+def backup(source: str, remote: str, work_dir: Path, run_id: str, count: int, workers: int,
+           codec: str, level: int, threads: int, long_mode: bool = False, rclone_flags: str = "",
+           exclude_from: Optional[Path] = None) -> Dict:
+    """
+    Build and upload the shards of one run.
+
+    Args:
+        source: Source directory
+        remote: Remote job directory; shards go to `<remote>/shards/<run_id>/`
+        work_dir: Directory for the shard path lists
+        run_id: Run identifier
+        count: Number of data shards
+        workers: Shards built at the same time
+        codec: "gzip" or "zstd"
+        level: Compression level
+        threads: Total compressor threads, divided between the workers
+        long_mode: zstd long-distance matching
+        rclone_flags: Job rclone flags
+        exclude_from: Excluded paths written by pipeline.filters
+
+    Returns:
+        The uploaded manifest
+    """
+    started = time.time()
+    units, split_dirs, total = plan_units(source, count, max(4, workers * 2), load_excluded(exclude_from))
+    shards = balance(units, count)
+    workers = max(1, min(workers, len(shards)))
+    print(f"Sharding {total / 1024 ** 2:.1f} MiB into {len(shards)} shards, {workers} at a time...",
+          file=sys.stderr)
+
+    extension = EXTENSIONS[codec]
+    compressor = compress_command(codec, level, max(1, threads // workers), long_mode)
+    run_dir = f"{remote.rstrip('/')}/{SHARD_DIR}/{run_id}"
+    upload_flags = share_bandwidth(rclone_flags, workers)
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs = []
+    for index, shard in enumerate(shards):
+        shard["name"] = f"shard-{index:03d}.tar.{extension}"
+        jobs.append((shard["name"], shard["paths"], True))
+    dirs_name = f"{DIRS_SHARD}.tar.{extension}"
+    jobs.append((dirs_name, split_dirs, False))
+
+    def build(name: str, paths: List[str], recursive: bool) -> None:
+        list_path = work_dir / f"{name}.lst"
+        _write_list(list_path, paths)
+        try:
+            _upload_shard(source, list_path, recursive, compressor, f"{run_dir}/{name}", upload_flags,
+                          tar_exclude_args(exclude_from))
+        finally:
+            list_path.unlink()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(build, *job) for job in jobs]:
+            future.result()
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "run_id": run_id,
+        "created": int(time.time()),
+        "codec": codec,
+        "total_bytes": total,
+        "shards": shards,
+        "dirs": {"name": dirs_name, "paths": split_dirs},
+    }
+    manifest_path = work_dir / MANIFEST_FILE
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    run_rclone(["copyto", str(manifest_path), f"{run_dir}/{MANIFEST_FILE}"], rclone_flags)
+
+    _prune_runs(remote, run_id, rclone_flags)
+    print(f"Uploaded {len(shards)} shards in {time.time() - started:.1f} s", file=sys.stderr)
+    return manifest
+
+
+def list_runs(remote: str, rclone_flags: str = "") -> List[str]:
+    """Return the run IDs under `<remote>/shards/`, oldest first."""
+    try:
+        result = run_rclone(["lsf", "--dirs-only", f"{remote.rstrip('/')}/{SHARD_DIR}/"], rclone_flags,
+                            capture_output=True)
+    except subprocess.CalledProcessError:
+        return []
+    return sorted(line.rstrip("/") for line in result.stdout.decode().splitlines() if line.strip())
+
+
+def _prune_runs(remote: str, keep: str, rclone_flags: str) -> None:
+    for run_id in list_runs(remote, rclone_flags):
+        if run_id != keep:
+            run_rclone(["purge", f"{remote.rstrip('/')}/{SHARD_DIR}/{run_id}"], rclone_flags)
+
+
+def load_manifest(remote: str, run_id: str, rclone_flags: str = "") -> Dict:
+    result = run_rclone(["cat", f"{remote.rstrip('/')}/{SHARD_DIR}/{run_id}/{MANIFEST_FILE}"], rclone_flags,
+                        capture_output=True)
+    return json.loads(result.stdout)
+
+
+def newest_manifest(remote: str, rclone_flags: str = "") -> Dict:
+    """
+    Return the manifest of the newest complete run.
+
+    Raises:
+        FileNotFoundError: If no run has a manifest
+    """
+    for run_id in reversed(list_runs(remote, rclone_flags)):
+        try:
+            return load_manifest(remote, run_id, rclone_flags)
+        except (subprocess.CalledProcessError, ValueError):
+            print(f"Skipping incomplete run {run_id}", file=sys.stderr)
+    raise FileNotFoundError(f"no sharded backup found under {remote}/{SHARD_DIR}")
+
+
+def _extract_shard(source: str, codec: str, target: str, rclone_flags: str) -> None:
+    """Stream rclone cat | decompressor | tar -x for one shard."""
+    download = subprocess.Popen(rclone_command(["cat", source], rclone_flags), stdout=subprocess.PIPE)
+    decompressor = decompress_command(codec)
+    decompress = subprocess.Popen(decompressor, stdin=download.stdout, stdout=subprocess.PIPE)
+    download.stdout.close()
+    tar = subprocess.Popen(["tar", "-xf", "-", "-C", target], stdin=decompress.stdout)
+    decompress.stdout.close()
+    _check([(tar, "tar"), (decompress, decompressor[0]), (download, "rclone cat")])
+
+
+def restore(remote: str, target: str, workers: int, rclone_flags: str = "") -> Dict:
+    """
+    Extract the newest sharded backup into `target`, `workers` shards at a time
+    (0 = as many as there are idle cores).
+
+    Returns:
+        The restored manifest
+    """
+    manifest = newest_manifest(remote, rclone_flags)
+    run_dir = f"{remote.rstrip('/')}/{SHARD_DIR}/{manifest['run_id']}"
+    codec = manifest["codec"]
+    workers = max(1, min(workers or available_cores(), len(manifest["shards"])))
+    os.makedirs(target, exist_ok=True)
+    print(f"Restoring {len(manifest['shards'])} shards of run {manifest['run_id']}, {workers} at a time...",
+          file=sys.stderr)
+
+    download_flags = share_bandwidth(rclone_flags, workers)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(_extract_shard, f"{run_dir}/{shard['name']}", codec, target, download_flags)
+                   for shard in manifest["shards"]]
+        for future in futures:
+            future.result()
+
+    _extract_shard(f"{run_dir}/{manifest['dirs']['name']}", codec, target, rclone_flags)
+    return manifest
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backup_parser = subparsers.add_parser("backup", help="Build and upload the shards of a run")
+    backup_parser.add_argument("--source", required=True)
+    backup_parser.add_argument("--remote", required=True, help="Remote job directory")
+    backup_parser.add_argument("--work-dir", required=True, type=Path)
+    backup_parser.add_argument("--run-id", required=True)
+    backup_parser.add_argument("--shards", type=int, default=4)
+    backup_parser.add_argument("--workers", type=int, default=4)
+    backup_parser.add_argument("--codec", choices=CODECS, default=GZIP)
+    backup_parser.add_argument("--level", type=int, default=6)
+    backup_parser.add_argument("--long", action="store_true", help="zstd long-distance matching")
+    backup_parser.add_argument("--threads", type=int, default=4)
+    backup_parser.add_argument("--rclone-flags", default="")
+    backup_parser.add_argument("--exclude-from", type=Path, help="Excluded paths written by pipeline.filters")
+
+    restore_parser = subparsers.add_parser("restore", help="Extract the newest sharded backup")
+    restore_parser.add_argument("--remote", required=True, help="Remote job directory")
+    restore_parser.add_argument("--target", required=True)
+    restore_parser.add_argument("--workers", type=int, default=0, help="Parallel shards (default: idle cores)")
+    restore_parser.add_argument("--rclone-flags", default="")
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "backup":
+            backup(args.source, args.remote, args.work_dir, args.run_id, args.shards, args.workers,
+                   args.codec, args.level, args.threads, args.long, args.rclone_flags, args.exclude_from)
+        else:
+            restore(args.remote, args.target, args.workers, args.rclone_flags)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        print(f"Sharded {args.command} failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Versioned backups with GFS retention.
+
+Every full run of a snapshot job uploads its archive to a new
+`<remote>/snapshots/<RUN_ID>/` directory, so a failed or partial upload
+never touches an earlier backup. Incremental runs add `incr/<RUN_ID>/`
+inside the snapshot their chain started with; a snapshot therefore always
+restores to the state of its newest run.
+
+`snapshots/catalog.json` lists every complete snapshot with its runs and
+files. It is only updated by `commit`, after the run has been uploaded and
+verified, so restores pick the newest complete snapshot from it and
+retention never needs a recursive listing of the destination:
+
+- `commit` records the run, keeps the newest snapshot of each of the last
+  N days, ISO weeks and months (plus the newest snapshot overall), and
+  deletes every file of the expired snapshots with a single
+  `rclone delete --files-from-raw`. Directories left behind by failed runs
+  are found with a one-level listing and purged.
+- `latest`, `runs` and `list` print the newest snapshot, the incremental
+  runs of a snapshot and all snapshots for restore scripts and the UI.
+
+If the catalog is lost, it is rebuilt from a listing of `snapshots/` and
+saved again by the next `commit`; snapshots and runs without a checksum
+manifest count as incomplete.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pipeline.manifest import MANIFEST_FILE
+from pipeline.rclone import run_rclone
+
+SNAPSHOT_DIR = "snapshots"
+CATALOG_FILE = "catalog.json"
+CATALOG_VERSION = 1
+INCR_DIR = "incr"
+RUN_ID_FORMAT = "%Y%m%d-%H%M%S"
+
+# Retention periods, newest first within each: name and bucket of a run time
+PERIODS = (
+    ("daily", lambda moment: moment.strftime("%Y-%m-%d")),
+    ("weekly", lambda moment: "{}-W{:02d}".format(*moment.isocalendar()[:2])),
+    ("monthly", lambda moment: moment.strftime("%Y-%m")),
+)
+
+
+def _list_dirs(remote: str, rclone_flags: str) -> List[str]:
+    """Return the subdirectories of `remote` (one level, no recursion)."""
+    try:
+        result = run_rclone(["lsf", "--dirs-only", f"{remote.rstrip('/')}/"], rclone_flags, capture_output=True)
+    except subprocess.CalledProcessError:
+        return []
+    return sorted(line.rstrip("/") for line in result.stdout.decode().splitlines() if line.strip())
+
+
+def _list_files(remote: str, rclone_flags: str, recursive: bool = False) -> List[str]:
+    args = ["lsjson", "--files-only"] + (["-R"] if recursive else []) + [remote]
+    result = run_rclone(args, rclone_flags, capture_output=True)
+    return sorted(item["Path"] for item in json.loads(result.stdout or b"[]"))
+
+
+def _rebuild_catalog(root: str, rclone_flags: str) -> Dict:
+    """Reconstruct the catalog from a listing of the snapshot directory."""
+    print(f"No snapshot catalog in {root}; rebuilding it from a listing", file=sys.stderr)
+    try:
+        paths = _list_files(root, rclone_flags, recursive=True)
+    except subprocess.CalledProcessError:
+        paths = []
+
+    files = {}  # type: Dict[str, List[str]]
+    for path in paths:
+        snapshot_id, _, rel = path.partition("/")
+        if rel:
+            files.setdefault(snapshot_id, []).append(rel)
+
+    snapshots = []
+    for snapshot_id, rels in sorted(files.items()):
+        if MANIFEST_FILE not in rels:
+            continue
+        runs = sorted({rel.split("/")[1] for rel in rels
+                       if rel.startswith(f"{INCR_DIR}/") and rel.endswith(f"/{MANIFEST_FILE}")})
+        kept = [rel for rel in rels if not rel.startswith(f"{INCR_DIR}/") or rel.split("/")[1] in runs]
+        snapshots.append({"id": snapshot_id, "runs": runs, "updated": runs[-1] if runs else snapshot_id,
+                          "files": kept})
+    return {"version": CATALOG_VERSION, "snapshots": snapshots}
+
+
+def load_catalog(root: str, rclone_flags: str = "") -> Dict:
+    """Return the catalog of the snapshot directory `root`, rebuilding it if it is missing."""
+    try:
+        result = run_rclone(["cat", f"{root.rstrip('/')}/{CATALOG_FILE}"], rclone_flags, capture_output=True)
+        return json.loads(result.stdout)
+    except (subprocess.CalledProcessError, ValueError):
+        return _rebuild_catalog(root, rclone_flags)
+
+
+def _save_catalog(catalog: Dict, root: str, work_dir: Path, rclone_flags: str) -> None:
+    catalog["updated"] = int(time.time())
+    local_path = work_dir / CATALOG_FILE
+    local_path.write_text(json.dumps(catalog, indent=2))
+    run_rclone(["copyto", str(local_path), f"{root.rstrip('/')}/{CATALOG_FILE}"], rclone_flags)
+
+
+def run_time(run_id: str) -> datetime:
+    """Return the local time a run ID was taken at."""
+    return datetime.strptime(run_id, RUN_ID_FORMAT)
+
+
+def expired(snapshots: List[Dict], keep: Dict[str, int]) -> List[str]:
+    """
+    Return the IDs of the snapshots the GFS policy `keep` drops.
+
+    For every period in PERIODS, the newest snapshot of each of the
+    `keep[period]` most recent periods that have one is kept; the newest
+    snapshot overall is always kept.
+    """
+    ordered = sorted(snapshots, key=lambda snapshot: snapshot["updated"], reverse=True)
+    kept = {ordered[0]["id"]} if ordered else set()
+
+    for period, bucket_of in PERIODS:
+        buckets = set()
+        for snapshot in ordered:
+            bucket = bucket_of(run_time(snapshot["updated"]))
+            if bucket in buckets:
+                continue
+            if len(buckets) >= keep.get(period, 0):
+                break
+            buckets.add(bucket)
+            kept.add(snapshot["id"])
+
+    return [snapshot["id"] for snapshot in ordered if snapshot["id"] not in kept]
+
+
+def _find(catalog: Dict, snapshot_id: str) -> Optional[Dict]:
+    for snapshot in catalog["snapshots"]:
+        if snapshot["id"] == snapshot_id:
+            return snapshot
+    return None
+
+
+def _purge_leftovers(root: str, catalog: Dict, current: str, run_id: str, rclone_flags: str) -> None:
+    """Purge directories of failed runs; only the affected directory level is listed."""
+    snapshot = _find(catalog, current)
+    if run_id == current:
+        known = {item["id"] for item in catalog["snapshots"]}
+        for name in _list_dirs(root, rclone_flags):
+            if name not in known:
+                print(f"Removing incomplete snapshot {name}", file=sys.stderr)
+                run_rclone(["purge", f"{root.rstrip('/')}/{name}"], rclone_flags)
+    else:
+        incr_root = f"{root.rstrip('/')}/{current}/{INCR_DIR}"
+        for name in _list_dirs(incr_root, rclone_flags):
+            if name not in snapshot["runs"]:
+                print(f"Removing incomplete run {current}/{INCR_DIR}/{name}", file=sys.stderr)
+                run_rclone(["purge", f"{incr_root}/{name}"], rclone_flags)
+
+
+def _delete_snapshots(root: str, snapshots: List[Dict], work_dir: Path, rclone_flags: str) -> None:
+    """Delete all files of `snapshots` with one batched rclone call."""
+    list_path = work_dir / "expired.lst"
+    list_path.write_text("".join(f"{snapshot['id']}/{rel}\n" for snapshot in snapshots for rel in snapshot["files"]))
+    run_rclone(["delete", root, "--files-from-raw", str(list_path)], rclone_flags)
+    for snapshot in snapshots:
+        # Bucket remotes have no directories; on others this drops the empty tree
+        try:
+            run_rclone(["rmdirs", f"{root.rstrip('/')}/{snapshot['id']}"], rclone_flags, capture_output=True)
+        except subprocess.CalledProcessError:
+            pass
+
+
+def commit(root: str, snapshot_id: str, run_id: str, keep: Dict[str, int], work_dir: Path,
+           rclone_flags: str = "") -> List[str]:
+    """
+    Record a finished run in the catalog and apply the retention policy.
+
+    Args:
+        root: Remote snapshot directory
+        snapshot_id: Snapshot the run belongs to (its own RUN_ID for full runs)
+        run_id: The run that just finished
+        keep: Periods to keep per retention period name ("daily", ...)
+        work_dir: Local directory for the catalog and the deletion list
+        rclone_flags: Job rclone flags
+
+    Returns:
+        IDs of the snapshots that were deleted
+    """
+    work_dir.mkdir(parents=True, exist_ok=True)
+    catalog = load_catalog(root, rclone_flags)
+
+    snapshot = _find(catalog, snapshot_id)
+    if run_id == snapshot_id:
+        if snapshot is None:
+            snapshot = {"id": snapshot_id, "runs": [], "files": []}
+            catalog["snapshots"].append(snapshot)
+        snapshot["files"] = _list_files(f"{root.rstrip('/')}/{snapshot_id}", rclone_flags)
+    else:
+        if snapshot is None:
+            raise ValueError(f"snapshot {snapshot_id} is not in the catalog")
+        prefix = f"{INCR_DIR}/{run_id}"
+        rels = [f"{prefix}/{rel}" for rel in _list_files(f"{root.rstrip('/')}/{snapshot_id}/{prefix}", rclone_flags)]
+        snapshot["files"] = [rel for rel in snapshot["files"] if not rel.startswith(f"{prefix}/")] + rels
+        if run_id not in snapshot["runs"]:
+            snapshot["runs"].append(run_id)
+    snapshot["updated"] = run_id
+    catalog["snapshots"].sort(key=lambda item: item["id"])
+
+    drop = set(expired(catalog["snapshots"], keep))
+    dropped = [item for item in catalog["snapshots"] if item["id"] in drop]
+    catalog["snapshots"] = [item for item in catalog["snapshots"] if item["id"] not in drop]
+    _save_catalog(catalog, root, work_dir, rclone_flags)
+
+    _purge_leftovers(root, {"snapshots": catalog["snapshots"] + dropped}, snapshot_id, run_id, rclone_flags)
+    if dropped:
+        print(f"Deleting {len(dropped)} expired snapshot(s) ({dropped[0]['id']} .. {dropped[-1]['id']})",
+              file=sys.stderr)
+        _delete_snapshots(root, dropped, work_dir, rclone_flags)
+    print(f"Snapshot {snapshot_id} committed; {len(catalog['snapshots'])} snapshot(s) kept", file=sys.stderr)
+    return sorted(drop)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    commit_parser = subparsers.add_parser("commit", help="Record a finished run and apply retention")
+    commit_parser.add_argument("--root", required=True, help="Remote snapshot directory")
+    commit_parser.add_argument("--id", required=True, help="Snapshot the run belongs to")
+    commit_parser.add_argument("--run-id", required=True)
+    commit_parser.add_argument("--work-dir", required=True, type=Path)
+    for period, _ in PERIODS:
+        commit_parser.add_argument(f"--keep-{period}", type=int, default=0)
+    commit_parser.add_argument("--rclone-flags", default="")
+
+    for command, help_text in (("latest", "Print the newest snapshot"),
+                               ("runs", "Print the incremental runs of a snapshot, oldest first"),
+                               ("list", "Print all snapshots with their newest run, oldest first")):
+        query_parser = subparsers.add_parser(command, help=help_text)
+        query_parser.add_argument("--root", required=True, help="Remote snapshot directory")
+        if command == "runs":
+            query_parser.add_argument("--id", required=True)
+        query_parser.add_argument("--rclone-flags", default="")
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "commit":
+            keep = {period: getattr(args, f"keep_{period}") for period, _ in PERIODS}
+            commit(args.root, args.id, args.run_id, keep, args.work_dir, args.rclone_flags)
+            return 0
+
+        catalog = load_catalog(args.root, args.rclone_flags)
+        if args.command == "runs":
+            snapshot = _find(catalog, args.id)
+            if snapshot is None:
+                raise ValueError(f"snapshot {args.id} is not in the catalog")
+            print("\n".join(snapshot["runs"]))
+        elif not catalog["snapshots"]:
+            raise FileNotFoundError(f"no snapshots in {args.root}")
+        elif args.command == "latest":
+            print(max(catalog["snapshots"], key=lambda item: item["updated"])["id"])
+        else:
+            for snapshot in catalog["snapshots"]:
+                print(f"{snapshot['id']} {snapshot['updated']} {len(snapshot['runs'])}")
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        print(f"Snapshot {args.command} failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
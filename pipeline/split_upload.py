@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Split a compressed stream into parts and upload them while it is produced.
+
+Reads the archive from stdin, cuts it into `backup-part-*` files named
+exactly like `split -b` would, and hands every finished part to a pool of
+rclone uploads. At most `queue` parts wait on local disk; a part is deleted
+as soon as rclone confirms it on the remote.
+
+When all parts are uploaded, a checksum manifest (pipeline.manifest) listing
+every part with its size and hashes, computed while the part was written,
+is uploaded next to them together with the whole archive's SHA-256; parts left
+over from an earlier, longer backup are removed from the remote.
+
+With `--journal`, every confirmed part is checkpointed with its SHA-256.
+If a run is interrupted, the next run
+over an unchanged source (same file-state fingerprint) skips every part
+whose content matches the journal and is still on the remote, and uploads
+only from the first missing or different part on. Runs that upload to a
+directory of their own (snapshots, incremental archives) pass no journal,
+since no later run could resume them.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pipeline.file_index import fingerprint
+from pipeline.filters import load_excluded
+from pipeline.manifest import MANIFEST_FILE, StreamHasher, build_manifest, upload_manifest
+from pipeline.rclone import run_rclone, share_bandwidth
+from pipeline.units import parse_size
+
+READ_SIZE = 1024 * 1024
+JOURNAL_FILE = "upload_journal.json"
+_LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def part_suffix(index: int) -> str:
+    """
+    Return the suffix `split` gives the part at `index`.
+    
+    Mirrors GNU split's auto-widening suffixes (aa..yz, zaaa..zyzz,
+    zzaaaa, ...) so the parts keep sorting in order for `cat backup-part-*`.
+    """
+    width = 2
+    prefix = ""
+    while index >= 25 * 26 ** (width - 1):
+        index -= 25 * 26 ** (width - 1)
+        prefix += "z"
+        width += 1
+    
+    letters = []
+    for _ in range(width):
+        index, remainder = divmod(index, 26)
+        letters.append(_LETTERS[remainder])
+    return prefix + "".join(reversed(letters))
+
+
+class UploadJournal:
+    """
+    Checkpoint of the parts of one split upload that reached the remote.
+    
+    The journal of an interrupted run is only reused if the remote, the part
+    size and the source fingerprint all match. The fingerprint is computed in
+    the background and added to the checkpoint once it is ready; uploads only
+    wait for it when an earlier journal for the same remote has to be checked.
+    """
+    
+    def __init__(self, path: Path, remote: str, part_size: int, source_fingerprint: Future, rclone_flags: str):
+        self.path = path
+        self.remote = remote
+        self.part_size = part_size
+        self.rclone_flags = rclone_flags
+        self.reused = 0
+        self._fingerprint = source_fingerprint
+        self._previous = None  # type: Optional[Dict[str, Dict]]
+        self._parts = {}  # type: Dict[str, Dict]
+        self._lock = threading.Lock()
+        source_fingerprint.add_done_callback(lambda _: self._fingerprinted())
+    
+    def finished(self, name: str, sha256: str, size: int) -> bool:
+        """Return True if the interrupted run already uploaded this exact part."""
+        if self._previous is None:
+            self._previous = self._load_previous()
+        if self._previous.get(name) != {"sha256": sha256, "size": size}:
+            return False
+        self.reused += 1
+        return True
+    
+    def forget(self, name: str) -> None:
+        """Drop a part from the checkpoint before it is overwritten on the remote."""
+        with self._lock:
+            if self._parts.pop(name, None) is not None:
+                self._save()
+    
+    def record(self, name: str, sha256: str, size: int) -> None:
+        """Checkpoint a part confirmed on the remote."""
+        with self._lock:
+            self._parts[name] = {"sha256": sha256, "size": size}
+            self._save()
+    
+    def close(self) -> None:
+        """Drop the journal after the upload completed."""
+        if self.path.exists():
+            self.path.unlink()
+    
+    def _load_previous(self) -> Dict[str, Dict]:
+        try:
+            journal = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            journal = {}
+        
+        parts = {}
+        # The fingerprint is only waited for if the journal could otherwise be reused
+        if (journal.get("remote"), journal.get("part_size")) == (self.remote, self.part_size) and \
+                journal.get("parts") and journal.get("fingerprint") == self._fingerprint.result():
+            # Only trust parts that are still on the remote with the journaled size
+            try:
+                listing = run_rclone(["lsjson", "--files-only", self.remote], self.rclone_flags, capture_output=True)
+                remote_sizes = {item["Name"]: item["Size"] for item in json.loads(listing.stdout or b"[]")}
+            except (subprocess.CalledProcessError, ValueError):
+                remote_sizes = {}
+            parts = {name: part for name, part in journal["parts"].items() if remote_sizes.get(name) == part["size"]}
+            print(f"Resuming interrupted upload: {len(parts)} parts already on the remote", file=sys.stderr)
+        
+        # Parts of the interrupted run stay checkpointed until this run overwrites them
+        with self._lock:
+            self._parts = dict(parts)
+            self._save()
+        return parts
+    
+    def _fingerprinted(self) -> None:
+        # Checkpoints written before the fingerprint was ready cannot be resumed yet
+        with self._lock:
+            if self._parts:
+                self._save()
+    
+    def _save(self) -> None:
+        ready = self._fingerprint.done() and self._fingerprint.exception() is None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps({
+            "remote": self.remote,
+            "part_size": self.part_size,
+            "fingerprint": self._fingerprint.result() if ready else None,
+            "parts": self._parts,
+        }))
+        os.replace(tmp_path, self.path)
+
+
+class PartUploader:
+    """Upload finished parts concurrently with a bounded backlog."""
+    
+    def __init__(self, remote: str, rclone_flags: str, workers: int, queue: int,
+                 journal: Optional[UploadJournal] = None):
+        self.remote = remote.rstrip("/")
+        self.rclone_flags = share_bandwidth(rclone_flags, workers)
+        self.journal = journal
+        self.files = []  # type: List[Dict]
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._slots = threading.BoundedSemaphore(max(1, queue))
+        self._futures = []
+    
+    def submit(self, part: Path, hashes: Dict[str, str]) -> None:
+        """Queue a finished part with its hashes, blocking while the backlog is full."""
+        size = part.stat().st_size
+        sha256 = hashes["sha256"]
+        self.files.append({"name": part.name, "size": size, **hashes})
+        if self.journal:
+            if self.journal.finished(part.name, sha256, size):
+                part.unlink()
+                return
+            self.journal.forget(part.name)
+        self._slots.acquire()
+        self._raise_failures()
+        future = self._pool.submit(self._upload, part, sha256, size)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+    
+    def close(self) -> None:
+        """Wait for all uploads and raise the first failure, if any."""
+        self._pool.shutdown(wait=True)
+        self._raise_failures()
+    
+    def _upload(self, part: Path, sha256: str, size: int) -> None:
+        run_rclone(["copyto", str(part), f"{self.remote}/{part.name}"], self.rclone_flags)
+        if self.journal:
+            self.journal.record(part.name, sha256, size)
+        part.unlink()
+    
+    def _raise_failures(self) -> None:
+        for future in self._futures:
+            if future.done() and future.exception():
+                raise future.exception()
+
+
+def remove_stale_parts(remote: str, prefix: str, keep: List[str], rclone_flags: str = "") -> int:
+    """
+    Delete remote parts named like `prefix` that are not in `keep`.
+    
+    Returns:
+        Number of parts deleted
+    """
+    result = run_rclone(["lsjson", "--files-only", remote], rclone_flags, capture_output=True)
+    stale = [item["Name"] for item in json.loads(result.stdout or b"[]")
+             if item["Name"].startswith(prefix) and item["Name"] not in keep]
+    for name in stale:
+        run_rclone(["deletefile", f"{remote.rstrip('/')}/{name}"], rclone_flags)
+    return len(stale)
+
+
+def split_stream(stream, prefix: str, part_size: int, uploader: PartUploader, archive_digest=None) -> int:
+    """
+    Cut `stream` into parts of `part_size` bytes and submit each one.
+    
+    Every part is hashed while it is written; `archive_digest`, if given, is
+    fed the whole stream.
+    
+    Returns:
+        Number of parts written
+    """
+    parts = 0
+    output = None
+    written = 0
+    digest = None
+    
+    try:
+        while True:
+            chunk = stream.read(READ_SIZE)
+            if not chunk:
+                break
+            if archive_digest is not None:
+                archive_digest.update(chunk)
+            
+            while chunk:
+                if output is None:
+                    part_path = Path(f"{prefix}{part_suffix(parts)}")
+                    output = open(part_path, "wb")
+                    written = 0
+                    digest = StreamHasher()
+                
+                take = chunk[:part_size - written]
+                output.write(take)
+                digest.update(take)
+                written += len(take)
+                chunk = chunk[len(take):]
+                
+                if written == part_size:
+                    output.close()
+                    uploader.submit(part_path, digest.hexdigests())
+                    parts += 1
+                    output = None
+        
+        if output is not None:
+            output.close()
+            uploader.submit(part_path, digest.hexdigests())
+            parts += 1
+            output = None
+    finally:
+        if output is not None:
+            output.close()
+    
+    return parts
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--prefix", required=True, help="Local path prefix for parts, e.g. /tmp/x/backup-part-")
+    parser.add_argument("--size", required=True, help="Part size, e.g. 100M")
+    parser.add_argument("--remote", required=True, help="Remote directory to upload parts to")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent uploads")
+    parser.add_argument("--queue", type=int, default=4, help="Maximum parts waiting on local disk")
+    parser.add_argument("--rclone-flags", default="", help="Flags passed to every rclone call")
+    parser.add_argument("--journal", type=Path, help="Checkpoint file for resuming an interrupted upload")
+    parser.add_argument("--source", help="Source directory whose fingerprint guards the journal")
+    parser.add_argument("--exclude-from", type=Path, help="Excluded paths written by pipeline.filters")
+    args = parser.parse_args(argv)
+    
+    part_size = parse_size(args.size)
+    journal = None
+    fingerprinter = None
+    if args.journal and args.source:
+        fingerprinter = ThreadPoolExecutor(max_workers=1)
+        journal = UploadJournal(args.journal, args.remote.rstrip("/"), part_size,
+                                fingerprinter.submit(fingerprint, args.source, load_excluded(args.exclude_from)),
+                                args.rclone_flags)
+    
+    uploader = PartUploader(args.remote, args.rclone_flags, args.workers, args.queue, journal)
+    archive_digest = hashlib.sha256()
+    try:
+        try:
+            parts = split_stream(sys.stdin.buffer, args.prefix, part_size, uploader, archive_digest)
+        finally:
+            uploader.close()
+            if fingerprinter:
+                fingerprinter.shutdown(wait=False)
+        manifest = build_manifest(uploader.files, archive_digest.hexdigest())
+        upload_manifest(manifest, Path(args.prefix).parent / MANIFEST_FILE, args.remote, args.rclone_flags)
+        stale = remove_stale_parts(args.remote, Path(args.prefix).name,
+                                   [item["name"] for item in uploader.files], args.rclone_flags)
+    except subprocess.CalledProcessError as e:
+        print(f"Part upload failed: {e}", file=sys.stderr)
+        return 1
+    
+    if journal:
+        journal.close()
+        if journal.reused:
+            print(f"Reused {journal.reused} parts uploaded by the interrupted run", file=sys.stderr)
+    if stale:
+        print(f"Removed {stale} parts left over from the previous backup", file=sys.stderr)
+    print(f"Uploaded {parts} parts to {args.remote}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Size and age parsing helpers for BackupBuddy pipeline stages.
+"""
+
+import re
+
+# Same suffix rules as `split -b`: K/M/G/T are powers of 1024, KB/MB/GB/TB powers of 1000
+_SIZE_UNITS = {
+    "": 1,
+    "B": 1,
+    "K": 1024, "KIB": 1024, "KB": 1000,
+    "M": 1024 ** 2, "MIB": 1024 ** 2, "MB": 1000 ** 2,
+    "G": 1024 ** 3, "GIB": 1024 ** 3, "GB": 1000 ** 3,
+    "T": 1024 ** 4, "TIB": 1024 ** 4, "TB": 1000 ** 4,
+}
+
+
+def parse_size(value: str) -> int:
+    """
+    Parse a human readable size such as '100M' or '1G' into bytes.
+    
+    Args:
+        value: Size string
+    
+    Returns:
+        Size in bytes
+    
+    Raises:
+        ValueError: If the size cannot be parsed
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([A-Za-z]*)\s*", str(value))
+    if not match or match.group(2).upper() not in _SIZE_UNITS:
+        raise ValueError(f"Invalid size: {value}")
+    
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]
+
+
+# Age suffixes as in rclone's --max-age; a bare number is a number of days
+_AGE_UNITS = {
+    "s": 1,
+    "m": 60,
+    "h": 3600,
+    "": 86400, "d": 86400,
+    "w": 7 * 86400,
+    "M": 30 * 86400,
+    "y": 365 * 86400,
+}
+
+
+def parse_age(value: str) -> int:
+    """
+    Parse an age such as '30d', '12h' or '6M' into seconds.
+    
+    Args:
+        value: Age string
+    
+    Returns:
+        Age in seconds
+    
+    Raises:
+        ValueError: If the age cannot be parsed
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([A-Za-z]?)\s*", str(value))
+    if not match or match.group(2) not in _AGE_UNITS:
+        raise ValueError(f"Invalid age: {value}")
+    
+    return int(match.group(1)) * _AGE_UNITS[match.group(2)]
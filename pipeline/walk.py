@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Directory tree walking for BackupBuddy pipeline stages.
+"""
+
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AbstractSet, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+def walk_tree(root: str, exclude: AbstractSet[str] = frozenset()) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Yield every entry below `root` with its lstat result.
+
+    Paths are relative to `root` and use '/' separators, which is the form
+    tar (`-C root`) and rclone (`--files-from`) both expect. Symlinks are
+    reported but never followed; unreadable directories are skipped with a
+    warning on stderr.
+
+    Args:
+        root: Directory to walk
+        exclude: Relative paths to leave out; excluded directories are not entered
+
+    Yields:
+        (relative_path, stat_result) tuples
+    """
+    stack = [""]
+
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, rel_dir) if rel_dir else root) as entries:
+                for entry in entries:
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    if rel_path in exclude:
+                        continue
+                    try:
+                        stat_result = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+
+                    yield rel_path, stat_result
+
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(rel_path)
+        except OSError as e:
+            print(f"Warning: cannot read {rel_dir or root}: {e}", file=sys.stderr)
+
+
+class DirListing:
+    """Direct contents of one directory as found by scan_tree."""
+
+    __slots__ = ("files", "dirs", "other")
+
+    def __init__(self):
+        self.files = []  # type: List[Tuple[str, int]]
+        self.dirs = []  # type: List[str]
+        self.other = []  # type: List[str]
+
+
+def list_directory(root: str, rel_dir: str, exclude: AbstractSet[str] = frozenset()) -> DirListing:
+    """Return the direct contents of one directory below `root`, minus `exclude`."""
+    listing = DirListing()
+    try:
+        with os.scandir(os.path.join(root, rel_dir) if rel_dir else root) as entries:
+            for entry in entries:
+                if exclude and (f"{rel_dir}/{entry.name}" if rel_dir else entry.name) in exclude:
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        listing.dirs.append(entry.name)
+                    elif entry.is_file(follow_symlinks=False):
+                        listing.files.append((entry.name, entry.stat(follow_symlinks=False).st_size))
+                    else:
+                        listing.other.append(entry.name)
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"Warning: cannot read {rel_dir or root}: {e}", file=sys.stderr)
+    return listing
+
+
+def scan_tree(root: str, workers: int = 8, exclude: AbstractSet[str] = frozenset(),
+              lister: Optional[Callable[[str, str, AbstractSet[str]], Any]] = None) -> Dict[str, Any]:
+    """
+    List every directory below `root` using a pool of scanner threads.
+
+    Directory reads release the GIL, so several threads keep more requests
+    in flight on network filesystems and multi-disk arrays than a single
+    walk does.
+
+    Args:
+        root: Directory to scan
+        workers: Number of scanner threads
+        exclude: Relative paths to leave out; excluded directories are not entered
+        lister: Replaces list_directory; called with (root, rel_dir, exclude) and
+            must return an object whose `dirs` names the subdirectories to scan
+
+    Returns:
+        {relative directory ("" for root): DirListing, or what `lister` returned}
+    """
+    lister = lister or list_directory
+    tree = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = {pool.submit(lister, root, "", exclude): ""}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir = pending.pop(future)
+                listing = future.result()
+                tree[rel_dir] = listing
+                for name in listing.dirs:
+                    rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                    pending[pool.submit(lister, root, rel_path, exclude)] = rel_path
+    return tree
+
+
+def subtree_sizes(tree: Dict[str, DirListing]) -> Dict[str, int]:
+    """Return the total file bytes below every directory of a scan_tree result."""
+    sizes = {}
+    for rel_dir in sorted(tree, key=lambda path: path.count("/") + bool(path), reverse=True):
+        listing = tree[rel_dir]
+        total = sum(size for _, size in listing.files)
+        for name in listing.dirs:
+            total += sizes.get(f"{rel_dir}/{name}" if rel_dir else name, 0)
+        sizes[rel_dir] = total
+    return sizes
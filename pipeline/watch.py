@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+inotify change tracker for incremental runs.
+
+`run` watches every directory below a job's source with inotify and appends
+the paths it sees change to a journal in the job's state directory. A run
+of the job then `take`s the journal instead of walking the tree: the file
+index re-reads only the dirty paths, and transfers copy only the dirty
+files. `release` drops the taken journal once the run succeeded; a failed
+run leaves it in place for the next one.
+
+The journal is only trusted when it covers everything since the last
+successful run: the watcher must still be running and must have had all its
+watches in place before that run started. Otherwise, and after the kernel
+dropped events (IN_Q_OVERFLOW), `take` asks for a full rescan.
+
+A path in the journal means the entry itself may have changed; for a
+directory that was created or moved in, its whole subtree is new. inotify
+only sees changes made through the local kernel, so network filesystems
+changed from other hosts must not be watched.
+
+`start` launches `run` in the background unless a watcher already holds
+the job's lock; `stop` ends it.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import json
+import os
+import select
+import signal
+import stat
+import struct
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+JOURNAL_FILE = "watch.journal"
+TAKEN_FILE = "watch.taken"
+STATE_FILE = "watch.json"
+SYNC_FILE = "watch.sync.json"
+LOCK_FILE = "watch.lock"
+PID_FILE = "watch.pid"
+LOG_FILE = "watch.log"
+# Dirty paths are written out at least this often
+FLUSH_INTERVAL = 1.0
+# ...or as soon as this many are pending
+FLUSH_PATHS = 10000
+READ_SIZE = 64 * 1024
+# An empty journal record asks the next run for a full rescan
+RESCAN = ""
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+# Events that add or remove entries, which also changes the directory itself
+ENTRY_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal ctypes binding of the inotify syscalls."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read_events(self):
+        """Yield (wd, mask, name) for the events currently queued."""
+        data = os.read(self.fd, READ_SIZE)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            yield wd, mask, name
+
+
+def _locked(state_dir: Path):
+    """Open and exclusively lock the journal lock file."""
+    file = open(state_dir / LOCK_FILE, "a")
+    fcntl.flock(file, fcntl.LOCK_EX)
+    return file
+
+
+def append_journal(state_dir: Path, paths: Set[str]) -> None:
+    """Append dirty paths to the journal, serialised with `take`."""
+    with _locked(state_dir):
+        with open(state_dir / JOURNAL_FILE, "ab") as journal:
+            journal.write(b"".join(os.fsencode(path) + b"\0" for path in sorted(paths)))
+
+
+def _read_records(path: Path) -> List[str]:
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return []
+    return [os.fsdecode(record) for record in data.split(b"\0")[:-1]]
+
+
+class Watcher:
+    """Watch a source tree and journal the paths that change."""
+
+    def __init__(self, source: str, state_dir: Path):
+        self.source = source.rstrip("/") or "/"
+        self.state_dir = state_dir
+        self.inotify = Inotify()
+        self.paths = {}  # type: Dict[int, str]
+        self.dirty = set()  # type: Set[str]
+
+    def _add_tree(self, rel_dir: str, mark: bool) -> None:
+        """Watch `rel_dir` and every directory below it, optionally marking all entries dirty."""
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            path = os.path.join(self.source, current) if current else self.source
+            try:
+                self.paths[self.inotify.add_watch(path, WATCH_MASK)] = current
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise OSError(e.errno, "out of inotify watches; raise fs.inotify.max_user_watches") from e
+                # Gone or unreadable: whatever happened is seen through its parent
+                continue
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        rel_path = f"{current}/{entry.name}" if current else entry.name
+                        if mark:
+                            self.dirty.add(rel_path)
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(rel_path)
+            except OSError:
+                continue
+
+    def _handle(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            print("Event queue overflowed; the next run rescans the source", file=sys.stderr)
+            self.dirty.add(RESCAN)
+            return
+        if mask & IN_IGNORED:
+            self.paths.pop(wd, None)
+            return
+        rel_dir = self.paths.get(wd)
+        if rel_dir is None:
+            return
+        if not name:
+            # The directory itself changed, was deleted or moved; its parent's watch reports the entry
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and not rel_dir:
+                print(f"{self.source} was removed or moved; stopping", file=sys.stderr)
+                self.dirty.add(RESCAN)
+                raise SystemExit(1)
+            if rel_dir:
+                self.dirty.add(rel_dir)
+            return
+
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        self.dirty.add(rel_path)
+        if mask & ENTRY_EVENTS and rel_dir:
+            self.dirty.add(rel_dir)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            # Entries made before the new watch existed produce no events
+            self._add_tree(rel_path, mark=True)
+
+    def flush(self) -> None:
+        if self.dirty:
+            append_journal(self.state_dir, self.dirty)
+            self.dirty = set()
+
+    def run(self) -> None:
+        started = time.time()
+        self._add_tree("", mark=False)
+        self.flush()
+        _write_json(self.state_dir / STATE_FILE, {"pid": os.getpid(), "source": self.source, "ready": time.time()})
+        print(f"Watching {len(self.paths)} directories below {self.source} "
+              f"(ready after {time.time() - started:.1f} s)", file=sys.stderr)
+
+        poller = select.poll()
+        poller.register(self.inotify.fd, select.POLLIN)
+        last_flush = time.monotonic()
+        try:
+            while True:
+                if poller.poll(FLUSH_INTERVAL * 1000):
+                    for event in self.inotify.read_events():
+                        self._handle(*event)
+                if len(self.dirty) >= FLUSH_PATHS or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    self.flush()
+                    last_flush = time.monotonic()
+        finally:
+            self.flush()
+
+
+def _write_json(path: Path, data: Dict) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(data))
+    os.replace(tmp_path, path)
+
+
+def _load_json(path: Path) -> Dict:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def running(state_dir: Path) -> bool:
+    """Whether a watcher holds the job's PID file lock."""
+    try:
+        with open(state_dir / PID_FILE, "a") as file:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def take(state_dir: Path, source: str) -> Optional[Set[str]]:
+    """
+    Take the journal for a run and return the dirty paths.
+
+    Paths taken by an earlier run that failed are included. Returns None if
+    the journal does not cover everything since the last successful run and
+    the source must be rescanned.
+    """
+    state_dir.mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    with _locked(state_dir):
+        journal = state_dir / JOURNAL_FILE
+        if journal.exists():
+            with open(state_dir / TAKEN_FILE, "ab") as taken:
+                taken.write(journal.read_bytes())
+            journal.unlink()
+
+    taken_state = _load_json(state_dir / SYNC_FILE)
+    _write_json(state_dir / SYNC_FILE, {"synced": taken_state.get("synced"), "taking": now})
+
+    state = _load_json(state_dir / STATE_FILE)
+    ready = state.get("ready")
+    synced = taken_state.get("synced")
+    if state.get("source") != (source.rstrip("/") or "/") or not running(state_dir):
+        print("No change watcher running for this source; scanning the whole tree", file=sys.stderr)
+        return None
+    if ready is None or synced is None or synced < ready:
+        print("Change watcher started after the last run; scanning the whole tree", file=sys.stderr)
+        return None
+
+    dirty = set(_read_records(state_dir / TAKEN_FILE))
+    if RESCAN in dirty:
+        print("Change watcher lost events; scanning the whole tree", file=sys.stderr)
+        return None
+    return dirty
+
+
+def release(state_dir: Path) -> None:
+    """Drop the journal taken by a run that succeeded; later runs start from its start time."""
+    taken_path = state_dir / SYNC_FILE
+    taken_state = _load_json(taken_path)
+    if taken_state.get("taking") is None:
+        return
+    _write_json(taken_path, {"synced": taken_state["taking"], "taking": None})
+    try:
+        (state_dir / TAKEN_FILE).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def changed_files(source: str, dirty: Set[str]) -> List[str]:
+    """Return the dirty paths that are files (or symlinks) now, for copying with rclone."""
+    files = []
+    for rel_path in sorted(dirty):
+        try:
+            st = os.lstat(os.path.join(source, rel_path))
+        except OSError:
+            continue
+        if not stat.S_ISDIR(st.st_mode):
+            files.append(rel_path)
+    return files
+
+
+def start(state_dir: Path, source: str) -> bool:
+    """Start a background watcher unless one is running. Returns True if one was started."""
+    state_dir.mkdir(parents=True, exist_ok=True)
+    if running(state_dir):
+        return False
+    with open(state_dir / LOG_FILE, "ab") as log:
+        subprocess.Popen(
+            [sys.executable, "-m", "pipeline.watch", "run", "--state-dir", str(state_dir), "--source", source],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True,
+            cwd=str(Path(__file__).resolve().parent.parent)
+        )
+    return True
+
+
+def stop(state_dir: Path) -> bool:
+    """Stop the job's watcher. Returns True if one was running."""
+    if not running(state_dir):
+        return False
+    try:
+        os.kill(int((state_dir / PID_FILE).read_text()), signal.SIGTERM)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _run(state_dir: Path, source: str) -> int:
+    state_dir.mkdir(parents=True, exist_ok=True)
+    pid_file = open(state_dir / PID_FILE, "a+")
+    try:
+        fcntl.flock(pid_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("A watcher is already running for this job", file=sys.stderr)
+        return 0
+    pid_file.truncate(0)
+    pid_file.write(str(os.getpid()))
+    pid_file.flush()
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    _write_json(state_dir / STATE_FILE, {"pid": os.getpid(), "source": source.rstrip("/") or "/", "ready": None})
+    Watcher(source, state_dir).run()
+    return 0
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, help_text in (("run", "Watch the source in the foreground"),
+                            ("start", "Start a background watcher unless one is running")):
+        command_parser = subparsers.add_parser(name, help=help_text)
+        command_parser.add_argument("--state-dir", required=True, type=Path)
+        command_parser.add_argument("--source", required=True)
+
+    stop_parser = subparsers.add_parser("stop", help="Stop the job's watcher")
+    stop_parser.add_argument("--state-dir", required=True, type=Path)
+
+    take_parser = subparsers.add_parser("take", help="Write the changed files for a transfer, or ask for a rescan")
+    take_parser.add_argument("--state-dir", required=True, type=Path)
+    take_parser.add_argument("--source", required=True)
+    take_parser.add_argument("--out", required=True, type=Path, help="Newline separated list for --files-from-raw")
+
+    release_parser = subparsers.add_parser("release", help="Drop the journal taken by a successful run")
+    release_parser.add_argument("--state-dir", required=True, type=Path)
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "run":
+            return _run(args.state_dir, args.source)
+        if args.command == "start":
+            if start(args.state_dir, args.source):
+                print(f"Started change watcher for {args.source}", file=sys.stderr)
+        elif args.command == "stop":
+            if stop(args.state_dir):
+                print("Stopped change watcher", file=sys.stderr)
+        elif args.command == "take":
+            dirty = take(args.state_dir, args.source)
+            files = changed_files(args.source, dirty) if dirty is not None else []
+            if dirty is None or any("\n" in path for path in files):
+                print("rescan")
+                return 0
+            args.out.write_text("".join(f"{path}\n" for path in files), encoding="utf-8", errors="surrogateescape")
+            print(f"{len(files)} changed file(s) since the last run", file=sys.stderr)
+            print("dirty")
+        else:
+            release(args.state_dir)
+    except OSError as e:
+        print(f"Change watcher failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Per-run working directories below the shared temp directory.
+
+Every generated script works in `<temp>/<job id>/<run id>-<pid>` and
+removes it on exit. `claim` creates that directory with an owner marker
+(PID plus process start time, so a recycled PID is not mistaken for the
+owner); `sweep` removes directories whose owner is gone, which only
+happens when a run was killed before its exit trap could fire. Restore
+download caches marked with RESUME_FILE are kept for RESUME_GRACE so an
+interrupted restore can pick up where it stopped: `adopt` hands such a
+cache to the next restore of the job, and to only one of them if several
+start at once.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+OWNER_FILE = ".owner"
+# Directories without an owner marker are left alone for this long, so a
+# run that is still between mkdir and writing its marker is never swept.
+UNCLAIMED_GRACE = 3600
+# Directories holding an interrupted, resumable download are kept this long
+RESUME_FILE = ".resume.json"
+RESUME_GRACE = 7 * 24 * 3600
+
+
+def process_start_time(pid: int) -> Optional[str]:
+    """Return the start time of `pid` from /proc, or None if it is not running."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # The command name may contain spaces; fields resume after ')'
+            return file.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def claim(work_dir: Path, pid: int) -> None:
+    """Create `work_dir` and mark it as owned by `pid`."""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    (work_dir / OWNER_FILE).write_text(f"{pid} {process_start_time(pid) or ''}\n")
+
+
+def owner_alive(work_dir: Path) -> bool:
+    """Check whether the process that claimed `work_dir` is still running."""
+    try:
+        fields = (work_dir / OWNER_FILE).read_text().split()
+    except OSError:
+        return time.time() - work_dir.stat().st_mtime < UNCLAIMED_GRACE
+
+    pid = int(fields[0])
+    started = process_start_time(pid)
+    if started is not None:
+        return len(fields) < 2 or fields[1] == started
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return not Path("/proc/self").exists()
+
+
+def _resumable(run_dir: Path) -> bool:
+    """Check whether `run_dir` holds a recent download that a rerun can resume."""
+    try:
+        return time.time() - (run_dir / RESUME_FILE).stat().st_mtime < RESUME_GRACE
+    except OSError:
+        return False
+
+
+def adopt(work_dir: Path, pid: int, prefix: str) -> None:
+    """
+    Claim `work_dir` for `pid`, taking over a resumable sibling named `prefix`* left by a dead run.
+
+    The newest such directory is renamed to `work_dir`; renaming is atomic,
+    so runs starting together never take over the same one.
+    """
+    candidates = []
+    for run_dir in work_dir.parent.glob(f"{prefix}*"):
+        try:
+            if run_dir.is_dir() and run_dir != work_dir and not owner_alive(run_dir) and _resumable(run_dir):
+                candidates.append((run_dir.stat().st_mtime, run_dir))
+        except (OSError, ValueError):
+            continue
+
+    for _, run_dir in sorted(candidates, reverse=True):
+        try:
+            os.rename(run_dir, work_dir)
+        except OSError:
+            continue
+        print(f"Resuming the download in {run_dir.name}", file=sys.stderr)
+        break
+    claim(work_dir, pid)
+
+
+def sweep(root: Path) -> List[Path]:
+    """
+    Remove stale run directories below `root`.
+
+    Args:
+        root: Shared temp directory (`<root>/<job id>/<run dir>`)
+
+    Returns:
+        The directories that were removed
+    """
+    removed = []
+    if not root.is_dir():
+        return removed
+
+    for job_dir in root.iterdir():
+        if not job_dir.is_dir() or job_dir.is_symlink():
+            continue
+        for run_dir in job_dir.iterdir():
+            try:
+                if not run_dir.is_dir() or owner_alive(run_dir) or _resumable(run_dir):
+                    continue
+            except (OSError, ValueError):
+                continue
+            shutil.rmtree(run_dir, ignore_errors=True)
+            removed.append(run_dir)
+        try:
+            job_dir.rmdir()
+        except OSError:
+            pass
+
+    return removed
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    claim_parser = subparsers.add_parser("claim", help="Create a run directory owned by a process")
+    claim_parser.add_argument("work_dir", type=Path)
+    claim_parser.add_argument("--pid", type=int, required=True)
+
+    adopt_parser = subparsers.add_parser("adopt", help="Claim a run directory, resuming one left by a dead run")
+    adopt_parser.add_argument("work_dir", type=Path)
+    adopt_parser.add_argument("--pid", type=int, required=True)
+    adopt_parser.add_argument("--prefix", required=True, help="Name prefix of the directories that may be resumed")
+
+    sweep_parser = subparsers.add_parser("sweep", help="Remove run directories left by dead runs")
+    sweep_parser.add_argument("--root", required=True, type=Path)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "claim":
+        claim(args.work_dir, args.pid)
+    elif args.command == "adopt":
+        adopt(args.work_dir, args.pid, args.prefix)
+    else:
+        for run_dir in sweep(args.root):
+            print(f"Removed stale working directory {run_dir}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,9 +3,37 @@
 Script generation for BackupBuddy.
 """
 
+import json
+import shlex
 from pathlib import Path
-from typing import Dict
-from config.constants import SCRIPT_DIR, TEMP_DIR
+from typing import Dict, List, Optional
+from config.constants import (
+    APP_DIR, SCRIPT_DIR, STATE_DIR, TEMP_DIR, BACKUP_PACING_FLAGS, CORES_AUTO, DEDUP_REPO_DIR, DEFAULT_BACKUP_FLAGS,
+    DEFAULT_BUNDLE_SIZE, DEFAULT_CORES, DEFAULT_BUNDLE_THRESHOLD, DEFAULT_FULL_EVERY, DEFAULT_KEEP_DAILY, DEFAULT_KEEP_MONTHLY,
+    DEFAULT_KEEP_WEEKLY, DEFAULT_RESTORE_WORKERS, DEFAULT_SPLIT_SIZE, DEFAULT_UPLOAD_QUEUE, TOMBSTONE_DIR
+)
+from pipeline.classify import STATS_FILE as CLASSIFY_STATS_FILE
+from pipeline.fetch import CACHE_DIR as RESTORE_CACHE_DIR
+from pipeline.filters import EXCLUDED_LIST, RCLONE_FILTERS, TAR_EXCLUDES, rclone_limit_args
+from pipeline.codecs import EXTENSIONS as CODEC_EXTENSIONS, GZIP, ZSTD, compress_command
+from pipeline.cpu import checkers_for
+from pipeline.indexed import INDEX_FILE
+from pipeline.file_index import TOMBSTONE_FILE
+from pipeline.manifest import MANIFEST_FILE
+from pipeline.snapshots import SNAPSHOT_DIR
+from pipeline.split_upload import JOURNAL_FILE
+from pipeline.units import parse_size
+from pipeline.workdir import OWNER_FILE
+
+# Shell variables holding the run-time sizing of `cores: auto` jobs
+AUTO_CORES_VAR = "$AUTO_CORES"
+AUTO_CHECKERS_VAR = "$AUTO_CHECKERS"
+
+# Directory below WORK_DIR that holds the compiled filter lists
+FILTER_DIR = "$WORK_DIR/filters"
+
+# rclone flags the job runner may override with its share of the host budget
+RUNNER_FLAG_OVERRIDES = {"--transfers": "BB_TRANSFERS", "--bwlimit": "BB_BWLIMIT"}
 
 
 def generate_backup_script(config: Dict, job_id: str) -> Path:
@@ -20,6 +48,8 @@ def generate_backup_script(config: Dict, job_id: str) -> Path:
         Path to generated script
     """
     job = config[job_id]
+    if job.get("cores") == CORES_AUTO:
+        job = _resolve_auto_cores(job)
     script_path = SCRIPT_DIR / f"backup_{job_id}.sh"
     SCRIPT_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -27,7 +57,7 @@ def generate_backup_script(config: Dict, job_id: str) -> Path:
     use_progress = "--progress" in rclone_flags
     log_file = job.get("rclone_flags", {}).get("--log-file")
 
-    script_lines = _build_backup_script_lines(job, rclone_flags, use_progress, log_file)
+    script_lines = _build_backup_script_lines(job_id, job, rclone_flags, use_progress, log_file)
     
     # Write script to file
     script_path.write_text("\n".join(script_lines))
@@ -36,32 +66,140 @@ def generate_backup_script(config: Dict, job_id: str) -> Path:
     return script_path
 
 
-def _build_rclone_flags(flags: Dict) -> str:
-    """Build rclone flags from dictionary."""
-    return " ".join(f"{flag} {value}" for flag, value in flags.items())
+def _resolve_auto_cores(job: Dict) -> Dict:
+    """
+    Return a copy of a `cores: auto` job whose core and checker counts are
+    the shell variables set by _build_auto_cores_lines.
+    
+    A --checkers value other than the default one offered when the job was
+    created was set on purpose and is kept.
+    """
+    flags = dict(job.get("rclone_flags", {}))
+    if flags.get("--checkers", DEFAULT_BACKUP_FLAGS["--checkers"]) == DEFAULT_BACKUP_FLAGS["--checkers"]:
+        flags["--checkers"] = AUTO_CHECKERS_VAR
+    return dict(job, cores=AUTO_CORES_VAR, rclone_flags=flags)
 
 
-def _build_backup_script_lines(job: Dict, rclone_flags: str, use_progress: bool, log_file: str) -> list:
-    """Build script lines for backup script."""
-    lines = [
-        "#!/bin/bash",
-        "set -e",
-        "echo 'Starting backup process...'",
-        "",
+def _build_auto_cores_lines() -> list:
+    """
+    Build script lines that size threads from affinity, cgroup quota and load at run time.
+    
+    If pipeline.cpu fails, the job falls back to the fixed default core count.
+    """
+    return [
+        "read -r AUTO_CORES AUTO_CHECKERS <<< \"$(python3 -m pipeline.cpu || true)\"",
+        "if ! [[ \"$AUTO_CORES\" =~ ^[0-9]+$ && \"$AUTO_CHECKERS\" =~ ^[0-9]+$ ]]; then",
+        f"    echo 'CPU sizing failed; using {DEFAULT_CORES} cores' >&2",
+        f"    AUTO_CORES={DEFAULT_CORES}",
+        f"    AUTO_CHECKERS={checkers_for(DEFAULT_CORES)}",
+        "fi",
+        ""
+    ]
+
+
+def _build_helper_env_lines() -> list:
+    """Build script lines that make the pipeline helpers importable."""
+    return [
+        f"export PYTHONPATH=\"{APP_DIR}${{PYTHONPATH:+:$PYTHONPATH}}\"",
+        ""
+    ]
+
+
+def _build_work_dir_lines(job_id: str) -> list:
+    """
+    Build script lines that set up this run's private WORK_DIR.
+    
+    Runs of the same or different jobs may overlap, so nothing is written to
+    TEMP_DIR itself: each run works in `TEMP_DIR/<job>/<RUN_ID>-<pid>`, which
+    is removed when the script exits. Directories left behind by killed runs
+    are swept before a new one is claimed.
+    """
+    return [
         "# Ensure temp directory exists",
         f"if [ ! -d \"{TEMP_DIR}\" ]; then",
         f"    echo 'Creating temporary directory: {TEMP_DIR}'",
         f"    mkdir -p {TEMP_DIR}",
         "fi",
         f"chmod 777 {TEMP_DIR}",
+        "",
+        f"WORK_DIR=\"{TEMP_DIR}/{job_id}/$RUN_ID-$$\"",
+        f"python3 -m pipeline.workdir sweep --root {TEMP_DIR} || true",
+        "python3 -m pipeline.workdir claim \"$WORK_DIR\" --pid $$",
+        "trap 'rm -rf \"$WORK_DIR\"' EXIT",
         ""
     ]
 
-    if job["compress"]:
-        lines.extend(_build_compression_lines(job, use_progress))
+
+def _runner_override(variable: str, value) -> str:
+    """Return a shell expression for `value` that the job runner can override."""
+    return f"${{{variable}:-{value}}}"
+
+
+def _build_rclone_flags(flags: Dict) -> str:
+    """
+    Build rclone flags from dictionary.
+    
+    Flags covered by the job runner's host-wide budget (RUNNER_FLAG_OVERRIDES)
+    are emitted as shell expressions, so a run started by the runner uses its
+    share instead of the job's own value.
+    """
+    parts = []
+    for flag, value in flags.items():
+        variable = RUNNER_FLAG_OVERRIDES.get(flag)
+        parts.append(f"{flag} {_runner_override(variable, value) if variable else value}")
+    for flag, variable in RUNNER_FLAG_OVERRIDES.items():
+        if flag not in flags:
+            parts.append(f"${{{variable}:+{flag} ${variable}}}")
+    return " ".join(parts)
+
+
+def _build_backup_script_lines(job_id: str, job: Dict, rclone_flags: str, use_progress: bool, log_file: str) -> list:
+    """Build script lines for backup script."""
+    lines = [
+        "#!/bin/bash",
+        "set -e",
+        "echo 'Starting backup process...'",
+        "",
+        *_build_helper_env_lines(),
+        "RUN_ID=$(date +%Y%m%d-%H%M%S)",
+        *_build_remote_dir_lines(job),
+        "",
+        *_build_work_dir_lines(job_id)
+    ]
+
+    if job.get("cores") == AUTO_CORES_VAR:
+        lines.extend(_build_auto_cores_lines())
+    if _has_filters(job):
+        lines.extend(_build_filter_lines(job))
+    if _uses_prescan(job, use_progress):
+        lines.extend(_build_prescan_lines(job_id, job))
+
+    dedup = job["compress"] and job.get("dedup")
+    sharded = job["compress"] and not dedup and job.get("shards")
+    incremental = job.get("incremental") and not dedup and not sharded
+
+    if incremental:
+        lines.extend(_build_incremental_scan_lines(job_id, job))
+
+    if dedup:
+        lines.extend(_build_dedup_backup_lines(job_id, job, use_progress))
+    elif sharded:
+        lines.extend(_build_shard_backup_lines(job))
+    elif job["compress"]:
+        lines.extend(_build_compression_lines(job_id, job, use_progress))
+        if _uses_content_index(job):
+            lines.append(f"rclone copyto \"$WORK_DIR/{INDEX_FILE}\" \"$REMOTE_DIR/{INDEX_FILE}\" {rclone_flags}")
+        lines.extend(_build_verify_lines(job))
     else:
         lines.extend(_build_copy_lines(job, rclone_flags))
 
+    if incremental:
+        lines.extend(_build_incremental_finish_lines(job_id, job, rclone_flags))
+    if _uses_snapshots(job):
+        lines.extend(_build_snapshot_commit_lines(job))
+    if incremental:
+        lines.append("python3 -m pipeline.file_index commit --state-dir \"$STATE_DIR\"")
+
     lines.append("echo 'Backup completed.'")
     
     if log_file:
@@ -72,55 +210,560 @@ def _build_backup_script_lines(job: Dict, rclone_flags: str, use_progress: bool,
     return lines
 
 
-def _build_compression_lines(job: Dict, use_progress: bool) -> list:
+def _uses_watch(job: Dict) -> bool:
+    """Whether incremental runs take their changes from the job's inotify watcher instead of a tree walk."""
+    return bool(job.get("watch") and job.get("incremental") and not (job.get("dedup") or job.get("shards")))
+
+
+def _has_filters(job: Dict) -> bool:
+    """Whether the job has include/exclude rules."""
+    return any((job.get("filters") or {}).values())
+
+
+def _filters_need_walk(job: Dict) -> bool:
+    """
+    Whether the job's filters must be compiled into explicit path lists.
+    
+    tar, the pipeline stages that walk the source and ignore files need
+    them; plain rclone copies (and the file-state index) apply the rules
+    themselves.
+    """
+    return bool(job["compress"] or job.get("bundle") or (job.get("filters") or {}).get("ignore_file"))
+
+
+def _build_filter_lines(job: Dict) -> list:
+    """
+    Build script lines that compile the job's include/exclude rules.
+    
+    pipeline.filters walks the source once, without entering excluded
+    directories, and writes the excluded paths as lists for tar and the
+    pipeline stages, so every mode leaves out the same data. Jobs that only
+    copy with rclone skip the walk and get the rclone filter file alone.
+    """
+    rules = shlex.quote(json.dumps(job["filters"]))
+    if not _filters_need_walk(job):
+        return [f"python3 -m pipeline.filters rclone --rules {rules} --out-dir \"{FILTER_DIR}\"", ""]
+    return [
+        "echo 'Compiling filter rules...'",
+        f"python3 -m pipeline.filters compile --source {job['source_dir']} "
+        f"--rules {rules} --out-dir \"{FILTER_DIR}\"",
+        "",
+    ]
+
+
+def _is_staged(job: Dict) -> bool:
+    """Whether the whole archive is written to WORK_DIR before it is uploaded."""
+    return not (job.get("split_files") or job.get("stream_upload") or job.get("dedup") or job.get("shards"))
+
+
+def _uses_prescan(job: Dict, use_progress: bool) -> bool:
+    """
+    Whether anything reads the pre-scan's SOURCE_BYTES.
+    
+    Only full compressed runs do: pv uses it for its ETA and staged archives
+    for the free-space check. Incremental runs archive the changed entries
+    only, so they skip the extra walk.
+    """
+    if not job["compress"] or job.get("incremental"):
+        return False
+    return (use_progress and not job.get("shards")) or _is_staged(job)
+
+
+def _build_prescan_lines(job_id: str, job: Dict) -> list:
+    """
+    Build script lines that estimate the source size before archiving.
+    
+    pipeline.prescan reuses the cached totals of unchanged directories and
+    sets SOURCE_BYTES (empty if the scan failed), which gives the progress
+    bars an ETA; staged archives are also checked against the free space in
+    WORK_DIR.
+    """
+    command = (
+        f"python3 -m pipeline.prescan scan --source {job['source_dir']} --state-dir \"{STATE_DIR / job_id}\""
+        f"{_exclude_arg(job)}"
+    )
+    if _is_staged(job):
+        command += " --staging-dir \"$WORK_DIR\""
+    return [
+        "echo 'Estimating source size...'",
+        f"SOURCE_BYTES=$({command} || true)",
+        "",
+    ]
+
+
+def _pv_size(job: Dict) -> str:
+    """pv option that sizes a full tar stream of the source, so pv can show an ETA."""
+    if job.get("incremental"):
+        # Incremental runs archive the changed entries only
+        return ""
+    return " ${SOURCE_BYTES:+-s $SOURCE_BYTES}"
+
+
+def _tar_excludes(job: Dict) -> str:
+    """tar options that skip the paths excluded by the job's filters (empty without filters)."""
+    if not _has_filters(job):
+        return ""
+    return f"--anchored --no-wildcards --exclude-from \"{FILTER_DIR}/{TAR_EXCLUDES}\" "
+
+
+def _exclude_arg(job: Dict) -> str:
+    """`--exclude-from` argument for the pipeline stages that walk the source (empty without filters)."""
+    if not _has_filters(job):
+        return ""
+    return f" --exclude-from \"{FILTER_DIR}/{EXCLUDED_LIST}\""
+
+
+def _index_filter_arg(job: Dict) -> str:
+    """Filter argument for pipeline.file_index: the compiled list, or the rules themselves if there is none."""
+    if not _has_filters(job) or _filters_need_walk(job):
+        return _exclude_arg(job)
+    return f" --rules {shlex.quote(json.dumps(job['filters']))}"
+
+
+def _rclone_filter_arg(job: Dict) -> str:
+    """rclone arguments that apply the job's filters to an rclone copy (empty without filters)."""
+    if not _has_filters(job):
+        return ""
+    limits = "".join(f"{arg} " for arg in rclone_limit_args(job["filters"]))
+    return f"--filter-from \"{FILTER_DIR}/{RCLONE_FILTERS}\" {limits}"
+
+
+def _build_compression_lines(job_id: str, job: Dict, use_progress: bool) -> list:
     """Build script lines for compression."""
+    if job.get('split_files'):
+        return _build_split_upload_lines(job_id, job, use_progress)
+    if job.get("stream_upload"):
+        return _build_stream_upload_lines(job_id, job, use_progress)
+
+    cores = _runner_override("BB_CORES", job.get("cores", 4))
+    archive = _archive_name(job)
+    
+    rclone_flags = _build_rclone_flags(job.get("rclone_flags", {}))
+    
+    return [
+        "set -o pipefail",
+        f"echo \"Compressing files with {_compressor_label(job)}, using {cores} cores...\"",
+        f"{_build_archive_pipe(job_id, job, use_progress)} | {_build_manifest_tee(job)} > \"$WORK_DIR/{archive}\"",
+        f"rclone copy \"$WORK_DIR/{archive}\" \"$REMOTE_DIR\" {rclone_flags}",
+        f"rclone copyto \"$WORK_DIR/{MANIFEST_FILE}\" \"$REMOTE_DIR/{MANIFEST_FILE}\" {rclone_flags}",
+    ]
+
+
+def _build_manifest_tee(job: Dict) -> str:
+    """Build the pipe stage that hashes the archive on its way out and writes its manifest to WORK_DIR."""
+    return f"python3 -m pipeline.manifest tee --name {_archive_name(job)} --manifest \"$WORK_DIR/{MANIFEST_FILE}\""
+
+
+def _build_verify_lines(job: Dict) -> list:
+    """
+    Build script lines that check the uploaded archive against its manifest.
+    
+    Sizes and the hashes the remote stores are compared with the ones
+    computed during the backup; nothing is downloaded.
+    """
+    listing_flags = _build_rclone_flags(
+        {flag: value for flag, value in job.get("rclone_flags", {}).items() if flag != "--progress"}
+    )
+    return [
+        "echo 'Verifying uploaded archive...'",
+        f"python3 -m pipeline.manifest verify --remote \"$REMOTE_DIR\" --rclone-flags=\"{listing_flags}\"",
+    ]
+
+
+def _build_compressor(job: Dict) -> str:
+    """Build the compressor command for the job's codec (pigz by default)."""
+    return " ".join(compress_command(
+        job.get("codec") or GZIP,
+        job.get("compression_level", 6),
+        _runner_override("BB_CORES", job.get("cores", 4)),
+        job.get("zstd_long", False)
+    ))
+
+
+def _uses_content_index(job: Dict) -> bool:
+    """Whether the job's archives are written frame by frame with a content index."""
+    return bool(
+        job.get("compress") and job.get("content_index")
+        and not (job.get("dedup") or job.get("shards") or job.get("skip_incompressible"))
+    )
+
+
+def _uses_snapshots(job: Dict) -> bool:
+    """Whether every run of the job is kept as its own snapshot below `snapshots/`."""
+    return bool(job.get("compress") and job.get("snapshots") and not (job.get("dedup") or job.get("shards")))
+
+
+def _build_remote_dir_lines(job: Dict) -> list:
+    """
+    Build script lines that set REMOTE_DIR, the directory this run uploads to.
+    
+    Snapshot jobs upload every full run to a new `snapshots/<RUN_ID>`
+    directory (incremental runs move into their chain's snapshot once the
+    scan has picked the mode); other jobs overwrite the destination.
+    """
+    if not _uses_snapshots(job):
+        return [f"REMOTE_DIR=\"{job['destination']}\""]
+    return [
+        f"SNAPSHOT_ROOT=\"{job['destination']}/{SNAPSHOT_DIR}\"",
+        "SNAPSHOT=\"$RUN_ID\"",
+        "REMOTE_DIR=\"$SNAPSHOT_ROOT/$SNAPSHOT\"",
+    ]
+
+
+def _build_snapshot_commit_lines(job: Dict) -> list:
+    """
+    Build script lines that record the finished run in the snapshot catalog.
+    
+    Runs after the upload was verified, so the catalog only ever lists
+    complete snapshots; expired snapshots are deleted in the same step.
+    """
+    rclone_flags = _build_rclone_flags(job.get("rclone_flags", {}))
+    return [
+        "echo 'Recording snapshot and applying retention...'",
+        f"python3 -m pipeline.snapshots commit --root \"$SNAPSHOT_ROOT\" --id \"$SNAPSHOT\" --run-id \"$RUN_ID\" "
+        f"--work-dir \"$WORK_DIR/snapshots\" --keep-daily {job.get('keep_daily', DEFAULT_KEEP_DAILY)} "
+        f"--keep-weekly {job.get('keep_weekly', DEFAULT_KEEP_WEEKLY)} "
+        f"--keep-monthly {job.get('keep_monthly', DEFAULT_KEEP_MONTHLY)} --rclone-flags=\"{rclone_flags}\"",
+    ]
+
+
+def _build_indexed_compressor(job: Dict) -> str:
+    """
+    Build the compressor that also writes the content index to WORK_DIR.
+    
+    The archive is compressed in independent frames so restore can fetch
+    single files with ranged reads; split jobs record part numbers instead
+    of the archive name.
+    """
+    command = (
+        f"python3 -m pipeline.indexed pack --index \"$WORK_DIR/{INDEX_FILE}\" "
+        f"--codec {job.get('codec') or GZIP} --level {job.get('compression_level', 6)} "
+        f"--cores {_runner_override('BB_CORES', job.get('cores', 4))}"
+    )
+    if job.get("codec") == ZSTD and job.get("zstd_long"):
+        command += " --long"
+    if job.get("split_files"):
+        command += f" --part-size {job.get('split_size') or DEFAULT_SPLIT_SIZE}"
+    else:
+        command += f" --archive {_archive_name(job)}"
+    return command
+
+
+def _compressor_label(job: Dict) -> str:
+    """Short description of the compressor for progress messages."""
+    tool = "zstd" if job.get("codec") == ZSTD else "pigz"
+    return f"{tool} -{job.get('compression_level', 6)}"
+
+
+def _archive_name(job: Dict) -> str:
+    """Name of the uploaded archive (extension follows the codec)."""
+    return f"backup.tar.{CODEC_EXTENSIONS[job.get('codec') or GZIP]}"
+
+
+def _build_archive_pipe(job_id: str, job: Dict, use_progress: bool) -> str:
+    """Build the tar | compressor pipeline that writes the archive to stdout."""
+    if job.get("skip_incompressible"):
+        return _build_classified_pipe(job_id, job, use_progress)
+    
+    tar_sources = "$TAR_ARGS" if job.get("incremental") else "."
+    pipe = f"tar -cf - -C {job['source_dir']} {_tar_excludes(job)}{tar_sources} | "
+    if use_progress:
+        pipe += f"pv -cN 'Compressing'{_pv_size(job)} | "
+    pipe += _build_indexed_compressor(job) if _uses_content_index(job) else _build_compressor(job)
+    
+    return pipe
+
+
+def _build_classified_pipe(job_id: str, job: Dict, use_progress: bool) -> str:
+    """
+    Build the pipeline that keeps already-compressed files away from the compressor.
+    
+    pipeline.classify writes two compressed members: regular entries at the
+    job's level and media/archives at the codec's cheapest setting. Restore
+    extracts both with `tar --ignore-zeros`.
+    """
     compression_level = job.get("compression_level", 6)
-    cores = job.get("cores", 4)
+    cores = _runner_override("BB_CORES", job.get("cores", 4))
     
-    lines = [
-        f"echo 'Compressing files with pigz -{compression_level}, using {cores} cores...'"
+    pipe = (
+        f"python3 -m pipeline.classify pack --source {job['source_dir']} --work-dir \"$WORK_DIR\" "
+        f"--codec {job.get('codec') or GZIP} --level {compression_level} --cores {cores} "
+        f"--stats-file \"{STATE_DIR / job_id / CLASSIFY_STATS_FILE}\"{_exclude_arg(job)}"
+    )
+    if job.get("zstd_long"):
+        pipe += " --long"
+    if job.get("incremental"):
+        pipe += " $PACK_ARGS"
+    if use_progress:
+        pipe += " | pv -cN 'Compressing'"
+    
+    return pipe
+
+
+def _build_stream_upload_lines(job_id: str, job: Dict, use_progress: bool) -> list:
+    """
+    Build script lines that stream tar -> compressor -> remote in one pipe.
+    
+    Only the archive's manifest is written to WORK_DIR: the archive goes
+    straight to `rclone rcat`, so upload overlaps with compression.
+    """
+    cores = _runner_override("BB_CORES", job.get("cores", 4))
+    rclone_flags = _build_rclone_flags(job.get("rclone_flags", {}))
+    
+    return [
+        "set -o pipefail",
+        f"echo \"Streaming compressed archive to remote with {_compressor_label(job)}, using {cores} cores...\"",
+        f"{_build_archive_pipe(job_id, job, use_progress)} | {_build_manifest_tee(job)} | "
+        f"rclone rcat \"$REMOTE_DIR/{_archive_name(job)}\" {rclone_flags}",
+        f"rclone copyto \"$WORK_DIR/{MANIFEST_FILE}\" \"$REMOTE_DIR/{MANIFEST_FILE}\" {rclone_flags}",
     ]
+
+
+def _build_split_upload_lines(job_id: str, job: Dict, use_progress: bool) -> list:
+    """
+    Build script lines that split the compressed stream while it is produced.
     
+    Finished `backup-part-*` files are uploaded in parallel (one worker per
+    rclone `--transfers`) while compression continues; at most
+    `upload_queue` parts wait on local disk at any time. Confirmed parts are
+    checkpointed in the job's upload journal, so a rerun after a failure
+    skips the parts that already made it to the remote.
+    """
+    cores = _runner_override("BB_CORES", job.get("cores", 4))
+    split_size = job.get("split_size") or DEFAULT_SPLIT_SIZE
+    flags = job.get("rclone_flags", {})
+    workers = _runner_override("BB_TRANSFERS", flags.get("--transfers", DEFAULT_BACKUP_FLAGS["--transfers"]))
+    queue = job.get("upload_queue") or DEFAULT_UPLOAD_QUEUE
+    
+    # Only a run that overwrites the job's fixed destination can be resumed by a later one
+    journal_args = f" --journal \"{STATE_DIR / job_id / JOURNAL_FILE}\" --source {job['source_dir']}{_exclude_arg(job)}"
+    lines = ["set -o pipefail"]
+    if _uses_snapshots(job):
+        journal_args = ""
+    elif job.get("incremental"):
+        lines.extend([
+            "JOURNAL_ARGS=()",
+            f"[ \"$BACKUP_MODE\" = \"incremental\" ] || JOURNAL_ARGS=({journal_args.strip()})",
+        ])
+        journal_args = " \"${JOURNAL_ARGS[@]}\""
+    
+    return lines + [
+        f"echo \"Compressing with {_compressor_label(job)} using {cores} cores, "
+        f"uploading {split_size} parts with {workers} workers...\"",
+        f"{_build_archive_pipe(job_id, job, use_progress)} | "
+        f"python3 -m pipeline.split_upload --prefix \"$WORK_DIR/backup-part-\" --size {split_size} "
+        f"--remote \"$REMOTE_DIR\" --workers {workers} --queue {queue}{journal_args} "
+        f"--rclone-flags=\"{_build_rclone_flags(flags)}\""
+    ]
+
+
+def _build_dedup_backup_lines(job_id: str, job: Dict, use_progress: bool) -> list:
+    """
+    Build script lines that store the tar stream in a deduplicating repository.
+    
+    The stream is cut into content-defined chunks; only chunks missing from
+    the job's local chunk index are compressed and uploaded, and each run
+    writes a snapshot manifest under `<destination>/repo/snapshots/`.
+    """
+    # Chunks are deflated with zlib, whose levels stop at 9
+    compression_level = min(job.get("compression_level", 6), 9)
+    cores = _runner_override("BB_CORES", job.get("cores", 4))
+    rclone_flags = _build_rclone_flags(job.get("rclone_flags", {}))
+    
+    pipe = f"tar -cf - -C {job['source_dir']} {_tar_excludes(job)}. | "
     if use_progress:
-        lines.append(
-            f"tar -cf - -C {job['source_dir']} . | "
-            f"pv -cN 'Compressing' | "
-            f"pigz -{compression_level} -p {cores} > {TEMP_DIR}/backup.tar.gz"
-        )
-    else:
-        lines.append(
-            f"tar -cf - -C {job['source_dir']} . | "
-            f"pigz -{compression_level} -p {cores} > {TEMP_DIR}/backup.tar.gz"
-        )
+        pipe += f"pv -cN 'Chunking'{_pv_size(job)} | "
     
-    if job.get('split_files'):
-        split_size = job.get("split_size", "100M")
-        lines.append("echo 'Splitting compressed file...'")
-        
-        if use_progress:
-            lines.append(
-                f"pv -cN 'Splitting' {TEMP_DIR}/backup.tar.gz | "
-                f"split -b {split_size} - {TEMP_DIR}/backup-part-"
-            )
-        else:
-            lines.append(f"split -b {split_size} {TEMP_DIR}/backup.tar.gz {TEMP_DIR}/backup-part-")
-        
-        lines.append(f"rm {TEMP_DIR}/backup.tar.gz")
+    return [
+        "set -o pipefail",
+        f"echo \"Storing backup in deduplicating repository (level {compression_level}, {cores} threads)...\"",
+        f"{pipe}python3 -m pipeline.chunkstore backup --state-dir \"{STATE_DIR / job_id}\" "
+        f"--repo \"$REMOTE_DIR/{DEDUP_REPO_DIR}\" --work-dir \"$WORK_DIR/chunkstore\" --run-id \"$RUN_ID\" "
+        f"--level {compression_level} --threads {cores} --rclone-flags=\"{rclone_flags}\""
+    ]
+
+
+def _build_shard_backup_lines(job: Dict) -> list:
+    """
+    Build script lines that upload the source as size-balanced shards.
     
+    pipeline.shard partitions the source into `shards` archives of similar
+    size and builds up to `cores` of them at a time, sharing the compressor
+    threads between them.
+    """
+    codec = job.get("codec") or GZIP
+    cores = _runner_override("BB_CORES", job.get("cores", 4))
     rclone_flags = _build_rclone_flags(job.get("rclone_flags", {}))
-    lines.append(f"rclone copy {TEMP_DIR}/ {job['destination']} {rclone_flags}")
+    command = (
+        f"python3 -m pipeline.shard backup --source {job['source_dir']} --remote \"$REMOTE_DIR\" "
+        f"--work-dir \"$WORK_DIR/shards\" --run-id \"$RUN_ID\" --shards {job['shards']} --workers {cores} "
+        f"--codec {codec} --level {job.get('compression_level', 6)} --threads {cores}{_exclude_arg(job)} "
+    )
+    if codec == ZSTD and job.get("zstd_long"):
+        command += "--long "
+    command += f"--rclone-flags=\"{rclone_flags}\""
     
-    return lines
+    return [
+        f"echo \"Building {job['shards']} sharded {_compressor_label(job)} archives, using {cores} cores...\"",
+        command
+    ]
 
 
 def _build_copy_lines(job: Dict, rclone_flags: str) -> list:
     """Build script lines for direct copy."""
+    min_size = _bundle_min_size(job)
+    if not job.get("incremental"):
+        lines = [
+            "echo 'Copying files without compression or splitting...'",
+            f"rclone copy {job['source_dir']} {job['destination']} {_rclone_filter_arg(job)}{min_size}{rclone_flags}"
+        ]
+    else:
+        lines = [
+            "echo 'Copying files without compression or splitting...'",
+            "if [ \"$BACKUP_MODE\" = \"incremental\" ]; then",
+            f"    rclone copy {job['source_dir']} {job['destination']} --files-from-raw \"$STATE_DIR/changed.txt\" "
+            f"--no-traverse {min_size}{rclone_flags}",
+            "else",
+            f"    rclone copy {job['source_dir']} {job['destination']} {_rclone_filter_arg(job)}{min_size}"
+            f"{rclone_flags}",
+            "fi"
+        ]
+    
+    if job.get("bundle"):
+        lines.extend(_build_bundle_lines(job, job["source_dir"], _exclude_arg(job)))
+    return lines
+
+
+def _bundle_min_size(job: Dict) -> str:
+    """rclone flag that leaves the files of a bundling job's bundles to pipeline.bundle."""
+    if not job.get("bundle"):
+        return ""
+    return f"--min-size {parse_size(job.get('bundle_threshold') or DEFAULT_BUNDLE_THRESHOLD)}B "
+
+
+def _build_bundle_lines(job: Dict, source: str, exclude_arg: str = "") -> list:
+    """
+    Build script lines that upload the files below the job's bundle threshold as tar bundles.
+    
+    Only bundles whose files changed are uploaded; one bundle upload runs
+    per rclone transfer.
+    """
+    flags = job.get("rclone_flags", {})
+    transfers = _runner_override("BB_TRANSFERS", flags.get("--transfers", 4))
+    rclone_flags = _build_rclone_flags(flags)
+    
     return [
-        "echo 'Copying files without compression or splitting...'",
-        f"rclone copy {job['source_dir']} {job['destination']} {rclone_flags}"
+        "echo 'Uploading small files in bundles...'",
+        f"python3 -m pipeline.bundle pack --source {source} --remote {job['destination']} "
+        f"--work-dir \"$WORK_DIR/bundles\" --threshold {job.get('bundle_threshold') or DEFAULT_BUNDLE_THRESHOLD} "
+        f"--size {job.get('bundle_size') or DEFAULT_BUNDLE_SIZE} --workers {transfers}{exclude_arg} "
+        f"--rclone-flags=\"{rclone_flags}\""
     ]
 
 
+def _build_incremental_scan_lines(job_id: str, job: Dict) -> list:
+    """
+    Build script lines that diff the source against the job's file-state index.
+    
+    Sets BACKUP_MODE to "full" or "incremental". Incremental compressed runs
+    archive only the changed entries and upload them to their own
+    `incr/<RUN_ID>` directory next to the full backup.
+    """
+    list_format = "tar" if job["compress"] else "rclone"
+    full_every = job.get("full_every", DEFAULT_FULL_EVERY)
+    
+    lines = [f"STATE_DIR=\"{STATE_DIR / job_id}\""]
+    scan_args = ""
+    
+    if _uses_watch(job):
+        # The first runs after the watcher starts still walk the tree
+        lines.append(f"python3 -m pipeline.watch start --state-dir \"$STATE_DIR\" --source {job['source_dir']}")
+        scan_args += " --watch"
+    
+    if _uses_snapshots(job):
+        # The chain continues in the newest snapshot; without one the run must be full
+        listing_flags = _build_rclone_flags(
+            {flag: value for flag, value in job.get("rclone_flags", {}).items() if flag != "--progress"}
+        )
+        lines.extend([
+            f"CHAIN=$(python3 -m pipeline.snapshots latest --root \"$SNAPSHOT_ROOT\" "
+            f"--rclone-flags=\"{listing_flags}\" 2>/dev/null || true)",
+            "SCAN_ARGS=\"\"",
+            "[ -n \"$CHAIN\" ] || SCAN_ARGS=\"--full\"",
+        ])
+        scan_args += " $SCAN_ARGS"
+    
+    lines.extend([
+        "echo 'Scanning source for changes...'",
+        f"BACKUP_MODE=$(python3 -m pipeline.file_index scan --state-dir \"$STATE_DIR\" "
+        f"--source {job['source_dir']} --full-every {full_every} --format {list_format}{scan_args}"
+        f"{_index_filter_arg(job)})",
+        "echo \"Backup mode: $BACKUP_MODE\"",
+    ])
+    
+    if _uses_snapshots(job):
+        lines.extend([
+            "if [ \"$BACKUP_MODE\" = \"incremental\" ]; then",
+            "    SNAPSHOT=\"$CHAIN\"",
+            "    REMOTE_DIR=\"$SNAPSHOT_ROOT/$SNAPSHOT\"",
+            "fi",
+        ])
+    
+    if job["compress"]:
+        lines.extend([
+            "if [ \"$BACKUP_MODE\" = \"incremental\" ]; then",
+            "    TAR_ARGS=\"--null --no-recursion -T $STATE_DIR/changed.lst\"",
+            "    PACK_ARGS=\"--from $STATE_DIR/changed.lst\"",
+            "    REMOTE_DIR=\"$REMOTE_DIR/incr/$RUN_ID\"",
+            "else",
+            "    TAR_ARGS=\".\"",
+            "    PACK_ARGS=\"\"",
+            "fi",
+        ])
+    
+    lines.append("")
+    return lines
+
+
+def _build_incremental_finish_lines(job_id: str, job: Dict, rclone_flags: str) -> list:
+    """
+    Build script lines that record deletions and commit the file-state index.
+    
+    Compressed jobs store the tombstone list inside the incremental directory
+    (a full run starts a new chain and drops the old one, unless snapshot
+    retention owns old chains); plain copy jobs keep every path deleted since
+    it was copied in one list under the destination, uploaded when it
+    changed. The index itself is committed by the caller once everything
+    else succeeded.
+    """
+    destination = job["destination"]
+    
+    if _uses_snapshots(job):
+        lines = [
+            "if [ \"$BACKUP_MODE\" = \"incremental\" ]; then",
+            f"    rclone copyto \"$STATE_DIR/deleted.lst\" \"$REMOTE_DIR/deleted.lst\" {rclone_flags}",
+            "fi",
+        ]
+    elif job["compress"]:
+        lines = [
+            "if [ \"$BACKUP_MODE\" = \"incremental\" ]; then",
+            f"    rclone copyto \"$STATE_DIR/deleted.lst\" \"$REMOTE_DIR/deleted.lst\" {rclone_flags}",
+            "else",
+            "    echo 'Removing previous incremental chain...'",
+            f"    rclone purge {destination}/incr {rclone_flags} 2>/dev/null || true",
+            "fi",
+        ]
+    else:
+        lines = [
+            f"if [ -f \"$STATE_DIR/{TOMBSTONE_FILE}\" ]; then",
+            "    echo 'Recording deleted files...'",
+            f"    rclone copyto \"$STATE_DIR/{TOMBSTONE_FILE}\" {destination}/{TOMBSTONE_DIR}/{TOMBSTONE_FILE} {rclone_flags}",
+            "fi",
+        ]
+    
+    return lines
+
+
 def _build_log_cleanup_lines(log_file: str) -> list:
     """Build script lines for log cleanup."""
     return [
@@ -134,10 +777,10 @@ def _build_log_cleanup_lines(log_file: str) -> list:
 
 
 def _build_temp_cleanup_lines() -> list:
-    """Build script lines for temp cleanup."""
+    """Build script lines for temp cleanup (only this run's WORK_DIR)."""
     return [
         "echo 'Cleaning up temporary files...'",
-        f"rm -rf {TEMP_DIR}/*"
+        "rm -rf \"$WORK_DIR\""
     ]
 
 
@@ -164,15 +807,33 @@ def generate_transfer_script(config: Dict, job_id: str) -> Path:
         "set -e",
         f"echo 'Starting transfer process for job {job_id}...'",
         "",
-        f"rclone copy {job['source']} {job['destination']} {rclone_flags}",
+        *_build_helper_env_lines(),
+        f"STATE_DIR=\"{STATE_DIR / job_id}\"",
+        "RUN_START=$(date +%s)",
         "",
-        "echo 'Transfer completed.'"
     ]
+    if job.get("bundle"):
+        script_lines.extend([
+            "RUN_ID=$(date +%Y%m%d-%H%M%S)",
+            *_build_work_dir_lines(job_id),
+        ])
+    if job.get("watch"):
+        script_lines.extend(_build_watched_transfer_lines(job, rclone_flags))
+    elif job.get("topup"):
+        script_lines.extend(_build_topup_transfer_lines(job, rclone_flags))
+    else:
+        script_lines.append(f"rclone copy {job['source']} {job['destination']} {_bundle_min_size(job)}{rclone_flags}")
+    if job.get("bundle"):
+        script_lines.extend(_build_bundle_lines(job, job["source"]))
+    script_lines.extend([
+        f"python3 -m pipeline.history record --state-dir \"$STATE_DIR\" --source {job['source']} "
+        f"--destination {job['destination']} --started \"$RUN_START\" --mode \"${{TRANSFER_MODE:-full}}\"",
+        "",
+        "echo 'Transfer completed.'"
+    ])
 
     if log_file:
         script_lines.extend(_build_log_cleanup_lines(log_file))
-    
-    script_lines.extend(_build_temp_cleanup_lines())
 
     script_path.write_text("\n".join(script_lines))
     script_path.chmod(0o755)
@@ -180,13 +841,68 @@ def generate_transfer_script(config: Dict, job_id: str) -> Path:
     return script_path
 
 
-def generate_restore_script(config: Dict, job_id: str) -> Path:
+def _build_topup_transfer_lines(job: Dict, rclone_flags: str) -> list:
+    """
+    Build script lines that copy only the files modified since the last successful transfer.
+    
+    Top-ups filter the source with --max-age and skip the destination
+    listing; every `full_every` runs the whole tree is reconciled instead.
+    Sets TRANSFER_MODE to "full" or "topup" for the run history.
+    """
+    source = job["source"]
+    destination = job["destination"]
+    min_size = _bundle_min_size(job)
+    full_every = job.get("full_every", DEFAULT_FULL_EVERY)
+    return [
+        f"read -r TRANSFER_MODE MAX_AGE <<< \"$(python3 -m pipeline.history plan --state-dir \"$STATE_DIR\" "
+        f"--source {source} --destination {destination} --full-every {full_every})\"",
+        "if [ \"$TRANSFER_MODE\" = \"topup\" ]; then",
+        "    echo \"Top-up: copying files modified within the last $MAX_AGE...\"",
+        f"    rclone copy {source} {destination} --max-age \"$MAX_AGE\" --no-traverse {min_size}{rclone_flags}",
+        "else",
+        "    echo 'Full reconciliation of source and destination...'",
+        f"    rclone copy {source} {destination} {min_size}{rclone_flags}",
+        "fi",
+    ]
+
+
+def _build_watched_transfer_lines(job: Dict, rclone_flags: str) -> list:
+    """
+    Build script lines that copy only the files the job's inotify watcher saw change.
+    
+    The whole source is copied when the watcher cannot vouch for every
+    change since the last successful transfer.
+    """
+    source = job["source"]
+    min_size = _bundle_min_size(job)
+    return [
+        f"python3 -m pipeline.watch start --state-dir \"$STATE_DIR\" --source {source}",
+        f"CHANGES=$(python3 -m pipeline.watch take --state-dir \"$STATE_DIR\" --source {source} "
+        f"--out \"$STATE_DIR/watch_changed.txt\")",
+        "if [ \"$CHANGES\" = \"dirty\" ]; then",
+        f"    rclone copy {source} {job['destination']} --files-from-raw \"$STATE_DIR/watch_changed.txt\" "
+        f"--no-traverse {min_size}{rclone_flags}",
+        "else",
+        f"    rclone copy {source} {job['destination']} {min_size}{rclone_flags}",
+        "fi",
+        "python3 -m pipeline.watch release --state-dir \"$STATE_DIR\"",
+    ]
+
+
+def generate_restore_script(config: Dict, job_id: str, paths: Optional[List[str]] = None,
+                            stream: bool = False, snapshot: Optional[str] = None) -> Path:
     """
     Generate a restore script for specified job.
     
     Args:
         config: Configuration dictionary
         job_id: Job ID
+        paths: Restore only these paths (relative to the source directory);
+            needs a job with a content index
+        stream: Stream archives from the remote into tar instead of
+            downloading them to TEMP_DIR first (compressed archive jobs)
+        snapshot: Snapshot to restore for snapshot jobs (default: the
+            newest one at run time)
     
     Returns:
         Path to generated script
@@ -196,10 +912,19 @@ def generate_restore_script(config: Dict, job_id: str) -> Path:
     script_path = SCRIPT_DIR / f"restore_{job_id}.sh"
     SCRIPT_DIR.mkdir(parents=True, exist_ok=True)
 
-    rclone_flags = _build_rclone_flags(job.get("rclone_flags", {}))
+    rclone_flags = _build_rclone_flags(_restore_flags(job))
     use_progress = "--progress" in rclone_flags
 
-    script_lines = _build_restore_script_lines(job, target_dir, rclone_flags, use_progress)
+    if paths and _uses_content_index(job):
+        script_lines = _build_indexed_restore_script_lines(job, target_dir, paths, snapshot)
+    elif job.get("compress") and job.get("dedup"):
+        script_lines = _build_dedup_restore_script_lines(job_id, job, target_dir, use_progress)
+    elif job.get("compress") and job.get("shards"):
+        script_lines = _build_shard_restore_script_lines(job, target_dir)
+    elif stream and job.get("compress"):
+        script_lines = _build_stream_restore_script_lines(job, target_dir, use_progress, snapshot)
+    else:
+        script_lines = _build_restore_script_lines(job_id, job, target_dir, rclone_flags, use_progress, snapshot)
     
     script_path.write_text("\n".join(script_lines))
     script_path.chmod(0o755)
@@ -207,81 +932,369 @@ def generate_restore_script(config: Dict, job_id: str) -> Path:
     return script_path
 
 
-def _build_restore_script_lines(job: Dict, target_dir: str, rclone_flags: str, use_progress: bool) -> list:
+def _restore_workers(job: Dict) -> int:
+    """Parallel downloads for restores (independent of the backup's --transfers)."""
+    return job.get("restore_workers") or DEFAULT_RESTORE_WORKERS
+
+
+def _restore_flags(job: Dict) -> Dict:
+    """
+    Return the job's rclone flags adjusted for restores.
+    
+    Backup pacing (--tpslimit) is dropped and --transfers is set to the
+    job's restore_workers, so restores are not held to backup throttling.
+    """
+    flags = {flag: value for flag, value in job.get("rclone_flags", {}).items() if flag not in BACKUP_PACING_FLAGS}
+    flags["--transfers"] = str(_restore_workers(job))
+    return flags
+
+
+def _build_restore_script_lines(job_id: str, job: Dict, target_dir: str, rclone_flags: str, use_progress: bool,
+                                snapshot: Optional[str] = None) -> list:
     """Build script lines for restore script."""
     lines = [
         "#!/bin/bash",
         "set -e",
+        "set -o pipefail",
         "echo 'Starting restore process...'",
         "",
-        "echo 'Downloading files from remote...'",
-        f"rclone copy {job['destination']} {TEMP_DIR} {rclone_flags}",
-        ""
+        *_build_helper_env_lines(),
+        "RUN_ID=restore-$(date +%Y%m%d-%H%M%S)",
+        *_build_work_dir_lines(job_id),
     ]
 
-    if job.get("split_files"):
-        lines.extend(_build_reassemble_lines(use_progress))
-    
     if job.get("compress"):
-        lines.extend(_build_extract_lines(target_dir, use_progress))
+        lines.extend([
+            *_build_snapshot_select_lines(job, snapshot),
+            # Each restore downloads into a cache of its own; an interrupted one is resumed by the next run
+            f"CACHE_DIR=\"{TEMP_DIR}/{job_id}/{RESTORE_CACHE_DIR}-$RUN_ID-$$\"",
+            f"python3 -m pipeline.workdir adopt \"$CACHE_DIR\" --pid $$ --prefix {RESTORE_CACHE_DIR}",
+            *_build_cached_download_lines(job, _backup_dir(job), "$CACHE_DIR"),
+            *_build_extract_lines("$CACHE_DIR", target_dir, use_progress),
+        ])
+        if job.get("incremental"):
+            lines.extend(_build_incremental_restore_lines(job, target_dir, use_progress))
+        lines.append("rm -rf \"$CACHE_DIR\"")
     else:
         lines.extend([
+            "echo 'Downloading files from remote...'",
+            f"rclone copy {job['destination']} \"$WORK_DIR\" {_build_restore_excludes(job)}{rclone_flags}",
+            "",
             "echo 'Restoring files without compression...'",
-            f"rclone copy {TEMP_DIR} {target_dir} {rclone_flags}"
+            f"rclone copy \"$WORK_DIR\" {target_dir} --exclude /{OWNER_FILE} {rclone_flags}"
         ])
+        if job.get("bundle"):
+            lines.extend([
+                "echo 'Extracting small-file bundles...'",
+                f"python3 -m pipeline.bundle unpack --remote {job['destination']} --target {target_dir} "
+                f"--workers {_restore_workers(job)} --rclone-flags=\"{rclone_flags}\"",
+            ])
+        if job.get("incremental"):
+            lines.extend(_build_tombstone_restore_lines(job, target_dir))
     
     lines.extend([
         "",
-        "echo 'Cleaning up temporary files...'",
-        f"rm -rf {TEMP_DIR}/*",
+        *_build_temp_cleanup_lines(),
         "echo 'Restore completed.'"
     ])
     
     return lines
 
 
-def _build_reassemble_lines(use_progress: bool) -> list:
-    """Build script lines for reassembling split files."""
-    lines = [
-        "echo 'Checking for split files...'",
-        f"if ls {TEMP_DIR}/backup-part-* 1> /dev/null 2>&1; then",
-        "    echo 'Split files found. Reassembling...'"
-    ]
+def _build_dedup_restore_script_lines(job_id: str, job: Dict, target_dir: str, use_progress: bool) -> list:
+    """Build script lines that restore the newest snapshot of a deduplicating repository."""
+    rclone_flags = _build_rclone_flags(_restore_flags(job))
     
+    pipe = (
+        f"python3 -m pipeline.chunkstore restore --state-dir \"{STATE_DIR / job_id}\" "
+        f"--repo \"{job['destination']}/{DEDUP_REPO_DIR}\" --work-dir \"$WORK_DIR/chunkstore\" "
+        f"--rclone-flags=\"{rclone_flags}\" | "
+    )
     if use_progress:
-        lines.append(
-            f"    cat {TEMP_DIR}/backup-part-* | "
-            f"pv -cN Reassembling > {TEMP_DIR}/backup.tar.gz"
+        pipe += "pv -cN Restoring | "
+    pipe += f"tar -xf - -C {target_dir}"
+    
+    return [
+        "#!/bin/bash",
+        "set -e",
+        "set -o pipefail",
+        "echo 'Starting restore process...'",
+        "",
+        *_build_helper_env_lines(),
+        "RUN_ID=restore-$(date +%Y%m%d-%H%M%S)",
+        *_build_work_dir_lines(job_id),
+        "echo 'Restoring newest snapshot from deduplicating repository...'",
+        f"mkdir -p {target_dir}",
+        pipe,
+        "",
+        "echo 'Restore completed.'"
+    ]
+
+
+def _build_shard_restore_script_lines(job: Dict, target_dir: str) -> list:
+    """Build script lines that download and extract the newest sharded backup in parallel."""
+    rclone_flags = _build_rclone_flags(_restore_flags(job))
+    
+    return [
+        "#!/bin/bash",
+        "set -e",
+        "echo 'Starting restore process...'",
+        "",
+        *_build_helper_env_lines(),
+        "echo 'Restoring newest sharded backup...'",
+        f"python3 -m pipeline.shard restore --remote \"{job['destination']}\" --target {target_dir} "
+        f"--workers {_restore_workers(job)} --rclone-flags=\"{rclone_flags}\"",
+        "",
+        "echo 'Restore completed.'"
+    ]
+
+
+def _build_stream_restore_script_lines(job: Dict, target_dir: str, use_progress: bool,
+                                       snapshot: Optional[str] = None) -> list:
+    """
+    Build script lines that stream archives from the remote straight into tar.
+    
+    pipeline.fetch reads the archive (or its parts, in order) with
+    `rclone cat` and decompresses it on the fly, so nothing is written to
+    TEMP_DIR. Incremental archives and their tombstone lists are streamed
+    the same way.
+    """
+    rclone_flags = _build_rclone_flags(_restore_flags(job))
+    listing_flags = _build_rclone_flags(
+        {flag: value for flag, value in _restore_flags(job).items() if flag != "--progress"}
+    )
+    parts = "--parts " if job.get("split_files") else ""
+    
+    def extract(remote: str) -> str:
+        pipe = (
+            f"python3 -m pipeline.fetch stream --remote \"{remote}\" {parts}--workers {_restore_workers(job)} "
+            f"--rclone-flags=\"{rclone_flags}\" | "
         )
-    else:
-        lines.append(f"    cat {TEMP_DIR}/backup-part-* > {TEMP_DIR}/backup.tar.gz")
+        if use_progress:
+            pipe += "pv -cN Restoring | "
+        return pipe + f"tar -x --ignore-zeros -C {target_dir}"
+    
+    lines = [
+        "#!/bin/bash",
+        "set -e",
+        "set -o pipefail",
+        "echo 'Starting streaming restore...'",
+        "",
+        *_build_helper_env_lines(),
+        f"mkdir -p {target_dir}",
+        *_build_snapshot_select_lines(job, snapshot),
+        "echo 'Streaming full backup from remote...'",
+        extract(_backup_dir(job)),
+    ]
+    
+    if job.get("incremental"):
+        lines.extend([
+            f"for INCR in $({_build_incremental_list_command(job, listing_flags)}); do",
+            "INCR=\"${INCR%/}\"",
+            "echo \"Applying incremental $INCR...\"",
+            extract(f"{_backup_dir(job)}/incr/$INCR"),
+            f"rclone cat \"{_backup_dir(job)}/incr/$INCR/deleted.lst\" {listing_flags} | "
+            f"(cd {target_dir} && xargs -0 -r rm -rf --)",
+            "done",
+        ])
     
     lines.extend([
-        f"    rm {TEMP_DIR}/backup-part-* || true",
-        "else",
-        "    echo 'Error: No split files found!'",
-        "    exit 1",
-        "fi",
-        ""
+        "",
+        "echo 'Restore completed.'"
     ])
     
     return lines
 
 
-def _build_extract_lines(target_dir: str, use_progress: bool) -> list:
-    """Build script lines for extracting compressed files."""
+def _build_indexed_restore_script_lines(job: Dict, target_dir: str, paths: List[str],
+                                        snapshot: Optional[str] = None) -> list:
+    """
+    Build script lines that restore selected paths using the content index.
+    
+    Only the frames holding the requested entries are downloaded. For
+    incremental jobs the full archive and then every incremental archive is
+    searched, so the newest version of each path wins; deletions recorded in
+    the chain are not replayed.
+    """
+    rclone_flags = _build_rclone_flags(_restore_flags(job))
+    listing_flags = _build_rclone_flags(
+        {flag: value for flag, value in _restore_flags(job).items() if flag != "--progress"}
+    )
+    path_args = " ".join(f"--path {shlex.quote(path)}" for path in paths)
+    extract = (
+        f"python3 -m pipeline.indexed extract --target {target_dir} {path_args} --workers {_restore_workers(job)} "
+        f"--rclone-flags=\"{rclone_flags}\" --remote"
+    )
+    
     lines = [
-        "echo 'Extracting compressed files...'",
-        f"mkdir -p {target_dir}"
+        "#!/bin/bash",
+        "set -e",
+        "echo 'Starting selective restore...'",
+        "",
+        *_build_helper_env_lines(),
+        *_build_snapshot_select_lines(job, snapshot),
+        "echo 'Restoring selected paths from the full backup...'",
+        f"{extract} \"{_backup_dir(job)}\"",
     ]
     
-    if use_progress:
-        lines.append(
-            f"pv -cN Extracting {TEMP_DIR}/backup.tar.gz | tar -xz -C {target_dir}"
+    if job.get("incremental"):
+        lines.extend([
+            f"for INCR in $({_build_incremental_list_command(job, listing_flags)}); do",
+            "INCR=\"${INCR%/}\"",
+            "echo \"Restoring selected paths from incremental $INCR...\"",
+            f"{extract} \"{_backup_dir(job)}/incr/$INCR\"",
+            "done",
+        ])
+    
+    lines.extend([
+        "",
+        "echo 'Restore completed.'"
+    ])
+    
+    return lines
+
+
+def _build_restore_excludes(job: Dict) -> str:
+    """Build rclone excludes for bookkeeping data stored next to a plain copy backup."""
+    if not job.get("incremental") and not job.get("bundle"):
+        return ""
+    return f"--exclude \"/{TOMBSTONE_DIR.split('/')[0]}/**\" "
+
+
+def _build_tombstone_restore_lines(job: Dict, target_dir: str) -> list:
+    """Build script lines that remove the files a plain copy job recorded as deleted from the restored tree."""
+    listing_flags = _build_rclone_flags(
+        {flag: value for flag, value in _restore_flags(job).items() if flag != "--progress"}
+    )
+    return [
+        f"if rclone cat {job['destination']}/{TOMBSTONE_DIR}/{TOMBSTONE_FILE} {listing_flags} "
+        f"> \"$WORK_DIR/{TOMBSTONE_FILE}\" 2>/dev/null; then",
+        "    echo 'Removing files deleted since they were backed up...'",
+        f"    tr '\\n' '\\0' < \"$WORK_DIR/{TOMBSTONE_FILE}\" | (cd {target_dir} && xargs -0 -r rm -f --)",
+        "fi",
+    ]
+
+
+def _build_incremental_restore_lines(job: Dict, target_dir: str, use_progress: bool) -> list:
+    """
+    Build script lines that replay the incremental chain on top of a full restore.
+    
+    Each `incr/<RUN_ID>` directory is applied oldest first: its archive is
+    downloaded into its own cache directory and extracted over the target,
+    then the paths in its tombstone list are removed.
+    """
+    listing_flags = _build_rclone_flags(
+        {flag: value for flag, value in _restore_flags(job).items() if flag != "--progress"}
+    )
+    remote = f"{_backup_dir(job)}/incr/$INCR"
+    
+    return [
+        "echo 'Applying incremental backups...'",
+        f"for INCR in $({_build_incremental_list_command(job, listing_flags)}); do",
+        "INCR=\"${INCR%/}\"",
+        "echo \"Applying incremental $INCR...\"",
+        *_build_cached_download_lines(job, remote, "$CACHE_DIR/incr/$INCR"),
+        *_build_extract_lines("$CACHE_DIR/incr/$INCR", target_dir, use_progress),
+        f"if rclone cat \"{remote}/deleted.lst\" {listing_flags} > \"$CACHE_DIR/deleted.lst\" 2>/dev/null; then",
+        f"    (cd {target_dir} && xargs -0 -r rm -rf -- < \"$CACHE_DIR/deleted.lst\")",
+        "fi",
+        "rm -f \"$CACHE_DIR/deleted.lst\"",
+        "done",
+        ""
+    ]
+
+
+def _build_incremental_list_command(job: Dict, listing_flags: str) -> str:
+    """
+    Build the command that prints the incremental runs to replay, oldest first.
+    
+    Snapshot jobs take the runs from the catalog, which only lists runs that
+    finished; other jobs list the `incr/` directory and skip runs that
+    failed before their manifest was uploaded.
+    """
+    if _uses_snapshots(job):
+        return (
+            f"python3 -m pipeline.snapshots runs --root \"$SNAPSHOT_ROOT\" --id \"$SNAPSHOT\" "
+            f"--rclone-flags=\"{listing_flags}\""
         )
+    return (
+        f"rclone lsf -R --files-only --max-depth 2 {job['destination']}/incr/ {listing_flags} 2>/dev/null | "
+        f"sed -n 's|/{MANIFEST_FILE}$||p' | sort"
+    )
+
+
+def _backup_dir(job: Dict) -> str:
+    """Remote directory holding the backup to restore (BACKUP_DIR for snapshot jobs)."""
+    return "$BACKUP_DIR" if _uses_snapshots(job) else job["destination"]
+
+
+def _build_snapshot_select_lines(job: Dict, snapshot: Optional[str]) -> list:
+    """
+    Build script lines that point BACKUP_DIR at the snapshot to restore.
+    
+    Without an explicit snapshot the newest one is read from the catalog at
+    run time, so a saved restore script keeps restoring the latest backup.
+    """
+    if not _uses_snapshots(job):
+        return []
+    
+    listing_flags = _build_rclone_flags(
+        {flag: value for flag, value in _restore_flags(job).items() if flag != "--progress"}
+    )
+    if snapshot:
+        select = f"SNAPSHOT={shlex.quote(snapshot)}"
     else:
-        lines.append(f"tar -xzf {TEMP_DIR}/backup.tar.gz -C {target_dir}")
+        select = (
+            f"SNAPSHOT=$(python3 -m pipeline.snapshots latest --root \"$SNAPSHOT_ROOT\" "
+            f"--rclone-flags=\"{listing_flags}\")"
+        )
+    
+    return [
+        f"SNAPSHOT_ROOT=\"{job['destination']}/{SNAPSHOT_DIR}\"",
+        select,
+        "BACKUP_DIR=\"$SNAPSHOT_ROOT/$SNAPSHOT\"",
+        "echo \"Restoring snapshot $SNAPSHOT...\"",
+    ]
+
+
+def _build_cached_download_lines(job: Dict, remote: str, cache_dir: str) -> list:
+    """
+    Build script lines that download an archive into a resumable restore cache.
     
-    lines.append(f"rm {TEMP_DIR}/backup.tar.gz")
+    pipeline.fetch verifies every file against the backup's checksum manifest
+    and re-fetches damaged ones; rerunning an interrupted restore only
+    downloads what is still missing.
+    """
+    rclone_flags = _build_rclone_flags(_restore_flags(job))
+    parts = "--parts " if job.get("split_files") else ""
     
-    return lines
+    return [
+        "echo 'Downloading and verifying backup files...'",
+        f"python3 -m pipeline.fetch download --remote \"{remote}\" --dir \"{cache_dir}\" {parts}"
+        f"--workers {_restore_workers(job)} --rclone-flags=\"{rclone_flags}\"",
+    ]
+
+
+def _build_extract_lines(cache_dir: str, target_dir: str, use_progress: bool) -> list:
+    """
+    Build script lines for extracting the archive in a restore cache directory.
+    
+    Split parts are fed to the decompressor in order straight from the
+    cache, without joining them into a second copy first. The decompressor
+    is chosen from the archive's magic bytes, so gzip and zstd archives
+    restore regardless of the job's current codec. --ignore-zeros lets tar
+    continue past the end of the first archive, which is needed for archives
+    written by pipeline.classify (two tar archives in two compressed members)
+    and harmless for regular ones.
+    """
+    files = f"\"{cache_dir}\"/backup[-.]*"
+    pipe = f"cat {files} | "
+    if use_progress:
+        pipe += "pv -cN Extracting | "
+    
+    return [
+        "echo 'Extracting compressed files...'",
+        f"mkdir -p {target_dir}",
+        f"DECOMPRESS=$(python3 -m pipeline.codecs decompressor \"$(ls {files} | head -n 1)\")",
+        f"{pipe}$DECOMPRESS | tar -x --ignore-zeros -C {target_dir}",
+    ]
@@ -0,0 +1,49 @@
+import os
+
+from pipeline.bundle import plan_bundles
+
+THRESHOLD = 4096
+TARGET = 64 * 1024
+
+
+def _make_tree(root, count):
+    for number in range(count):
+        directory = os.path.join(root, f"dir{number // 50:02d}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"file{number:04d}.txt"), "w") as file:
+            file.write("x" * (100 + number % 1000))
+        os.utime(os.path.join(directory, f"file{number:04d}.txt"), (1, 1))
+
+
+def test_bundles_hold_every_small_file_once(tmp_path):
+    _make_tree(str(tmp_path), 500)
+    with open(tmp_path / "large.bin", "w") as file:
+        file.write("x" * THRESHOLD)
+
+    bundles = plan_bundles(str(tmp_path), THRESHOLD, TARGET)
+    paths = [entry[0] for bundle in bundles for entry in bundle["files"]]
+
+    assert len(paths) == 500 and len(set(paths)) == 500
+    assert "large.bin" not in paths
+    assert paths == sorted(paths)
+    assert all(bundle["bytes"] < TARGET * 2 + THRESHOLD + 512 for bundle in bundles)
+
+
+def test_one_change_touches_few_bundles(tmp_path):
+    _make_tree(str(tmp_path), 1000)
+    before = {bundle["name"] for bundle in plan_bundles(str(tmp_path), THRESHOLD, TARGET)}
+
+    with open(tmp_path / "dir05" / "file0260.txt", "a") as file:
+        file.write("changed")
+    with open(tmp_path / "dir10" / "new.txt", "w") as file:
+        file.write("new")
+    after = {bundle["name"] for bundle in plan_bundles(str(tmp_path), THRESHOLD, TARGET)}
+
+    assert len(before) > 10
+    # Each edit rewrites its own bundle, and at most the one after it if a cut point moved
+    assert len(after - before) <= 4
+
+
+def test_plan_is_deterministic(tmp_path):
+    _make_tree(str(tmp_path), 200)
+    assert plan_bundles(str(tmp_path), THRESHOLD, TARGET) == plan_bundles(str(tmp_path), THRESHOLD, TARGET)
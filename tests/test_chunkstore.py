@@ -0,0 +1,36 @@
+import io
+import random
+
+from pipeline.chunkstore import MAX_CHUNK, MIN_CHUNK, Chunker, decode_chunk, encode_chunk
+
+
+def _data(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+
+def test_chunks_reassemble_within_bounds():
+    data = _data(24 * 1024 * 1024)
+    chunks = list(Chunker().chunks(io.BytesIO(data)))
+
+    assert b"".join(chunks) == data
+    assert all(MIN_CHUNK <= len(chunk) <= MAX_CHUNK for chunk in chunks[:-1])
+    assert 0 < len(chunks[-1]) <= MAX_CHUNK
+
+
+def test_boundaries_survive_an_insertion():
+    data = _data(24 * 1024 * 1024)
+    before = list(Chunker().chunks(io.BytesIO(data)))
+    after = list(Chunker().chunks(io.BytesIO(b"inserted" + data)))
+
+    # Only the chunks up to the first content-defined cut differ
+    assert len(set(before) & set(after)) >= len(before) - 2
+
+
+def test_short_streams_are_one_chunk():
+    assert list(Chunker().chunks(io.BytesIO(b""))) == []
+    assert list(Chunker().chunks(io.BytesIO(b"small"))) == [b"small"]
+
+
+def test_chunk_encoding_round_trips():
+    for data in (b"a" * 100000, _data(100000)):
+        assert decode_chunk(encode_chunk(data, 6)) == data
@@ -0,0 +1,54 @@
+import pipeline.cpu as cpu
+
+
+def fake_cgroup(monkeypatch, tmp_path, paths):
+    monkeypatch.setattr(cpu, "CGROUP_ROOT", tmp_path)
+    monkeypatch.setattr(cpu, "_cgroup_paths", lambda: paths)
+
+
+def test_cgroup_v2_quota_includes_parents(monkeypatch, tmp_path):
+    fake_cgroup(monkeypatch, tmp_path, {"": "/parent/job"})
+    (tmp_path / "parent" / "job").mkdir(parents=True)
+    (tmp_path / "parent" / "job" / "cpu.max").write_text("max 100000\n")
+    assert cpu.cgroup_quota() is None
+
+    (tmp_path / "parent" / "cpu.max").write_text("150000 100000\n")
+    assert cpu.cgroup_quota() == 1.5
+
+
+def test_cgroup_v1_quota(monkeypatch, tmp_path):
+    fake_cgroup(monkeypatch, tmp_path, {"cpu": "/job", "cpuacct": "/job"})
+    directory = tmp_path / "cpu,cpuacct" / "job"
+    directory.mkdir(parents=True)
+    (directory / "cpu.cfs_quota_us").write_text("-1\n")
+    (directory / "cpu.cfs_period_us").write_text("100000\n")
+    assert cpu.cgroup_quota() is None
+
+    (directory / "cpu.cfs_quota_us").write_text("200000\n")
+    assert cpu.cgroup_quota() == 2
+
+
+def test_cpu_limit_rounds_the_quota_up(monkeypatch):
+    monkeypatch.setattr(cpu, "affinity_cpus", lambda: 8)
+    monkeypatch.setattr(cpu, "cgroup_quota", lambda: 2.5)
+    assert cpu.cpu_limit() == 3
+    monkeypatch.setattr(cpu, "cgroup_quota", lambda: 0.1)
+    assert cpu.cpu_limit() == 1
+    monkeypatch.setattr(cpu, "cgroup_quota", lambda: None)
+    assert cpu.cpu_limit() == 8
+
+
+def test_available_cores_respects_limit_and_load(monkeypatch):
+    monkeypatch.setattr(cpu, "cpu_limit", lambda: 4)
+    monkeypatch.setattr(cpu, "idle_cpus", lambda: 6.5)
+    assert cpu.available_cores() == 4
+    monkeypatch.setattr(cpu, "idle_cpus", lambda: 2.7)
+    assert cpu.available_cores() == 2
+    monkeypatch.setattr(cpu, "idle_cpus", lambda: -3.0)
+    assert cpu.available_cores() == 1
+
+
+def test_checkers_for():
+    assert cpu.checkers_for(0) == 1
+    assert cpu.checkers_for(6) == 6
+    assert cpu.checkers_for(64) == cpu.MAX_CHECKERS
@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+
+import core.dir_sizes as dir_sizes
+from core.dir_sizes import DirSizeCache, DirSizer
+
+
+def make_tree(root, files, age=3600):
+    for rel_path, size in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+    # Directories modified just now are not cached; age the tree
+    old = time.time() - age
+    for directory, _, _ in os.walk(root):
+        os.utime(directory, (old, old))
+
+
+FILES = {"a.bin": 1000, "sub/b.bin": 200, "sub/deeper/c.bin": 30}
+
+
+def count_scans(monkeypatch):
+    scanned = []
+    real_scandir = os.scandir
+
+    def scandir(path):
+        scanned.append(path)
+        return real_scandir(path)
+    monkeypatch.setattr(dir_sizes.os, "scandir", scandir)
+    return scanned
+
+
+def test_size_is_cached_per_directory(tmp_path, monkeypatch):
+    make_tree(tmp_path / "src", FILES)
+    cache = DirSizeCache(tmp_path / "cache.json.gz")
+    scanned = count_scans(monkeypatch)
+    assert cache.size(str(tmp_path / "src")) == 1230
+    assert len(scanned) == 3
+
+    assert cache.size(str(tmp_path / "src" / "sub")) == 230
+    assert len(scanned) == 3
+
+    (tmp_path / "src" / "sub" / "new.bin").write_bytes(b"y" * 5)
+    assert cache.size(str(tmp_path / "src")) == 1235
+    assert scanned[3:] == [str(tmp_path / "src" / "sub")]
+
+
+def test_cache_survives_a_restart(tmp_path, monkeypatch):
+    make_tree(tmp_path / "src", FILES)
+    cache = DirSizeCache(tmp_path / "cache.json.gz")
+    cache.size(str(tmp_path / "src"))
+    cache.save()
+
+    scanned = count_scans(monkeypatch)
+    assert DirSizeCache(tmp_path / "cache.json.gz").size(str(tmp_path / "src")) == 1230
+    assert scanned == []
+
+
+def test_missing_paths_count_as_empty(tmp_path):
+    cache = DirSizeCache(tmp_path / "cache.json.gz")
+    assert cache.size(str(tmp_path / "missing")) == 0
+
+
+def test_sizer_computes_in_the_background(tmp_path, monkeypatch):
+    make_tree(tmp_path / "src", FILES)
+    monkeypatch.setattr(dir_sizes, "DirSizeCache", lambda: DirSizeCache(tmp_path / "cache.json.gz"))
+    sizer = DirSizer(workers=2)
+    paths = [str(tmp_path / "src"), str(tmp_path / "src" / "sub")]
+
+    assert sizer.size(paths[0]) is None
+    assert sizer.size(paths[1]) is None
+    deadline = time.monotonic() + 5
+    while len(sizer.wait(paths, 0.5)) < 2:
+        assert time.monotonic() < deadline
+    assert [sizer.size(path) for path in paths] == [1230, 230]
+
+    sizer.save()
+    assert (tmp_path / "cache.json.gz").exists()
+
+
+def test_sizer_drops_requests_for_paths_no_longer_shown(tmp_path, monkeypatch):
+    make_tree(tmp_path / "src", FILES)
+    monkeypatch.setattr(dir_sizes, "DirSizeCache", lambda: DirSizeCache(tmp_path / "cache.json.gz"))
+    # No workers yet, so the requests stay queued
+    sizer = DirSizer(workers=0)
+    old, shown = str(tmp_path / "src"), str(tmp_path / "src" / "sub")
+    sizer.size(old)
+    sizer.size(shown)
+    sizer.only([shown])
+
+    threading.Thread(target=sizer._work, daemon=True).start()
+    assert sizer.wait([shown], 5) == [shown]
+    assert sizer.wait([old], 0.2) == []
+    assert sizer.size(shown) == 230
@@ -0,0 +1,158 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from pipeline.fetch import download, decompress_stream, find_archive
+from pipeline.manifest import MANIFEST_FILE, build_manifest
+from pipeline.workdir import OWNER_FILE, RESUME_FILE
+
+# Stand-in for the rclone subcommands used here, for remotes that are local directories
+FAKE_RCLONE = """#!{python}
+import json, os, sys
+args = sys.argv[1:]
+with open(os.environ["FAKE_RCLONE_LOG"], "a") as log:
+    log.write(" ".join(args) + "\\n")
+if args[0] == "cat":
+    offset = int(args[args.index("--offset") + 1]) if "--offset" in args else 0
+    count = int(args[args.index("--count") + 1]) if "--count" in args else -1
+    try:
+        with open(args[1], "rb") as file:
+            file.seek(offset)
+            sys.stdout.buffer.write(file.read(count))
+    except OSError:
+        sys.exit(3)
+elif args[0] == "lsjson":
+    directory = args[-1]
+    print(json.dumps([
+        {{"Name": name, "Size": os.path.getsize(os.path.join(directory, name)),
+          "ModTime": "2026-01-01T00:00:%02dZ" % index}}
+        for index, name in enumerate(sorted(os.listdir(directory)))
+    ]))
+"""
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    rclone = bin_dir / "rclone"
+    rclone.write_text(FAKE_RCLONE.format(python=sys.executable))
+    rclone.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_RCLONE_LOG", str(tmp_path / "rclone.log"))
+    directory = tmp_path / "remote"
+    directory.mkdir()
+    return directory
+
+
+def rclone_calls(remote):
+    log = remote.parent / "rclone.log"
+    return log.read_text().splitlines() if log.exists() else []
+
+
+def store(remote, files, manifest=True):
+    entries = []
+    for name, data in files.items():
+        (remote / name).write_bytes(data)
+        entries.append({"name": name, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()})
+    if manifest:
+        (remote / MANIFEST_FILE).write_text(json.dumps(build_manifest(entries)))
+
+
+PARTS = {"backup-part-000": b"a" * 3000, "backup-part-001": b"b" * 3000, "backup-part-002": b"c" * 100}
+
+
+def test_download_verifies_every_file(remote, tmp_path):
+    store(remote, PARTS)
+    cache = tmp_path / "cache"
+    assert download(str(remote), cache, True, 2) == 3
+    for name, data in PARTS.items():
+        assert (cache / name).read_bytes() == data
+    assert sorted(json.loads((cache / RESUME_FILE).read_text())["done"]) == sorted(PARTS)
+
+    # Everything is cached now
+    assert download(str(remote), cache, True, 2) == 0
+
+
+def test_interrupted_download_resumes(remote, tmp_path):
+    store(remote, PARTS)
+    cache = tmp_path / "cache"
+    download(str(remote), cache, True, 1)
+    (cache / "backup-part-001").unlink()
+    (cache / "backup-part-002").rename(cache / "backup-part-002.partial")
+    with open(cache / "backup-part-002.partial", "r+b") as file:
+        file.truncate(40)
+    state = json.loads((cache / RESUME_FILE).read_text())
+    state["done"] = ["backup-part-000"]
+    (cache / RESUME_FILE).write_text(json.dumps(state))
+
+    assert download(str(remote), cache, True, 1) == 2
+    assert (cache / "backup-part-002").read_bytes() == PARTS["backup-part-002"]
+    assert any(call.endswith("backup-part-002 --offset 40") for call in rclone_calls(remote))
+
+
+def test_damaged_cached_file_is_fetched_again(remote, tmp_path):
+    store(remote, PARTS)
+    cache = tmp_path / "cache"
+    download(str(remote), cache, True, 2)
+    (cache / "backup-part-000").write_bytes(b"x" * 3000)
+
+    assert download(str(remote), cache, True, 2) == 1
+    assert (cache / "backup-part-000").read_bytes() == PARTS["backup-part-000"]
+
+
+def test_remote_damage_fails_the_download(remote, tmp_path):
+    store(remote, PARTS)
+    (remote / "backup-part-001").write_bytes(b"x" * 3000)
+    with pytest.raises(OSError, match="checksum mismatch"):
+        download(str(remote), tmp_path / "cache", True, 2)
+
+
+def test_cache_of_another_backup_is_cleared(remote, tmp_path):
+    store(remote, PARTS)
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    (cache / OWNER_FILE).write_text("1 1\n")
+    (cache / "backup-part-009").write_bytes(b"old")
+    (cache / RESUME_FILE).write_text(json.dumps({"remote": "r:other", "files": [], "done": []}))
+
+    download(str(remote), cache, True, 2)
+    assert not (cache / "backup-part-009").exists()
+    assert (cache / OWNER_FILE).exists()
+
+
+def test_backups_without_manifest_are_listed(remote, tmp_path):
+    store(remote, {"backup-part-001": b"2", "backup-part-000": b"1", "other": b"x"}, manifest=False)
+    assert find_archive(str(remote), True) == [("backup-part-000", 1), ("backup-part-001", 1)]
+    assert download(str(remote), tmp_path / "cache", True, 2) == 2
+
+    single = remote.parent / "single"
+    single.mkdir()
+    store(single, {"backup.tar.gz": b"old", "backup.tar.zst": b"newer"}, manifest=False)
+    # The newest archive wins
+    assert find_archive(str(single), False) == [("backup.tar.zst", 5)]
+
+    empty = remote.parent / "empty"
+    empty.mkdir()
+    with pytest.raises(FileNotFoundError):
+        find_archive(str(empty), True)
+
+
+@pytest.mark.skipif(not shutil.which("zstd"), reason="zstd is not installed")
+def test_decompress_stream_detects_the_codec(tmp_path):
+    data = b"tar data " * 1000
+    compressed = subprocess.run(["zstd", "-q", "-c"], input=data, stdout=subprocess.PIPE, check=True).stdout
+    output_path = tmp_path / "out"
+    with open(output_path, "wb") as output:
+        chunks = iter([compressed[:2], compressed[2:10], compressed[10:]])
+        assert decompress_stream(chunks, output) == "zstd"
+    assert output_path.read_bytes() == data
+
+    with pytest.raises(ValueError):
+        decompress_stream(iter([b"not an archive"]), io.BytesIO())
@@ -0,0 +1,123 @@
+import os
+
+from pipeline.file_index import (
+    CHANGED_FILE, DELETED_FILE, INDEX_FILE, PENDING_FILE, TOMBSTONE_FILE, commit, diff_trees, load_index, scan,
+    snapshot_tree,
+)
+
+
+def make_tree(root, files):
+    for rel_path, data in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(data)
+
+
+def read_list(state_dir, name, fmt):
+    separator = "\0" if fmt == "tar" else "\n"
+    return [entry for entry in (state_dir / name).read_text().split(separator) if entry]
+
+
+def bump_mtime(path):
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def test_snapshot_and_diff(tmp_path):
+    make_tree(tmp_path, {"a.txt": "a", "dir/b.txt": "bb"})
+    before = snapshot_tree(str(tmp_path))
+    assert sorted(before) == ["a.txt", "dir", "dir/b.txt"]
+    assert before["dir/b.txt"][0] == 2
+    assert before["dir"][4] == 1
+
+    bump_mtime(tmp_path / "a.txt")
+    (tmp_path / "dir" / "b.txt").unlink()
+    (tmp_path / "c.txt").write_text("c")
+    changed, deleted = diff_trees(before, snapshot_tree(str(tmp_path)))
+    assert changed == ["a.txt", "c.txt", "dir"]
+    assert deleted == ["dir/b.txt"]
+
+
+def test_first_scan_is_full_and_commit_promotes_the_index(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    make_tree(source, {"a.txt": "a", "dir/b.txt": "b"})
+
+    assert scan(state, str(source), 0, "tar") == "full"
+    assert read_list(state, CHANGED_FILE["tar"], "tar") == ["a.txt", "dir", "dir/b.txt"]
+    assert not (state / INDEX_FILE).exists()
+
+    # Without a commit the next run is full again
+    assert scan(state, str(source), 0, "tar") == "full"
+    commit(state)
+    assert not (state / PENDING_FILE).exists()
+    assert load_index(state)["mode"] == "full"
+
+
+def test_incremental_scan_lists_changes_only(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    make_tree(source, {"a.txt": "a", "b.txt": "b"})
+    scan(state, str(source), 0, "tar")
+    commit(state)
+
+    bump_mtime(source / "a.txt")
+    (source / "b.txt").unlink()
+    assert scan(state, str(source), 0, "tar") == "incremental"
+    assert read_list(state, CHANGED_FILE["tar"], "tar") == ["a.txt"]
+    assert read_list(state, DELETED_FILE["tar"], "tar") == ["b.txt"]
+
+
+def test_full_every_and_forced_full(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    make_tree(source, {"a.txt": "a"})
+    scan(state, str(source), 3, "tar")
+    commit(state)
+
+    modes = []
+    for _ in range(3):
+        modes.append(scan(state, str(source), 3, "tar"))
+        commit(state)
+    assert modes == ["incremental", "incremental", "full"]
+    assert scan(state, str(source), 0, "tar", force_full=True) == "full"
+
+
+def test_rclone_lists_skip_directories_and_keep_tombstones(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    make_tree(source, {"keep.txt": "k", "dir/gone.txt": "g", "later.txt": "l"})
+    scan(state, str(source), 0, "rclone")
+    commit(state)
+    assert read_list(state, CHANGED_FILE["rclone"], "rclone") == ["dir/gone.txt", "keep.txt", "later.txt"]
+    assert not (state / TOMBSTONE_FILE).exists()
+
+    (source / "dir" / "gone.txt").unlink()
+    scan(state, str(source), 0, "rclone")
+    commit(state)
+    assert read_list(state, DELETED_FILE["rclone"], "rclone") == ["dir/gone.txt"]
+    assert read_list(state, TOMBSTONE_FILE, "rclone") == ["dir/gone.txt"]
+
+    # Tombstones accumulate across runs; the file is only rewritten when they change
+    (source / "later.txt").unlink()
+    scan(state, str(source), 0, "rclone")
+    commit(state)
+    assert load_index(state)["tombstones"] == ["dir/gone.txt", "later.txt"]
+    assert read_list(state, TOMBSTONE_FILE, "rclone") == ["dir/gone.txt", "later.txt"]
+
+    scan(state, str(source), 0, "rclone")
+    assert not (state / TOMBSTONE_FILE).exists()
+    commit(state)
+
+    # A re-created path is no longer a tombstone
+    (source / "later.txt").write_text("back")
+    scan(state, str(source), 0, "rclone")
+    assert load_index(state, PENDING_FILE)["tombstones"] == ["dir/gone.txt"]
+
+
+def test_filtered_entries_stay_out_of_the_index(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    make_tree(source, {"keep.txt": "k", "debug.log": "d", "cache/x.bin": "x"})
+    scan(state, str(source), 0, "rclone", rules={"exclude": ["*.log", "cache/"]})
+    commit(state)
+    assert sorted(load_index(state)["files"]) == ["keep.txt"]
+
+    # Newly excluded entries count as deleted
+    scan(state, str(source), 0, "rclone", rules={"exclude": ["*.log", "cache/", "keep.txt"]})
+    assert read_list(state, DELETED_FILE["rclone"], "rclone") == ["keep.txt"]
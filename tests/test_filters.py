@@ -0,0 +1,117 @@
+import os
+import stat
+import time
+
+import pytest
+
+from pipeline.filters import (
+    BY_IGNORE_FILE, BY_LIMIT, BY_RULE, FilterRules, RuleSet, compile_rules, parse_pattern, rclone_limit_args,
+    rclone_rules, walk_included
+)
+
+
+def _rule_set(*lines):
+    return RuleSet("", [pattern for pattern in map(parse_pattern, lines) if pattern])
+
+
+@pytest.mark.parametrize("lines, path, is_dir, expected", [
+    (["*.log"], "a/b/debug.log", False, True),
+    (["*.log", "!keep.log"], "a/keep.log", False, False),
+    (["!keep.log", "*.log"], "a/keep.log", False, True),
+    (["build/"], "proj/build", True, True),
+    (["build/"], "proj/build", False, None),
+    (["/build"], "proj/build", True, None),
+    (["docs/*.md"], "docs/a.md", False, True),
+    (["docs/*.md"], "x/docs/a.md", False, None),
+    (["**/cache"], "a/b/cache", True, True),
+    (["data/**"], "data/x/y", False, True),
+    (["data/**"], "data", True, None),
+    (["file[0-9].txt"], "file7.txt", False, True),
+    (["file[!0-9].txt"], "file7.txt", False, None),
+    (["\\#notes"], "#notes", False, True),
+    (["# comment", ""], "comment", False, None),
+])
+def test_gitignore_patterns(lines, path, is_dir, expected):
+    assert _rule_set(*lines).match(path, is_dir) == expected
+
+
+def _write(path, content="x", mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def tree(tmp_path):
+    source = str(tmp_path)
+    _write(f"{source}/app/node_modules/dep/index.js")
+    _write(f"{source}/app/src/main.js")
+    _write(f"{source}/app/src/debug.log")
+    _write(f"{source}/app/src/important.log")
+    _write(f"{source}/proj/.gitignore", "build/\n*.tmp\n!keep.tmp\n")
+    _write(f"{source}/proj/build/out.bin")
+    _write(f"{source}/proj/lib/a.tmp")
+    _write(f"{source}/proj/lib/keep.tmp")
+    _write(f"{source}/vm/disk.img", "x" * 4096)
+    _write(f"{source}/old.txt", mtime=time.time() - 400 * 86400)
+    return source
+
+
+RULES = {
+    "exclude": ["node_modules/", "*.log"],
+    "include": ["important.log"],
+    "max_size": "1K",
+    "max_age": "365d",
+    "ignore_file": ".gitignore",
+}
+
+
+def test_walk_included(tree):
+    files = sorted(path for path, st in walk_included(tree, FilterRules(RULES)) if not stat.S_ISDIR(st.st_mode))
+    assert files == ["app/src/important.log", "app/src/main.js", "proj/.gitignore", "proj/lib/keep.tmp"]
+
+
+def test_compile_rules_reports_why(tree):
+    reasons = {path: reason for path, st, reason in compile_rules(tree, FilterRules(RULES))}
+    assert reasons == {
+        "app/node_modules": BY_RULE,
+        "app/src/debug.log": BY_RULE,
+        "proj/build": BY_IGNORE_FILE,
+        "proj/lib/a.tmp": BY_IGNORE_FILE,
+        "vm/disk.img": BY_LIMIT,
+        "old.txt": BY_LIMIT,
+    }
+
+
+def test_excludes_path_checks_parent_directories(tree):
+    rules = FilterRules(RULES)
+    path = "app/node_modules/dep/index.js"
+    assert rules.excludes_path(path, os.lstat(f"{tree}/{path}"))
+    assert not rules.excludes_path("app/src/main.js", os.lstat(f"{tree}/app/src/main.js"))
+
+
+def test_rclone_rules_put_later_globs_and_includes_first():
+    assert rclone_rules(RULES) == [
+        "+ important.log", "+ important.log/**",
+        "- *.log", "- *.log/**",
+        "- node_modules/**",
+    ]
+
+
+def test_rclone_rules_translate_glob_syntax():
+    rules = {"exclude": ["/build", "docs/*.md", "**/cache/", "{a,b}.txt", "file[!0-9]", "!keep.md"]}
+    assert rclone_rules(rules) == [
+        "+ keep.md", "+ keep.md/**",
+        "- file[^0-9]", "- file[^0-9]/**",
+        "- \\{a,b\\}.txt", "- \\{a,b\\}.txt/**",
+        "- cache/**",
+        "- /docs/*.md", "- /docs/*.md/**",
+        "- /build", "- /build/**",
+    ]
+
+
+def test_rclone_limit_args():
+    assert rclone_limit_args(RULES) == ["--max-size", "1024B", "--max-age", "31536000s"]
+    assert rclone_limit_args({"exclude": ["*.tmp"]}) == []
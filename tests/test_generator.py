@@ -0,0 +1,234 @@
+import shutil
+import subprocess
+
+import pytest
+
+import scripts.generator as generator
+from config.constants import DEFAULT_BACKUP_FLAGS, JOB_DEFAULTS
+
+
+@pytest.fixture
+def script_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(generator, "SCRIPT_DIR", tmp_path / "scripts")
+    monkeypatch.setattr(generator, "TEMP_DIR", tmp_path / "tmp")
+    monkeypatch.setattr(generator, "STATE_DIR", tmp_path / "state")
+    return tmp_path / "scripts"
+
+
+def make_job(**options):
+    job = dict(JOB_DEFAULTS, type="backup", source_dir="/data", destination="remote:backup",
+               compression_level=6, cores=2, rclone_flags={"--transfers": "4"})
+    job.update(options)
+    return job
+
+
+def check_syntax(path):
+    if shutil.which("bash"):
+        subprocess.run(["bash", "-n", str(path)], check=True)
+
+
+def backup_script(**options):
+    path = generator.generate_backup_script({"job": make_job(**options)}, "job")
+    check_syntax(path)
+    return path.read_text()
+
+
+def transfer_script(**options):
+    job = dict(JOB_DEFAULTS, type="transfer", source="local:/data", destination="remote:copy",
+               rclone_flags={"--transfers": "4"})
+    job.update(options)
+    path = generator.generate_transfer_script({"job": job}, "job")
+    check_syntax(path)
+    return path.read_text()
+
+
+def restore_script(paths=None, stream=False, **options):
+    path = generator.generate_restore_script({"job": make_job(**options)}, "job", paths, stream)
+    check_syntax(path)
+    return path.read_text()
+
+
+def test_incremental_backup_scans_and_commits_the_index(script_dir):
+    text = backup_script(compress=True, incremental=True, full_every=5)
+    assert "python3 -m pipeline.file_index scan" in text
+    assert "--full-every 5 --format tar" in text
+    assert "REMOTE_DIR=\"$REMOTE_DIR/incr/$RUN_ID\"" in text
+    # The index is promoted last, after the upload succeeded
+    assert text.index("pipeline.file_index commit") > text.index("rclone copyto \"$STATE_DIR/deleted.lst\"")
+
+
+def test_incremental_plain_copy_records_tombstones(script_dir):
+    text = backup_script(incremental=True)
+    assert "--format rclone" in text
+    assert "tombstones.txt" in text
+    assert "pipeline.file_index commit" in text
+
+
+def test_plain_copy_restore_applies_tombstones(script_dir):
+    text = restore_script(incremental=True)
+    assert "tombstones.txt" in text and "xargs -0 -r rm -f --" in text
+    assert "tombstones.txt" not in restore_script()
+
+
+def test_incremental_compressed_restore_replays_the_chain(script_dir):
+    text = restore_script(compress=True, incremental=True)
+    assert "incr/" in text
+    assert "backup.manifest.json" in text
+
+
+def test_dedup_backup_and_restore_use_the_chunk_store(script_dir):
+    text = backup_script(compress=True, dedup=True, compression_level=12, incremental=True)
+    assert "python3 -m pipeline.chunkstore backup" in text
+    # zlib levels stop at 9; dedup jobs keep their own chain instead of the file index
+    assert "--level 9" in text
+    assert "pipeline.file_index" not in text
+    assert "python3 -m pipeline.chunkstore restore" in restore_script(compress=True, dedup=True)
+
+
+def test_each_run_claims_its_own_work_dir(script_dir, tmp_path):
+    text = backup_script(compress=True)
+    assert f"WORK_DIR=\"{tmp_path / 'tmp'}/job/$RUN_ID-$$\"" in text
+    assert "python3 -m pipeline.workdir sweep" in text
+    assert "python3 -m pipeline.workdir claim \"$WORK_DIR\" --pid $$" in text
+    assert text.rstrip().endswith("rm -rf \"$WORK_DIR\"")
+
+
+def test_runner_overrides_cores_and_transfers(script_dir):
+    text = backup_script(compress=True, cores=3)
+    assert "${BB_CORES:-3}" in text
+    assert "--transfers ${BB_TRANSFERS:-4}" in text
+
+
+def test_auto_cores_are_sized_at_run_time(script_dir):
+    text = backup_script(compress=True, cores="auto", rclone_flags=dict(DEFAULT_BACKUP_FLAGS))
+    assert "python3 -m pipeline.cpu" in text
+    assert "AUTO_CORES=4" in text
+    assert "${BB_CORES:-$AUTO_CORES}" in text
+    assert "--checkers $AUTO_CHECKERS" in text
+
+    # A --checkers value changed from the default is kept
+    assert "--checkers 3" in backup_script(compress=True, cores="auto", rclone_flags={"--checkers": "3"})
+
+
+def test_content_index_is_written_and_used_for_selective_restore(script_dir):
+    text = backup_script(compress=True, content_index=True, split_files=True, split_size="100M")
+    assert "python3 -m pipeline.indexed pack" in text and "--part-size 100M" in text
+    assert "backup.index.gz" in text
+
+    text = restore_script(["docs/a b.txt"], compress=True, content_index=True)
+    assert "python3 -m pipeline.indexed extract" in text
+    assert "--path 'docs/a b.txt'" in text
+    # Without the index a path restore falls back to the full archive
+    assert "pipeline.indexed" not in restore_script(["docs"], compress=True)
+
+
+def test_restores_download_in_parallel_without_backup_pacing(script_dir):
+    flags = dict(DEFAULT_BACKUP_FLAGS, **{"--bwlimit": "10M"})
+    text = restore_script(compress=True, split_files=True, restore_workers=6, rclone_flags=flags)
+    assert "python3 -m pipeline.fetch download" in text and "--parts --workers 6" in text
+    assert "--tpslimit" not in text
+    assert "--transfers ${BB_TRANSFERS:-6}" in text and "--bwlimit ${BB_BWLIMIT:-10M}" in text
+
+    text = restore_script(stream=True, compress=True, restore_workers=3)
+    assert "python3 -m pipeline.fetch stream" in text and "--workers 3" in text
+
+
+def test_restore_resumes_into_its_own_cache(script_dir, tmp_path):
+    text = restore_script(compress=True)
+    assert f"CACHE_DIR=\"{tmp_path / 'tmp'}/job/restore-cache-$RUN_ID-$$\"" in text
+    assert "python3 -m pipeline.workdir adopt \"$CACHE_DIR\" --pid $$ --prefix restore-cache" in text
+    assert text.index("pipeline.fetch download") < text.index("rm -rf \"$CACHE_DIR\"")
+
+
+def test_compressed_backups_are_hashed_inline_and_verified(script_dir):
+    text = backup_script(compress=True, rclone_flags={"--progress": "", "--transfers": "2"})
+    assert "python3 -m pipeline.manifest tee --name backup.tar.gz" in text
+    verify_line = next(line for line in text.splitlines() if "pipeline.manifest verify" in line)
+    assert "--progress" not in verify_line
+
+
+def test_snapshot_jobs_upload_each_run_to_its_own_snapshot(script_dir):
+    text = backup_script(compress=True, snapshots=True, keep_daily=3, keep_weekly=2, keep_monthly=1)
+    assert "SNAPSHOT_ROOT=\"remote:backup/snapshots\"" in text
+    assert "REMOTE_DIR=\"$SNAPSHOT_ROOT/$SNAPSHOT\"" in text
+    assert "--keep-daily 3 --keep-weekly 2 --keep-monthly 1" in text
+    # The catalog only lists verified snapshots
+    assert text.index("pipeline.manifest verify") < text.index("pipeline.snapshots commit")
+
+
+def test_incremental_snapshot_runs_continue_the_newest_chain(script_dir):
+    text = backup_script(compress=True, snapshots=True, incremental=True)
+    assert "python3 -m pipeline.snapshots latest" in text
+    assert "[ -n \"$CHAIN\" ] || SCAN_ARGS=\"--full\"" in text
+    # Old chains belong to retention, not to the next full run
+    assert "rclone purge" not in text
+
+
+def test_compressed_jobs_compile_filters_for_tar(script_dir):
+    text = backup_script(compress=True, filters={"exclude": ["*.log"]})
+    assert "python3 -m pipeline.filters compile --source /data" in text
+    assert "--anchored --no-wildcards --exclude-from \"$WORK_DIR/filters/" in text
+    assert "pipeline.filters compile" not in backup_script(compress=True)
+
+
+def test_plain_copies_let_rclone_apply_filters(script_dir):
+    text = backup_script(incremental=True, filters={"exclude": ["*.log"], "max_size": "1M", "max_age": "2d"})
+    assert "python3 -m pipeline.filters rclone" in text
+    assert "pipeline.filters compile" not in text
+    assert "--filter-from \"$WORK_DIR/filters/" in text
+    assert "--max-size 1048576B --max-age 172800s" in text
+    # The file index checks the rules itself instead of reading a compiled list
+    assert "pipeline.file_index scan" in text and "--rules '{\"exclude\"" in text
+
+
+def test_prescan_runs_only_when_its_size_is_used(script_dir):
+    # Staged archives check the free space; pv uses the size for its ETA
+    assert "--staging-dir \"$WORK_DIR\"" in backup_script(compress=True)
+    text = backup_script(compress=True, stream_upload=True, rclone_flags={"--progress": ""})
+    assert "pipeline.prescan scan" in text and "--staging-dir" not in text
+    assert "-s $SOURCE_BYTES" in text
+
+    assert "pipeline.prescan" not in backup_script(compress=True, stream_upload=True)
+    assert "pipeline.prescan" not in backup_script(compress=True, incremental=True, rclone_flags={"--progress": ""})
+    assert "pipeline.prescan" not in backup_script()
+
+
+def test_watched_jobs_start_the_watcher_and_use_its_journal(script_dir):
+    text = backup_script(compress=True, incremental=True, watch=True)
+    assert "python3 -m pipeline.watch start" in text
+    assert "--format tar --watch" in text
+    # Sharded and dedup jobs do not use the file index, so they never watch
+    assert "pipeline.watch" not in backup_script(compress=True, incremental=True, watch=True, shards=4)
+
+
+def test_watched_transfers_copy_the_journaled_files(script_dir):
+    text = transfer_script(watch=True)
+    assert "python3 -m pipeline.watch take" in text
+    assert "--files-from-raw \"$STATE_DIR/watch_changed.txt\" --no-traverse" in text
+    # The journal is only dropped after the copy succeeded
+    assert text.index("rclone copy local:/data remote:copy --files-from-raw") < text.index("pipeline.watch release")
+
+
+def test_bundling_jobs_leave_small_files_to_the_bundles(script_dir):
+    text = backup_script(bundle=True, bundle_threshold="256K", bundle_size="32M")
+    assert "--min-size 262144B" in text
+    assert "python3 -m pipeline.bundle pack" in text and "--threshold 256K --size 32M" in text
+
+    text = restore_script(bundle=True)
+    assert "python3 -m pipeline.bundle unpack" in text
+    # Bookkeeping data at the top of the destination is not restored into the source
+    assert "--exclude \"/.backupbuddy/**\"" in text
+
+    text = transfer_script(bundle=True)
+    assert "--min-size 1048576B" in text and "pipeline.bundle pack" in text
+
+
+def test_topup_transfers_plan_from_the_run_history(script_dir):
+    text = transfer_script(topup=True, full_every=10)
+    assert "python3 -m pipeline.history plan" in text and "--full-every 10" in text
+    assert "--max-age \"$MAX_AGE\" --no-traverse" in text
+    # The run is recorded with the start time taken before copying
+    assert text.index("RUN_START=$(date +%s)") < text.index("rclone copy")
+    assert "--started \"$RUN_START\" --mode \"${TRANSFER_MODE:-full}\"" in text
+
+    assert "--max-age" not in transfer_script()
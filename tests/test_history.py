@@ -0,0 +1,39 @@
+from pipeline.history import FULL, KEEP_RUNS, TOPUP, WATERMARK_SLACK, load_history, plan, record
+
+
+def test_first_run_is_full(tmp_path):
+    assert plan(tmp_path, "/src", "r:dst", 0) == FULL
+
+
+def test_topup_reaches_back_to_the_last_start(tmp_path):
+    record(tmp_path, "/src", "r:dst", 1000, FULL)
+    assert plan(tmp_path, "/src", "r:dst", 0, now=1500) == f"{TOPUP} {500 + WATERMARK_SLACK}s"
+
+
+def test_changed_source_or_destination_runs_full(tmp_path):
+    record(tmp_path, "/src", "r:dst", 1000, FULL)
+    assert plan(tmp_path, "/other", "r:dst", 0, now=1500) == FULL
+    assert plan(tmp_path, "/src", "r:other", 0, now=1500) == FULL
+
+    history = record(tmp_path, "/src", "r:other", 2000, FULL)
+    assert [run["started"] for run in history["runs"]] == [2000]
+
+
+def test_full_every_counts_topups(tmp_path):
+    record(tmp_path, "/src", "r:dst", 1000, FULL)
+    assert plan(tmp_path, "/src", "r:dst", 3, now=1100).startswith(TOPUP)
+    record(tmp_path, "/src", "r:dst", 1100, TOPUP)
+    assert plan(tmp_path, "/src", "r:dst", 3, now=1200).startswith(TOPUP)
+    record(tmp_path, "/src", "r:dst", 1200, TOPUP)
+    assert plan(tmp_path, "/src", "r:dst", 3, now=1300) == FULL
+
+    record(tmp_path, "/src", "r:dst", 1300, FULL)
+    assert load_history(tmp_path)["topups_since_full"] == 0
+
+
+def test_history_is_capped(tmp_path):
+    for started in range(KEEP_RUNS + 5):
+        record(tmp_path, "/src", "r:dst", started, TOPUP)
+    runs = load_history(tmp_path)["runs"]
+    assert len(runs) == KEEP_RUNS
+    assert runs[-1]["started"] == KEEP_RUNS + 4
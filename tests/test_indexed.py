@@ -0,0 +1,131 @@
+import gzip
+import io
+import json
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+import pipeline.indexed as indexed
+import pipeline.prefetch as prefetch
+from pipeline.codecs import GZIP, ZSTD
+from pipeline.indexed import INDEX_FILE, TarIndexer, normalize, pack, plan_reads, select_entries
+
+LONG_NAME = "deep/" + "x" * 120 + ".txt"
+
+
+def make_tar(format=tarfile.GNU_FORMAT):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w", format=format) as tar:
+        for name, data in [("docs/a.txt", b"a" * 3000), ("docs/b.txt", b"b" * 700),
+                           (LONG_NAME, b"long"), ("top.bin", bytes(range(256)) * 100)]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        link = tarfile.TarInfo("docs/link")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "a.txt"
+        tar.addfile(link)
+    return buffer.getvalue()
+
+
+def read_index(path):
+    with gzip.open(path, "rt") as file:
+        lines = [json.loads(line) for line in file]
+    header = lines[0]
+    return header, lines[1:header["frames"] + 1], lines[header["frames"] + 1:]
+
+
+@pytest.mark.parametrize("format", [tarfile.GNU_FORMAT, tarfile.PAX_FORMAT])
+def test_indexer_records_entry_ranges(format):
+    data = make_tar(format)
+    indexer = TarIndexer()
+    for position in range(0, len(data), 777):
+        indexer.feed(data[position:position + 777])
+
+    paths = [entry["path"] for entry in indexer.entries]
+    assert paths == ["docs/a.txt", "docs/b.txt", LONG_NAME, "top.bin", "docs/link"]
+    for entry in indexer.entries:
+        # Each range is a complete tar member, long-name headers included
+        with tarfile.open(fileobj=io.BytesIO(data[entry["start"]:entry["start"] + entry["length"]])) as tar:
+            assert normalize(tar.getnames()[0]) == entry["path"]
+    assert indexer.entries[-1]["size"] == 0
+
+
+def test_pack_writes_frames_and_index(tmp_path):
+    data = make_tar()
+    output = io.BytesIO()
+    header = pack(io.BytesIO(data), output, tmp_path / INDEX_FILE, GZIP, 6, 2, archive="backup.tar.gz",
+                  frame_size=4096)
+
+    # Concatenated gzip members are still one regular .tar.gz
+    assert gzip.decompress(output.getvalue()) == data
+    saved_header, frames, entries = read_index(tmp_path / INDEX_FILE)
+    assert saved_header == header
+    assert header["tar_bytes"] == len(data) and header["compressed_bytes"] == len(output.getvalue())
+    assert len(frames) == header["frames"] == -(-len(data) // 4096)
+    assert [frame["tar_offset"] for frame in frames] == list(range(0, len(data), 4096))
+    assert len(entries) == 5
+
+
+def test_pack_maps_frames_to_parts(tmp_path):
+    header = pack(io.BytesIO(make_tar()), io.BytesIO(), tmp_path / INDEX_FILE, GZIP, 1, 1,
+                  part_size=1000, frame_size=2048)
+    _, frames, _ = read_index(tmp_path / INDEX_FILE)
+    assert header["part_size"] == 1000
+    assert all(frame["part"] * 1000 + frame["part_offset"] == frame["offset"] for frame in frames)
+
+
+def test_select_entries():
+    entries = [{"path": path} for path in ("docs", "docs/a.txt", "docsx/b.txt", "top.bin")]
+    assert [entry["path"] for entry in select_entries(entries, ["./docs/"])] == ["docs", "docs/a.txt"]
+    assert select_entries(entries, ["/"]) == entries
+    assert select_entries(entries, ["missing"]) == []
+
+
+def test_plan_reads_merges_neighbouring_frames():
+    frames = [{"tar_offset": offset} for offset in (0, 100, 200, 300, 400)]
+    entries = [
+        {"start": 10, "length": 50},
+        {"start": 60, "length": 60},
+        {"start": 410, "length": 20},
+    ]
+    assert plan_reads(frames, entries) == [(0, 1, [(10, 120)]), (4, 4, [(410, 430)])]
+
+
+def fake_rclone(args, flags="", capture_output=False):
+    """`rclone cat [--offset N --count M] <path>` for remotes that are local directories."""
+    offset, count = 0, -1
+    if "--offset" in args:
+        offset, count = int(args[args.index("--offset") + 1]), int(args[args.index("--count") + 1])
+    with open(args[-1], "rb") as file:
+        file.seek(offset)
+        return subprocess.CompletedProcess(args, 0, stdout=file.read(count))
+
+
+@pytest.mark.skipif(not shutil.which("zstd"), reason="zstd is not installed")
+def test_extract_fetches_only_the_selected_entries(tmp_path, monkeypatch):
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    with open(remote / "backup.tar.zst", "wb") as output:
+        pack(io.BytesIO(make_tar()), output, remote / INDEX_FILE, ZSTD, 3, 2, archive="backup.tar.zst",
+             frame_size=2048)
+
+    reads = []
+
+    def recording_rclone(args, flags="", capture_output=False):
+        reads.append(args)
+        return fake_rclone(args, flags, capture_output)
+
+    monkeypatch.setattr(indexed, "run_rclone", fake_rclone)
+    monkeypatch.setattr(prefetch, "run_rclone", recording_rclone)
+
+    target = tmp_path / "restore"
+    assert indexed.extract(str(remote), str(target), ["docs/b.txt"], workers=2) == 1
+    assert (target / "docs" / "b.txt").read_bytes() == b"b" * 700
+    assert not (target / "docs" / "a.txt").exists()
+    fetched = sum(int(args[args.index("--count") + 1]) for args in reads)
+    assert fetched < (remote / "backup.tar.zst").stat().st_size
+
+    assert indexed.extract(str(remote), str(target), ["missing"]) == 0
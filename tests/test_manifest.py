@@ -0,0 +1,72 @@
+import hashlib
+import io
+import json
+import subprocess
+
+import pytest
+
+import pipeline.manifest as manifest
+from pipeline.manifest import MANIFEST_FILE, build_manifest, tee, verify
+
+
+def test_tee_copies_and_hashes(tmp_path):
+    data = b"archive bytes" * 100000
+    output = io.BytesIO()
+    result = tee(io.BytesIO(data), output, "backup.tar.gz", tmp_path / MANIFEST_FILE)
+
+    assert output.getvalue() == data
+    assert json.loads((tmp_path / MANIFEST_FILE).read_text()) == result
+    entry = result["files"][0]
+    assert entry["name"] == "backup.tar.gz" and entry["size"] == len(data)
+    assert entry["md5"] == hashlib.md5(data).hexdigest()
+    assert entry["sha1"] == hashlib.sha1(data).hexdigest()
+    assert result["archive"] == {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def test_build_manifest_orders_parts():
+    files = [{"name": "backup-part-001", "size": 2, "sha256": "b"}, {"name": "backup-part-000", "size": 3, "sha256": "a"}]
+    result = build_manifest(files, archive_sha256="whole")
+    assert [item["name"] for item in result["files"]] == ["backup-part-000", "backup-part-001"]
+    assert result["archive"] == {"size": 5, "sha256": "whole"}
+
+
+def serve(monkeypatch, stored, listing):
+    def run_rclone(args, flags="", capture_output=False):
+        if args[0] == "cat":
+            if stored is None:
+                raise subprocess.CalledProcessError(3, "rclone")
+            return subprocess.CompletedProcess(args, 0, stdout=json.dumps(stored).encode())
+        assert args[:3] == ["lsjson", "--files-only", "--hash"]
+        return subprocess.CompletedProcess(args, 0, stdout=json.dumps(listing).encode())
+    monkeypatch.setattr(manifest, "run_rclone", run_rclone)
+
+
+STORED = build_manifest([
+    {"name": "backup-part-000", "size": 10, "md5": "aa", "sha1": "bb", "sha256": "cc"},
+    {"name": "backup-part-001", "size": 5, "md5": "dd", "sha1": "ee", "sha256": "ff"},
+], archive_sha256="whole")
+
+
+def test_verify_uses_the_hashes_the_remote_reports(monkeypatch, capsys):
+    serve(monkeypatch, STORED, [
+        {"Name": "backup-part-000", "Size": 10, "Hashes": {"MD5": "AA"}},
+        {"Name": "backup-part-001", "Size": 5, "Hashes": {"MD5": "dd", "SHA-1": ""}},
+        {"Name": MANIFEST_FILE, "Size": 100},
+    ])
+    assert verify("r:backup") == []
+    assert "size, md5" in capsys.readouterr().err
+
+
+def test_verify_reports_missing_resized_and_damaged_files(monkeypatch):
+    serve(monkeypatch, STORED, [{"Name": "backup-part-000", "Size": 10, "Hashes": {"sha1": "00"}}])
+    assert verify("r:backup") == ["backup-part-000: sha1 mismatch", "backup-part-001: missing"]
+
+    serve(monkeypatch, STORED, [{"Name": "backup-part-000", "Size": 9}, {"Name": "backup-part-001", "Size": 5}])
+    assert verify("r:backup") == ["backup-part-000: size 9, expected 10"]
+
+
+def test_verify_without_manifest(monkeypatch):
+    serve(monkeypatch, None, [])
+    with pytest.raises(FileNotFoundError):
+        verify("r:backup")
+    assert manifest.main(["verify", "--remote", "r:backup"]) == 1
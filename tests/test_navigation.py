@@ -0,0 +1,96 @@
+import threading
+import time
+
+from core.navigation import RemoteListingCache
+
+
+class CountingCache(RemoteListingCache):
+    """Lists every path as one child directory and records how many listings overlap."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = []
+        self.running = 0
+        self.peak = 0
+        self.gate = threading.Event()
+        self._count_lock = threading.Lock()
+
+    def _fetch(self, path):
+        with self._count_lock:
+            self.calls.append(path)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        self.gate.wait(5)
+        with self._count_lock:
+            self.running -= 1
+        return [f"{path}-child"]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_list_dirs_is_cached():
+    cache = CountingCache()
+    cache.gate.set()
+    assert cache.list_dirs("r:a/b") == ["r:a/b-child"]
+    assert cache.list_dirs("r:/a/b/") == ["r:a/b-child"]
+    assert cache.calls == ["r:a/b"]
+
+    cache.invalidate("r:a/b")
+    cache.list_dirs("r:a/b")
+    assert len(cache.calls) == 2
+
+
+def test_expired_listing_is_fetched_again():
+    cache = CountingCache(ttl=0)
+    cache.gate.set()
+    cache.list_dirs("r:a")
+    cache.list_dirs("r:a")
+    assert len(cache.calls) == 2
+
+
+def test_prefetch_uses_a_fixed_pool():
+    cache = CountingCache(workers=2)
+    threads_before = threading.active_count()
+    cache.prefetch([f"r:d{i}" for i in range(10)])
+
+    wait_for(lambda: cache.running == 2)
+    time.sleep(0.05)
+    assert cache.peak == 2
+    assert threading.active_count() - threads_before == 2
+
+    cache.gate.set()
+    wait_for(lambda: len(cache.calls) == 10 and cache.running == 0)
+    assert cache.peak == 2
+    assert cache.list_dirs("r:d9") == ["r:d9-child"]
+    assert len(cache.calls) == 10
+
+
+def test_prefetch_drops_requests_from_an_earlier_screen():
+    cache = CountingCache(workers=1)
+    cache.prefetch(["r:old1", "r:old2", "r:old3"])
+    wait_for(lambda: cache.running == 1)
+
+    cache.prefetch(["r:new"])
+    cache.gate.set()
+    wait_for(lambda: "r:new" in cache.calls and cache.running == 0)
+    assert cache.calls == ["r:old1", "r:new"]
+
+
+def test_foreground_listing_waits_for_prefetch():
+    cache = CountingCache(workers=1)
+    cache.prefetch(["r:a"])
+    wait_for(lambda: cache.running == 1)
+
+    result = []
+    reader = threading.Thread(target=lambda: result.append(cache.list_dirs("r:a")))
+    reader.start()
+    time.sleep(0.05)
+    cache.gate.set()
+    reader.join(5)
+    assert result == [["r:a-child"]]
+    assert cache.calls == ["r:a"]
@@ -0,0 +1,63 @@
+import subprocess
+import threading
+import time
+
+import pytest
+
+import pipeline.prefetch as prefetch
+from pipeline.prefetch import PrefetchReader, segments
+
+
+def test_segments_split_long_reads():
+    assert segments([("a", 0, 25), ("b", 5, 10)], segment_size=10) == [
+        ("a", 0, 10), ("a", 10, 10), ("a", 20, 5), ("b", 5, 10),
+    ]
+
+
+def serve(monkeypatch, files, delays=None, failures=None):
+    """Answer `rclone cat --offset/--count` from in-memory files; record the calls."""
+    calls = []
+    lock = threading.Lock()
+
+    def run_rclone(args, flags="", capture_output=False):
+        offset, count, source = int(args[2]), int(args[4]), args[5]
+        with lock:
+            calls.append((source, offset, count, flags))
+            failing = failures and failures.get((source, offset), 0) > 0
+            if failing:
+                failures[(source, offset)] -= 1
+        time.sleep((delays or {}).get((source, offset), 0))
+        if failing:
+            raise subprocess.CalledProcessError(1, "rclone", stderr=b"connection reset")
+        return subprocess.CompletedProcess(args, 0, stdout=files[source][offset:offset + count])
+
+    monkeypatch.setattr(prefetch, "run_rclone", run_rclone)
+    return calls
+
+
+def test_segments_are_yielded_in_order(monkeypatch):
+    files = {"r:part-0": bytes(range(250)), "r:part-1": b"tail"}
+    # The first segment is the slowest, so later ones finish before it
+    serve(monkeypatch, files, delays={("r:part-0", 0): 0.1})
+    reader = PrefetchReader([("r:part-0", 0, 250), ("r:part-1", 0, 4)], workers=3, segment_size=64)
+    assert b"".join(reader) == files["r:part-0"] + b"tail"
+
+
+def test_failed_segments_are_retried(monkeypatch, capsys):
+    files = {"r:archive": b"x" * 100}
+    calls = serve(monkeypatch, files, failures={("r:archive", 50): 1})
+    assert b"".join(PrefetchReader([("r:archive", 0, 100)], workers=2, segment_size=50)) == files["r:archive"]
+    assert len(calls) == 3
+    assert "connection reset" in capsys.readouterr().err
+
+
+def test_short_reads_fail_after_retries(monkeypatch):
+    serve(monkeypatch, {"r:archive": b"short"})
+    with pytest.raises(OSError, match="short read"):
+        b"".join(PrefetchReader([("r:archive", 0, 100)], workers=1))
+
+
+def test_bandwidth_is_shared_between_workers(monkeypatch):
+    calls = serve(monkeypatch, {"r:archive": b"x" * 10})
+    list(PrefetchReader([("r:archive", 0, 10)], workers=4, rclone_flags="--bwlimit 8M"))
+    assert calls[0][3] == "--bwlimit 2048K"
@@ -0,0 +1,65 @@
+import os
+import time
+
+from pipeline.prescan import load_cache, main, scan
+
+
+def make_tree(root, files, age=3600):
+    for rel_path, size in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+    # Directories modified just now are not cached; age the tree
+    old = time.time() - age
+    for directory, _, _ in os.walk(root):
+        os.utime(directory, (old, old))
+
+
+FILES = {"small.txt": 100, "media/a.bin": 100000, "media/b.bin": 2 * 1024 ** 2, "docs/c.txt": 5000}
+
+
+def test_scan_totals(tmp_path):
+    make_tree(tmp_path / "src", FILES)
+    summary = scan(str(tmp_path / "src"), tmp_path / "state", workers=2)
+
+    assert summary["total_bytes"] == sum(FILES.values())
+    assert summary["files"] == 4 and summary["dirs"] == 3
+    assert summary["histogram"] == {"<4K": 1, "4K-64K": 1, "64K-1M": 1, "1M-16M": 1, "16M-256M": 0,
+                                    "256M-4G": 0, ">=4G": 0}
+    assert summary["largest_dirs"][0] == ["media", 100000 + 2 * 1024 ** 2]
+
+
+def test_unchanged_directories_come_from_the_cache(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    make_tree(source, FILES)
+    assert scan(str(source), state)["cached_dirs"] == 0
+    assert scan(str(source), state)["cached_dirs"] == 3
+
+    (source / "docs" / "new.txt").write_bytes(b"y" * 10)
+    summary = scan(str(source), state)
+    assert summary["cached_dirs"] == 2
+    assert summary["total_bytes"] == sum(FILES.values()) + 10
+
+
+def test_recently_modified_directories_are_not_trusted(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    make_tree(source, FILES, age=0)
+    scan(str(source), state)
+    assert scan(str(source), state)["cached_dirs"] == 0
+
+
+def test_excluded_paths_and_their_cache(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    make_tree(source, FILES)
+    summary = scan(str(source), state, exclude=frozenset({"media"}))
+    assert summary["total_bytes"] == 5100
+    # A cache made with other filters is not reused
+    assert load_cache(state, str(source), frozenset()) == {}
+    assert load_cache(state, str(source), frozenset({"media"}))
+
+
+def test_cli_prints_the_total(tmp_path, capsys):
+    make_tree(tmp_path / "src", FILES)
+    assert main(["scan", "--source", str(tmp_path / "src"), "--state-dir", str(tmp_path / "state"),
+                 "--staging-dir", str(tmp_path)]) == 0
+    assert capsys.readouterr().out.strip() == str(sum(FILES.values()))
@@ -0,0 +1,77 @@
+import base64
+import hashlib
+import os
+import shutil
+import stat
+
+import pytest
+
+from utils import rclone_rc
+from utils.rclone_rc import RcError, RcloneDaemon
+
+
+def test_password_stays_off_the_command_line(monkeypatch):
+    seen = {}
+
+    class Exited:
+        def poll(self):
+            return 1
+
+        def wait(self, timeout=None):
+            return 1
+
+    def popen(command, **kwargs):
+        htpasswd = command[command.index("--rc-htpasswd") + 1]
+        seen.update(command=command, content=open(htpasswd).read(),
+                    file_mode=stat.S_IMODE(os.stat(htpasswd).st_mode),
+                    dir_mode=stat.S_IMODE(os.stat(os.path.dirname(htpasswd)).st_mode))
+        return Exited()
+
+    monkeypatch.setattr(rclone_rc.os, "geteuid", lambda: 1000)
+    monkeypatch.setattr(rclone_rc.secrets, "token_urlsafe", lambda size: "s3cret")
+    monkeypatch.setattr(rclone_rc.subprocess, "Popen", popen)
+
+    daemon = RcloneDaemon()
+    with pytest.raises(OSError):
+        daemon.start()
+
+    digest = base64.b64encode(hashlib.sha1(b"s3cret").digest()).decode()
+    assert not any("s3cret" in arg for arg in seen["command"])
+    assert seen["content"] == f"backupbuddy:{{SHA}}{digest}\n"
+    assert seen["file_mode"] == 0o600 and seen["dir_mode"] == 0o700
+    # The private directory is removed with the daemon
+    assert daemon._private_dir is None
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    if shutil.which("rclone") is None:
+        pytest.skip("rclone is not installed")
+    if os.geteuid() != 0:
+        pytest.skip("the daemon is started through sudo for non-root users")
+    config = tmp_path / "rclone.conf"
+    config.write_text("[bbtest]\ntype = local\n")
+    monkeypatch.setenv("RCLONE_CONFIG", str(config))
+
+    daemon = RcloneDaemon()
+    yield daemon.start()
+    daemon.stop()
+
+
+def test_list_remotes(client):
+    assert "bbtest:" in client.list_remotes()
+
+
+def test_mkdir_and_list_dirs(client, tmp_path):
+    root = tmp_path / "root"
+    (root / "with space").mkdir(parents=True)
+    (root / "file.txt").write_text("x")
+
+    client.mkdir(str(root / "made"))
+
+    assert sorted(client.list_dirs(str(root))) == ["made", "with space"]
+
+
+def test_errors_raise_rc_error(client, tmp_path):
+    with pytest.raises(RcError):
+        client.list_dirs(str(tmp_path / "missing"))
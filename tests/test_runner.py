@@ -0,0 +1,53 @@
+from jobs.runner import Budget, format_report, job_wants, transferred_bytes
+
+
+def test_budget_caps_each_job_at_an_equal_share():
+    budget = Budget(cores=8, transfers=8, bandwidth=0)
+    first = budget.take({"cores": 8, "transfers": 2, "bandwidth": 0}, slots=2)
+    assert first == {"cores": 4, "transfers": 2, "bandwidth": 0}
+    second = budget.take({"cores": 8, "transfers": 8, "bandwidth": 0}, slots=2)
+    assert second == {"cores": 4, "transfers": 4, "bandwidth": 0}
+    assert budget.take({"cores": 1, "transfers": 1, "bandwidth": 0}, slots=2) is None
+
+    budget.release(first)
+    assert budget.free == {"cores": 4, "transfers": 4, "bandwidth": 0}
+
+
+def test_budget_splits_bandwidth_only_when_limited():
+    budget = Budget(cores=4, transfers=4, bandwidth=1000)
+    grant = budget.take({"cores": 1, "transfers": 1, "bandwidth": 1000}, slots=4)
+    assert grant["bandwidth"] == 250
+    assert budget.free["bandwidth"] == 750
+
+
+def test_job_wants():
+    assert job_wants({"compress": True, "cores": 3, "rclone_flags": {"--transfers": "6"}}) == \
+        {"cores": 3, "transfers": 6, "bandwidth": 0}
+    # Plain copies and transfers do not run pigz
+    assert job_wants({"compress": False, "cores": 3})["cores"] == 1
+    assert job_wants({"type": "transfer", "compress": True, "cores": 3})["cores"] == 1
+    assert job_wants({"rclone_flags": {"--transfers": "many"}})["transfers"] == 4
+
+
+def test_transferred_bytes_reads_from_the_offset(tmp_path):
+    log = tmp_path / "rclone.log"
+    log.write_text("NOTICE: 1.000 GiB / 1.000 GiB, 100%, 10 MiB/s, ETA 0s\n")
+    offset = log.stat().st_size
+    with open(log, "a") as file:
+        file.write("NOTICE: 2.5 MiB / 2.5 MiB, 100%, 1 MiB/s, ETA 0s\n")
+        file.write("NOTICE: 512 B / 512 B, 100%, 0 B/s, ETA -\n")
+
+    assert transferred_bytes([(log, offset)]) == int(2.5 * 1024 ** 2) + 512
+    assert transferred_bytes([(log, log.stat().st_size)]) is None
+    assert transferred_bytes([(tmp_path / "missing.log", 0)]) is None
+
+
+def test_format_report_totals():
+    results = [
+        {"job_id": "a", "returncode": 0, "seconds": 2.0, "bytes": 4 * 1024 ** 2},
+        {"job_id": "b", "returncode": 1, "seconds": 1.0, "bytes": None},
+    ]
+    lines = format_report(results, 2.0)
+    assert "ok" in lines[1] and "2.0 MiB/s" in lines[1]
+    assert "failed" in lines[2]
+    assert lines[-1].startswith("TOTAL") and "4.0 MiB" in lines[-1]
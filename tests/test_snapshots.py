@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from pipeline.snapshots import RUN_ID_FORMAT, expired
+
+
+def _daily(days, start=datetime(2024, 1, 31, 2, 0)):
+    """One snapshot per day for `days` days, ending at `start`."""
+    snapshots = []
+    for offset in range(days):
+        run_id = (start - timedelta(days=offset)).strftime(RUN_ID_FORMAT)
+        snapshots.append({"id": run_id, "runs": [], "updated": run_id})
+    return snapshots
+
+
+def test_keeps_the_newest_daily_snapshots():
+    snapshots = _daily(10)
+    assert expired(snapshots, {"daily": 3}) == [snapshot["id"] for snapshot in snapshots[3:]]
+
+
+def test_weekly_and_monthly_keep_the_newest_of_each_period():
+    snapshots = _daily(70)
+    kept = set(snapshot["id"] for snapshot in snapshots) - set(expired(snapshots, {"weekly": 2, "monthly": 3}))
+
+    # Newest snapshot plus the newest of the last 2 ISO weeks and of the last 3 months
+    assert kept == {"20240131-020000", "20240128-020000", "20231231-020000", "20231130-020000"}
+
+
+def test_newest_snapshot_is_always_kept():
+    snapshots = _daily(5)
+    assert expired(snapshots, {}) == [snapshot["id"] for snapshot in snapshots[1:]]
+    assert expired([], {"daily": 7}) == []
+
+
+def test_updated_time_counts_not_creation():
+    snapshots = [
+        {"id": "20240101-020000", "runs": ["20240130-020000"], "updated": "20240130-020000"},
+        {"id": "20240120-020000", "runs": [], "updated": "20240120-020000"},
+    ]
+    assert expired(snapshots, {"daily": 1}) == ["20240120-020000"]
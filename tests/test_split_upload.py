@@ -0,0 +1,20 @@
+from pipeline.split_upload import part_suffix
+
+
+def test_part_suffix_matches_split():
+    # GNU split: aa..yz, then zaaa..zyzz, then zzaaaa...
+    assert part_suffix(0) == "aa"
+    assert part_suffix(1) == "ab"
+    assert part_suffix(26) == "ba"
+    assert part_suffix(649) == "yz"
+    assert part_suffix(650) == "zaaa"
+    assert part_suffix(675) == "zaaz"
+    assert part_suffix(999) == "zanl"
+    assert part_suffix(650 + 25 * 26 ** 2 - 1) == "zyzz"
+    assert part_suffix(650 + 25 * 26 ** 2) == "zzaaaa"
+
+
+def test_part_suffixes_sort_in_part_order():
+    suffixes = [part_suffix(index) for index in range(20000)]
+    assert len(set(suffixes)) == len(suffixes)
+    assert sorted(suffixes) == suffixes
@@ -0,0 +1,44 @@
+import pytest
+
+from pipeline.units import parse_age, parse_size
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("512", 512),
+    ("100B", 100),
+    ("1K", 1024),
+    ("1KB", 1000),
+    ("1KiB", 1024),
+    ("100M", 100 * 1024 ** 2),
+    ("2mb", 2 * 1000 ** 2),
+    (" 1 G ", 1024 ** 3),
+    ("1T", 1024 ** 4),
+])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "M", "1.5G", "-1K", "10X", "1 K B"])
+def test_parse_size_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_size(value)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("30", 30 * 86400),
+    ("30d", 30 * 86400),
+    ("45s", 45),
+    ("15m", 15 * 60),
+    ("12h", 12 * 3600),
+    ("2w", 14 * 86400),
+    ("6M", 180 * 86400),
+    ("1y", 365 * 86400),
+])
+def test_parse_age(value, expected):
+    assert parse_age(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "d", "1.5d", "10x", "1dd"])
+def test_parse_age_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_age(value)
@@ -0,0 +1,21 @@
+import builtins
+
+from utils.validation import get_size_input
+
+
+def answer(monkeypatch, replies):
+    replies = iter(replies)
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(replies))
+
+
+def test_size_input_retries_until_the_size_parses(monkeypatch, capsys):
+    answer(monkeypatch, ["1.5M", "0", "abc", " 512K "])
+    assert get_size_input("Bundle size", "64M") == "512K"
+    output = capsys.readouterr().out
+    assert output.count("Invalid size") == 2
+    assert "at least 1 byte" in output
+
+
+def test_size_input_default(monkeypatch):
+    answer(monkeypatch, [""])
+    assert get_size_input("Bundle size", "64M") == "64M"
@@ -0,0 +1,155 @@
+import fcntl
+import json
+import os
+import select
+import sys
+import time
+
+import pytest
+
+from pipeline import watch
+from pipeline.file_index import apply_dirty, snapshot_tree
+from pipeline.watch import (
+    JOURNAL_FILE, PID_FILE, RESCAN, STATE_FILE, SYNC_FILE, Watcher, append_journal, changed_files, release, take,
+)
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+
+
+def make_tree(root, files):
+    for rel_path, data in files.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(data)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def fake_watcher(tmp_path):
+    """Pretend a watcher for `src` is running: hold its PID lock and mark it ready."""
+    state = tmp_path / "state"
+    state.mkdir()
+    source = str(tmp_path / "src")
+    lock = open(state / PID_FILE, "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    (state / STATE_FILE).write_text(json.dumps({"pid": os.getpid(), "source": source, "ready": time.time() - 10}))
+    yield state, source
+    lock.close()
+
+
+def test_take_needs_a_watcher_covering_the_last_run(fake_watcher, tmp_path):
+    state, source = fake_watcher
+    # The watcher was not ready before the first run
+    assert take(state, source) is None
+    release(state)
+
+    append_journal(state, {"a.txt", "dir"})
+    assert take(state, source) == {"a.txt", "dir"}
+    release(state)
+    assert take(state, source) == set()
+    assert take(state, str(tmp_path / "other")) is None
+
+
+def test_failed_runs_keep_their_paths(fake_watcher):
+    state, source = fake_watcher
+    take(state, source)
+    release(state)
+
+    append_journal(state, {"a.txt"})
+    assert take(state, source) == {"a.txt"}
+    # No release: the next run sees the same paths again, plus new ones
+    append_journal(state, {"b.txt"})
+    assert take(state, source) == {"a.txt", "b.txt"}
+
+
+def test_lost_events_ask_for_a_rescan(fake_watcher):
+    state, source = fake_watcher
+    take(state, source)
+    release(state)
+    append_journal(state, {"a.txt", RESCAN})
+    assert take(state, source) is None
+
+
+def test_no_watcher_means_rescan(tmp_path):
+    state = tmp_path / "state"
+    state.mkdir()
+    assert take(state, str(tmp_path)) is None
+    assert json.loads((state / SYNC_FILE).read_text())["taking"]
+
+
+def test_changed_files_skips_directories_and_deleted_paths(tmp_path):
+    make_tree(tmp_path, {"a.txt": "a", "dir/b.txt": "b"})
+    assert changed_files(str(tmp_path), {"a.txt", "dir", "dir/b.txt", "gone.txt"}) == ["a.txt", "dir/b.txt"]
+
+
+@linux_only
+def test_watcher_journals_changes(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    state.mkdir()
+    make_tree(source, {"a.txt": "a", "dir/b.txt": "b"})
+    watcher = Watcher(str(source), state)
+    watcher._add_tree("", mark=False)
+
+    (source / "a.txt").write_text("changed")
+    (source / "dir" / "b.txt").unlink()
+    make_tree(source, {"new/deep/c.txt": "c"})
+    poller = select.poll()
+    poller.register(watcher.inotify.fd, select.POLLIN)
+    while poller.poll(200):
+        for event in watcher.inotify.read_events():
+            watcher._handle(*event)
+
+    assert {"a.txt", "dir", "dir/b.txt", "new"} <= watcher.dirty
+    watcher.flush()
+    assert "new" in (state / JOURNAL_FILE).read_bytes().decode().split("\0")
+
+
+@linux_only
+def test_background_watcher(tmp_path):
+    source, state = tmp_path / "src", tmp_path / "state"
+    make_tree(source, {"a.txt": "a"})
+    assert watch.start(state, str(source))
+    try:
+        wait_for(lambda: watch._load_json(state / STATE_FILE).get("ready"))
+        assert not watch.start(state, str(source))
+        assert take(state, str(source)) is None
+        release(state)
+
+        (source / "a.txt").write_text("changed")
+        wait_for(lambda: (state / JOURNAL_FILE).exists())
+        assert take(state, str(source)) == {"a.txt"}
+    finally:
+        assert watch.stop(state)
+    wait_for(lambda: not watch.running(state))
+
+
+def test_apply_dirty_reads_only_the_dirty_paths(tmp_path):
+    make_tree(tmp_path, {"a.txt": "a", "b.txt": "b", "old/x.txt": "x"})
+    previous = snapshot_tree(str(tmp_path))
+
+    (tmp_path / "a.txt").write_text("changed")
+    (tmp_path / "b.txt").write_text("also changed, but not reported")
+    (tmp_path / "old" / "x.txt").unlink()
+    (tmp_path / "old").rmdir()
+    make_tree(tmp_path, {"new/deep/c.txt": "c"})
+
+    current, changed, deleted = apply_dirty(str(tmp_path), previous, {"a.txt", "old", "new"})
+    assert changed == ["a.txt", "new", "new/deep", "new/deep/c.txt"]
+    assert deleted == ["old", "old/x.txt"]
+    assert current["b.txt"] == previous["b.txt"]
+    assert "old/x.txt" not in current
+
+
+def test_apply_dirty_honours_exclusions(tmp_path):
+    make_tree(tmp_path, {"keep.txt": "k"})
+    previous = snapshot_tree(str(tmp_path))
+    make_tree(tmp_path, {"cache/x.bin": "x", "keep.txt": "kk"})
+
+    _, changed, _ = apply_dirty(str(tmp_path), previous, {"keep.txt", "cache"}, exclude=frozenset({"cache"}))
+    assert changed == ["keep.txt"]
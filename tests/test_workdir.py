@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+import time
+
+from pipeline.workdir import OWNER_FILE, RESUME_FILE, RESUME_GRACE, UNCLAIMED_GRACE, adopt, claim, owner_alive, sweep
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_claim_marks_the_owner(tmp_path):
+    work_dir = tmp_path / "job" / "run-1"
+    claim(work_dir, os.getpid())
+    assert (work_dir / OWNER_FILE).read_text().split()[0] == str(os.getpid())
+    assert owner_alive(work_dir)
+
+    claim(work_dir, dead_pid())
+    assert not owner_alive(work_dir)
+
+
+def test_recycled_pid_is_not_the_owner(tmp_path):
+    work_dir = tmp_path / "job" / "run-1"
+    work_dir.mkdir(parents=True)
+    (work_dir / OWNER_FILE).write_text(f"{os.getpid()} 1\n")
+    assert not owner_alive(work_dir)
+
+
+def test_sweep_removes_only_dead_runs(tmp_path):
+    live, dead, unclaimed, stale = (tmp_path / "job" / name for name in ("live", "dead", "unclaimed", "stale"))
+    claim(live, os.getpid())
+    claim(dead, dead_pid())
+    unclaimed.mkdir()
+    stale.mkdir()
+    old = time.time() - UNCLAIMED_GRACE - 60
+    os.utime(stale, (old, old))
+
+    assert sorted(sweep(tmp_path)) == sorted([dead, stale])
+    assert live.is_dir() and unclaimed.is_dir()
+
+
+def test_sweep_removes_empty_job_directories(tmp_path):
+    claim(tmp_path / "job" / "run", dead_pid())
+    sweep(tmp_path)
+    assert not (tmp_path / "job").exists()
+    assert sweep(tmp_path / "missing") == []
+
+
+def resumable(run_dir, pid):
+    claim(run_dir, pid)
+    (run_dir / RESUME_FILE).write_text("{}")
+
+
+def test_adopt_takes_over_the_newest_dead_resumable_cache(tmp_path):
+    job = tmp_path / "job"
+    older, newer, busy = job / "restore-cache-1", job / "restore-cache-2", job / "restore-cache-3"
+    resumable(older, dead_pid())
+    resumable(newer, dead_pid())
+    resumable(busy, os.getpid())
+    os.utime(older, (time.time() - 60, time.time() - 60))
+    (newer / "backup-part-000").write_text("data")
+
+    work_dir = job / "restore-cache-4"
+    adopt(work_dir, os.getpid(), "restore-cache")
+    assert (work_dir / "backup-part-000").exists()
+    assert not newer.exists() and older.exists() and busy.exists()
+    assert owner_alive(work_dir)
+
+
+def test_adopt_without_candidates_claims_a_new_directory(tmp_path):
+    work_dir = tmp_path / "job" / "restore-cache-1"
+    adopt(work_dir, os.getpid(), "restore-cache")
+    assert owner_alive(work_dir)
+    assert list(work_dir.iterdir()) == [work_dir / OWNER_FILE]
+
+
+def test_sweep_keeps_resumable_caches(tmp_path):
+    cache = tmp_path / "job" / "restore-cache-1"
+    resumable(cache, dead_pid())
+    assert sweep(tmp_path) == []
+    old = time.time() - RESUME_GRACE - 60
+    os.utime(cache / RESUME_FILE, (old, old))
+    assert sweep(tmp_path) == [cache]
@@ -8,11 +8,14 @@ from .commands import run_command, run_script
 from .validation import (
     get_user_choice,
     get_int_input,
+    get_cores_input,
+    get_size_input,
     get_yes_no,
     confirm_action,
     validate_flag_value
 )
 from .matrix_ui import MatrixUI, MatrixColors
+from .rclone_rc import RcClient, RcError, get_client
 
 __all__ = [
     'Colors',
@@ -23,9 +26,14 @@ __all__ = [
     'run_script',
     'get_user_choice',
     'get_int_input',
+    'get_cores_input',
+    'get_size_input',
     'get_yes_no',
     'confirm_action',
     'validate_flag_value',
     'MatrixUI',
     'MatrixColors',
+    'RcClient',
+    'RcError',
+    'get_client',
 ]
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+rclone remote control (rcd) backend for BackupBuddy.
+
+Instead of spawning `sudo sh -c "rclone ..."` for every listing, one
+long-lived `rclone rcd` serves the whole session. It reads the rclone config
+and authenticates with each remote once; later calls go over a kept-alive
+HTTP connection to its JSON API.
+
+The daemon listens on a Unix socket in a private directory when BackupBuddy
+runs as root; otherwise it is started through sudo (so it sees the same
+rclone config as run_command) on a loopback port. A root-owned socket
+could not be opened by the user, so that port is protected by a random
+password, passed to rclone as an htpasswd file in the private directory
+rather than on its command line, where any local user could read it.
+
+The backend is optional: set BACKUPBUDDY_RCLONE_BACKEND=rcd to use it.
+get_client() returns None when it is disabled or the daemon cannot be
+started, and callers fall back to the rclone command line.
+"""
+
+import atexit
+import base64
+import hashlib
+import http.client
+import json
+import os
+import secrets
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.display import Colors
+
+BACKEND_ENV = "BACKUPBUDDY_RCLONE_BACKEND"
+BACKEND_RCD = "rcd"
+SOCKET_NAME = "rcd.sock"
+HTPASSWD_NAME = "htpasswd"
+START_TIMEOUT = 15
+CALL_TIMEOUT = 300
+
+
+class RcError(Exception):
+    """An rclone remote control call failed."""
+
+    def __init__(self, method: str, message: str, status: int = 0):
+        super().__init__(f"{method}: {message}")
+        self.method = method
+        self.status = status
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket."""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RcClient:
+    """JSON client for a running rclone rcd, reusing one connection."""
+
+    def __init__(self, socket_path: Optional[str] = None, port: Optional[int] = None,
+                 user: Optional[str] = None, password: Optional[str] = None, timeout: float = CALL_TIMEOUT):
+        if socket_path:
+            self._connect = lambda: _UnixHTTPConnection(socket_path, timeout)
+        else:
+            self._connect = lambda: http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        self._headers = {"Content-Type": "application/json"}
+        if user:
+            token = base64.b64encode(f"{user}:{password}".encode()).decode()
+            self._headers["Authorization"] = f"Basic {token}"
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def call(self, method: str, **params) -> Dict:
+        """
+        Call an rc method and return its JSON result.
+
+        Args:
+            method: rc method, e.g. "operations/list"
+            **params: Method parameters
+
+        Returns:
+            The decoded response
+
+        Raises:
+            RcError: If rclone reports an error
+            OSError: If the daemon cannot be reached
+        """
+        body = json.dumps(params).encode()
+        with self._lock:
+            # A kept-alive connection may have been closed by the daemon; reconnect once
+            for attempt in range(2):
+                if self._connection is None:
+                    self._connection = self._connect()
+                try:
+                    self._connection.request("POST", f"/{method}", body, self._headers)
+                    response = self._connection.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    self._connection.close()
+                    self._connection = None
+                    if attempt:
+                        raise
+
+        try:
+            result = json.loads(data or b"{}")
+        except ValueError:
+            result = {"error": data.decode(errors="replace")}
+        if response.status != 200:
+            raise RcError(method, result.get("error") or response.reason, response.status)
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def list_remotes(self) -> List[str]:
+        """Return the configured remotes as `name:` strings, like `rclone listremotes`."""
+        return [f"{name}:" for name in self.call("config/listremotes").get("remotes") or []]
+
+    def list_dirs(self, path: str) -> List[str]:
+        """Return the names of the directories directly inside `path` (remote:dir)."""
+        result = self.call("operations/list", fs=path, remote="", opt={"dirsOnly": True})
+        return [item["Name"] for item in result.get("list") or []]
+
+    def mkdir(self, path: str) -> None:
+        """Create the directory `path` (remote:dir)."""
+        self.call("operations/mkdir", fs=path, remote="")
+
+
+def _write_htpasswd(path: str, user: str, password: str) -> None:
+    """Write an htpasswd file readable only by its owner (rclone accepts {SHA} entries)."""
+    digest = base64.b64encode(hashlib.sha1(password.encode()).digest()).decode()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as file:
+        file.write(f"{user}:{{SHA}}{digest}\n")
+
+
+class RcloneDaemon:
+    """An `rclone rcd` process owned by this session."""
+
+    def __init__(self):
+        self.process = None  # type: Optional[subprocess.Popen]
+        self.client = None  # type: Optional[RcClient]
+        self._private_dir = None  # type: Optional[str]
+
+    def start(self) -> RcClient:
+        """
+        Start the daemon and wait until it answers.
+
+        Returns:
+            A client connected to it
+
+        Raises:
+            OSError: If rclone cannot be started or does not come up in time
+        """
+        # mkdtemp creates the directory with mode 0700
+        self._private_dir = tempfile.mkdtemp(prefix="backupbuddy-rcd-")
+        if os.geteuid() == 0:
+            socket_path = os.path.join(self._private_dir, SOCKET_NAME)
+            command = ["rclone", "rcd", "--rc-addr", f"unix://{socket_path}", "--rc-no-auth"]
+            client = RcClient(socket_path=socket_path)
+        else:
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+            user, password = "backupbuddy", secrets.token_urlsafe(24)
+            htpasswd = os.path.join(self._private_dir, HTPASSWD_NAME)
+            _write_htpasswd(htpasswd, user, password)
+            command = ["sudo", "rclone", "rcd", "--rc-addr", f"127.0.0.1:{port}", "--rc-htpasswd", htpasswd]
+            client = RcClient(port=port, user=user, password=password)
+
+        self.process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL)
+        deadline = time.time() + START_TIMEOUT
+        while True:
+            try:
+                client.call("rc/noop")
+                break
+            except (OSError, http.client.HTTPException, RcError):
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.stop()
+                    raise OSError("rclone rcd did not start")
+                time.sleep(0.1)
+
+        self.client = client
+        return client
+
+    def stop(self) -> None:
+        """Ask the daemon to quit and wait for it; kill it if it does not."""
+        if self.client is not None:
+            try:
+                self.client.call("core/quit")
+            except (OSError, http.client.HTTPException, RcError):
+                pass
+            self.client.close()
+            self.client = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+                self.process.wait()
+            self.process = None
+        if self._private_dir:
+            shutil.rmtree(self._private_dir, ignore_errors=True)
+            self._private_dir = None
+
+
+_daemon = None  # type: Optional[RcloneDaemon]
+_failed = False
+_start_lock = threading.Lock()
+
+
+def get_client() -> Optional[RcClient]:
+    """
+    Return a client of the session's rclone daemon, starting it on first use.
+
+    Returns:
+        None if the rcd backend is not enabled or the daemon failed to start
+    """
+    global _daemon, _failed
+    if os.environ.get(BACKEND_ENV) != BACKEND_RCD:
+        return None
+    with _start_lock:
+        if _failed:
+            return None
+        if _daemon is None:
+            daemon = RcloneDaemon()
+            try:
+                daemon.start()
+            except OSError as e:
+                print(f"{Colors.YELLOW}{e}; using the rclone command line instead{Colors.RESET}")
+                _failed = True
+                return None
+            _daemon = daemon
+            atexit.register(daemon.stop)
+        return _daemon.client
@@ -3,7 +3,8 @@
 Input validation utilities for BackupBuddy.
 """
 
-from typing import List, Optional
+from typing import List, Optional, Union
+from pipeline.units import parse_size
 from utils.display import Colors
 
 
@@ -75,6 +76,61 @@ def get_int_input(
             print(f"{Colors.RED}Invalid input. Please enter a number.{Colors.RESET}")
 
 
+def get_cores_input(prompt: str, default: Union[int, str] = "auto") -> Union[int, str]:
+    """
+    Get a CPU core count, or "auto" to size it when the job runs.
+    
+    Args:
+        prompt: Message to display
+        default: Default value if user presses Enter
+    
+    Returns:
+        Positive integer or "auto"
+    """
+    while True:
+        user_input = input(f"{prompt}: ").strip().lower()
+        
+        if not user_input:
+            return default
+        if user_input == "auto":
+            return user_input
+        
+        try:
+            value = int(user_input)
+            if value < 1:
+                print(f"{Colors.RED}Value must be at least 1.{Colors.RESET}")
+                continue
+            return value
+        except ValueError:
+            print(f"{Colors.RED}Invalid input. Please enter a number or 'auto'.{Colors.RESET}")
+
+
+def get_size_input(prompt: str, default: str) -> str:
+    """
+    Get a size such as '256K' or '64M', checked the way the generated scripts parse it.
+    
+    Args:
+        prompt: Message to display
+        default: Default value if user presses Enter
+    
+    Returns:
+        The size as entered
+    """
+    while True:
+        user_input = input(f"{prompt}: ").strip()
+        
+        if not user_input:
+            return default
+        
+        try:
+            if parse_size(user_input) < 1:
+                print(f"{Colors.RED}Size must be at least 1 byte.{Colors.RESET}")
+                continue
+            return user_input
+        except ValueError:
+            print(f"{Colors.RED}Invalid size. Use a whole number with an optional unit (K, M, G, T, KB, MB, ...).{Colors.RESET}")
+
+
 def get_yes_no(prompt: str, default: bool = False) -> bool:
     """
     Get yes/no answer from user.